@@ -5,9 +5,11 @@ from sqlalchemy import select
 
 from app.core.database import get_db
 from app.services.user_service import UserService
+from app.services.auth_user_cache import auth_user_cache
 from app.models.user import User
 from app.core.logger import get_logger
 from app.core.security import require_admin
+from app.core.user_types import VALID_USER_TYPES
 
 router = APIRouter(prefix="/admin")
 logger = get_logger("admin_api")
@@ -46,14 +48,14 @@ async def admin_assign_user_type(payload: AdminAssignRequest, db: AsyncSession =
             # 自动为 Lihan 设置 founder 权限
             admin_user.user_type = "founder"
             await db.commit()
+            auth_user_cache.invalidate(username=admin_user.username, user_id=admin_user.id)
             logger.info(f"Auto-promoted Lihan to founder")
         else:
             raise HTTPException(status_code=403, detail="管理员无权限")
 
     # 2) 校验 user_type 合法
-    valid_types = ["founder", "time_master", "spark_partner"]
     desired_type = payload.user_type.strip()
-    if desired_type not in valid_types:
+    if desired_type not in VALID_USER_TYPES:
         raise HTTPException(status_code=400, detail="无效的用户类型")
 
     # 3) 查询目标用户
@@ -69,6 +71,7 @@ async def admin_assign_user_type(payload: AdminAssignRequest, db: AsyncSession =
         await db.refresh(target_user)
     except Exception:
         pass
+    auth_user_cache.invalidate(username=target_user.username, user_id=target_user.id)
 
     logger.info(f"Admin assigned user_type: {target_user.username} -> {target_user.user_type} by {admin_user.username}")
     return {"ok": True, "username": target_user.username, "user_type": target_user.user_type}
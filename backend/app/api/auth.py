@@ -12,6 +12,7 @@ sys.path.append(str(project_root))
 
 from app.core.database import get_db
 from app.core.security import create_access_token, get_current_user
+from app.services.auth_user_cache import auth_user_cache
 from app.schemas.user import UserCreate, UserResponse, Token, UserLogin
 from app.services.user_service import UserService
 from app.core.config import settings
@@ -97,12 +98,18 @@ async def update_current_user_info(
     for k in list(payload.keys()):
         if k not in allowed:
             payload.pop(k)
+    # current_user 是缓存的只读快照，修改前从数据库重新加载
+    user = await UserService(db).get_user_by_id(current_user.id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="用户不存在")
     if "username" in payload:
-        current_user.username = payload["username"].strip()
+        user.username = payload["username"].strip()
     try:
         await db.commit()
-        await db.refresh(current_user)
+        await db.refresh(user)
     except Exception:
         await db.rollback()
         raise HTTPException(status_code=400, detail="更新失败，可能与其他用户冲突")
-    return current_user
\ No newline at end of file
+    # 旧用户名签发的 token 不再对应该用户
+    auth_user_cache.invalidate(username=current_user.username, user_id=current_user.id)
+    return user
\ No newline at end of file
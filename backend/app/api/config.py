@@ -15,10 +15,11 @@ router = APIRouter()
 CONFIG_FILE = Path(__file__).parent.parent.parent / "runtime_config.json"
 
 class SystemConfig(BaseModel):
-    coze: Dict[str, str]
+    # coze / tripo / sora 除单个 key 外还可包含 key 列表（authorizations / apiKeys）
+    coze: Dict[str, Any]
     bots: Dict[str, str]
-    tripo: Dict[str, str]
-    sora: Dict[str, str]
+    tripo: Dict[str, Any]
+    sora: Dict[str, Any]
 
 class ConfigResponse(BaseModel):
     success: bool
@@ -0,0 +1,124 @@
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from pathlib import Path
+from typing import Literal, Optional
+import sys
+
+current_file = Path(__file__).resolve()
+project_root = current_file.parent.parent.parent
+sys.path.append(str(project_root))
+
+from app.core.logger import get_logger
+from app.core.crypto import seal_secret
+from app.core.security import get_current_user, tier_of
+from app.services.credential_pool import sora_credentials
+from app.services.generation_jobs import job_queue
+from app.services.quota_admission import quota_admission
+from app.utils.upload_store import upload_store
+
+logger = get_logger(service="jobs_api")
+
+router = APIRouter()
+
+
+async def _enqueue(kind: str, params: dict, image_path: str, current_user) -> str:
+    """
+    检查额度后入队；队列中未完成的任务计入占用。
+    任务在 worker 中成功后才计入使用次数（task_id 为 job_id），最终失败的任务不计数。
+    """
+    user_id = current_user.id
+    outstanding = await job_queue.outstanding(user_id) if quota_admission.enforced else 0
+    reservation = await quota_admission.reserve(current_user, kind, outstanding=outstanding)
+    try:
+        return await job_queue.enqueue(kind, params, image_path=image_path, user_id=user_id)
+    finally:
+        # 入队后任务本身即代表占用，不再保留进程内的预留
+        quota_admission.release(reservation)
+
+
+def _sora_credential(auth_key: Optional[str]) -> dict:
+    """调用方指定的 key 不明文落库：池中的 key 只保存引用，其他 key 加密保存"""
+    if not auth_key:
+        return {}
+    ref = sora_credentials.ref(auth_key)
+    if ref is not None:
+        return {"auth_key_ref": ref}
+    return {"auth_key_sealed": seal_secret(auth_key)}
+
+
+async def _store_image(file: UploadFile) -> str:
+    content_type = (file.content_type or "").lower()
+    if not content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="仅支持图片文件上传")
+    stored = await upload_store.put_upload(file)
+    return stored.relative_path
+
+
+async def queue_sora_job(
+    file: UploadFile,
+    current_user,
+    prompt: str,
+    model: str = "sora_image",
+    n: int = 1,
+    size: str = "1024x1024",
+    strength: float = 0.8,
+    auth_key: Optional[str] = None,
+    upload_mode: Optional[str] = None,
+) -> dict:
+    """保存图片并放入 Sora 任务队列，返回 job_id（/api/jobs/sora 与 /sora/image-to-image 共用）"""
+    if current_user is None:
+        raise HTTPException(status_code=401, detail="请先登录", headers={"WWW-Authenticate": "Bearer"})
+    image_path = await _store_image(file)
+    params = {
+        "prompt": prompt,
+        "model": model,
+        "n": n,
+        "size": size,
+        "strength": strength,
+        "upload_mode": upload_mode,
+        "tier": tier_of(current_user),
+        **_sora_credential(auth_key),
+    }
+    job_id = await _enqueue("sora", params, image_path, current_user)
+    logger.info(f"Sora job queued: {job_id}")
+    return {"job_id": job_id, "status": "queued"}
+
+
+async def queue_tripo_job(file: UploadFile, current_user) -> dict:
+    """保存图片并放入 Tripo 任务队列，返回 job_id（/api/jobs/tripo 与 /3d-generation/submit 共用）"""
+    if current_user is None:
+        raise HTTPException(status_code=401, detail="请先登录", headers={"WWW-Authenticate": "Bearer"})
+    image_path = await _store_image(file)
+    job_id = await _enqueue("tripo", {"tier": tier_of(current_user)}, image_path, current_user)
+    logger.info(f"Tripo job queued: {job_id}")
+    return {"job_id": job_id, "status": "queued"}
+
+
+@router.post("/jobs/sora")
+async def submit_sora_job(
+    prompt: str,
+    file: UploadFile = File(...),
+    model: str = "sora_image",
+    n: int = 1,
+    size: str = "1024x1024",
+    strength: float = 0.8,
+    auth_key: Optional[str] = None,
+    upload_mode: Optional[Literal["base64", "multipart"]] = None,
+    current_user = Depends(get_current_user),
+):
+    """提交 Sora 图生图任务，立即返回 job_id；worker 异步提交上游，任务结果为上游 task_id"""
+    return await queue_sora_job(file, current_user, prompt, model, n, size, strength, auth_key, upload_mode)
+
+
+@router.post("/jobs/tripo")
+async def submit_tripo_job(file: UploadFile = File(...), current_user = Depends(get_current_user)):
+    """提交 Tripo 图生 3D 任务，立即返回 job_id"""
+    return await queue_tripo_job(file, current_user)
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user = Depends(get_current_user)):
+    """查询任务状态与结果；只能查询自己提交的任务"""
+    job = await job_queue.get(job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Depends
+
+from app.core.metrics import metrics
+from app.core.security import require_admin
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def get_metrics(current_user = Depends(require_admin)):
+    """获取当前 worker 的运行指标（仅管理员可访问）"""
+    return metrics.snapshot()
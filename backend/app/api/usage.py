@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, insert
+from sqlalchemy import select
 from pathlib import Path
 import sys
 
@@ -10,8 +10,12 @@ sys.path.append(str(project_root))
 
 from app.core.database import get_db
 from app.core.security import get_current_user, require_admin
-from app.models.usage import UsageCounter, UsageTask
+from app.core.user_types import DEFAULT_USER_TYPE, VALID_USER_TYPES, user_type_config
+from app.models.usage import UsageCounter
 from app.models.user import User
+from app.services.auth_user_cache import auth_user_cache
+from app.services.quota_admission import quota_admission
+from app.services.usage_service import UsageService
 
 router = APIRouter()
 
@@ -22,15 +26,8 @@ async def get_usage(db: AsyncSession = Depends(get_db), current_user: User = Dep
     row = result.scalar_one_or_none()
     used = int(row.used_count) if row else 0
     
-    # 用户类型配置
-    USER_TYPE_CONFIG = {
-        "founder": {"name": "创始人", "maxUsage": float('inf'), "color": "#FF6B6B"},
-        "time_master": {"name": "时光主理人", "maxUsage": 100, "color": "#4A90E2"},
-        "spark_partner": {"name": "星火合伙人", "maxUsage": 7, "color": "#7ED321"}
-    }
-    
-    user_type = current_user.user_type or "spark_partner"
-    config = USER_TYPE_CONFIG.get(user_type, USER_TYPE_CONFIG["spark_partner"])
+    user_type = current_user.user_type or DEFAULT_USER_TYPE
+    config = user_type_config(user_type)
     
     # 计算剩余次数
     if config["maxUsage"] == float('inf'):
@@ -66,28 +63,47 @@ async def increment_usage(payload: dict, db: AsyncSession = Depends(get_db), cur
     if not task_id or not service_type:
         raise HTTPException(status_code=400, detail="task_id 和 service_type 必填")
 
-    # 1) 先尝试记录任务（幂等：task_id 唯一约束）
-    try:
-        await db.execute(insert(UsageTask).values(user_id=current_user.id, task_id=task_id, service_type=service_type))
-        await db.commit()
-    except Exception:
-        # 已记录则不重复计数
-        await db.rollback()
+    # 任务记录与计数在同一事务中完成（幂等：task_id 唯一约束，已记录则不重复计数）
+    record = await UsageService(db).record_task(current_user.id, task_id, service_type)
+    if not record.counted:
         return {"ok": True, "dedup": True}
-
-    # 2) 更新使用次数（不存在则插入 0 再 +1）
-    result = await db.execute(select(UsageCounter).where(UsageCounter.user_id == current_user.id))
-    row = result.scalar_one_or_none()
-    if not row:
-        await db.execute(insert(UsageCounter).values(user_id=current_user.id, used_count=1))
-        await db.commit()
-        return {"ok": True, "used": 1}
-    else:
-        old_count = int(row.used_count or 0)
-        row.used_count = old_count + 1
-        await db.commit()
-        print(f"User {current_user.username} usage incremented: {old_count} -> {row.used_count}")
-        return {"ok": True, "used": row.used_count}
+    quota_admission.invalidate(current_user.id)
+    return {"ok": True, "used": record.used}
+
+
+# 批量记账单次最多的任务数
+USAGE_BATCH_MAX_TASKS = 500
+
+
+@router.post("/usage/increment/batch")
+async def increment_usage_batch(payload: dict, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    批量补记任务（对账用）：{"tasks": [{"task_id": "...", "service_type": "sora"}, ...]}
+    已记录过的 task_id 不重复计数。
+    """
+    tasks = payload.get("tasks")
+    if not isinstance(tasks, list) or not tasks:
+        raise HTTPException(status_code=400, detail="tasks 必须为非空列表")
+    if len(tasks) > USAGE_BATCH_MAX_TASKS:
+        raise HTTPException(status_code=400, detail=f"单次最多 {USAGE_BATCH_MAX_TASKS} 个任务")
+
+    items = []
+    for task in tasks:
+        task_id = (str(task.get("task_id") or "") if isinstance(task, dict) else "").strip()
+        service_type = (str(task.get("service_type") or "") if isinstance(task, dict) else "").strip()
+        if not task_id or not service_type:
+            raise HTTPException(status_code=400, detail="task_id 和 service_type 必填")
+        items.append((task_id, service_type))
+
+    record = await UsageService(db).record_tasks(current_user.id, items)
+    if record.counted:
+        quota_admission.invalidate(current_user.id)
+    return {
+        "ok": True,
+        "counted": record.counted,
+        "dedup": record.dedup,
+        "used": record.used,
+    }
 
 
 @router.put("/usage/user-type")
@@ -97,13 +113,16 @@ async def update_user_type(payload: dict, db: AsyncSession = Depends(get_db), cu
     new_user_type = payload.get("user_type", "").strip()
     
     # 验证用户类型
-    valid_types = ["founder", "time_master", "spark_partner"]
-    if new_user_type not in valid_types:
+    if new_user_type not in VALID_USER_TYPES:
         raise HTTPException(status_code=400, detail="无效的用户类型")
     
     # 如果没有指定用户名，则更新当前用户
     if not target_username:
-        target_user = current_user
+        # current_user 是缓存的只读快照，修改前从数据库重新加载
+        result = await db.execute(select(User).where(User.id == current_user.id))
+        target_user = result.scalar_one_or_none()
+        if not target_user:
+            raise HTTPException(status_code=404, detail="用户不存在")
     else:
         # 查找目标用户
         result = await db.execute(select(User).where(User.username == target_username))
@@ -118,6 +137,7 @@ async def update_user_type(payload: dict, db: AsyncSession = Depends(get_db), cu
         await db.refresh(target_user)
     except Exception:
         pass
+    auth_user_cache.invalidate(username=target_user.username, user_id=target_user.id)
     
     # 标准日志，避免使用 print 被进程管理器吞掉
     try:
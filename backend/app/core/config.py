@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings
 from enum import Enum
 from pathlib import Path
+from typing import Dict, List
 import json
 import os
 
@@ -18,6 +19,59 @@ class Settings(BaseSettings):
 	# COZE BASE_URL 
 	COZE_BASE_URL: str = ""
 	COZE_AUTHORIZATION: str = ""
+	# 多个 Coze token 组成凭据池（需属于同一空间，以便共享 bot 与已上传的文件）
+	COZE_AUTHORIZATIONS: List[str] = []
+	# 凭据池中返回 429 的 key 的冷却时间（秒，上游返回 Retry-After 时以其为准）
+	CREDENTIAL_COOLDOWN_SECONDS: float = 30.0
+
+	# COZE 共享客户端连接池
+	COZE_MAX_CONNECTIONS: int = 100
+	COZE_MAX_KEEPALIVE_CONNECTIONS: int = 20
+	COZE_KEEPALIVE_EXPIRY: float = 60.0
+	COZE_TIMEOUT_SECONDS: float = 600.0
+	# 客户端提前断开时取消 Coze 对话的超时（秒），取消为尽力而为
+	COZE_CANCEL_TIMEOUT_SECONDS: float = 5.0
+
+	# 图片分析结果缓存（按图片内容 SHA-256），ANALYSIS_CACHE_DIR 为空时只使用内存缓存
+	ANALYSIS_CACHE_TTL_SECONDS: int = 86400
+	ANALYSIS_CACHE_MAX_ENTRIES: int = 1024
+	ANALYSIS_CACHE_DIR: str = ""
+	# 磁盘层定期清理：间隔（秒），以及总大小上限（字节，超出时从最旧的开始删除，0 表示不限制）
+	ANALYSIS_CACHE_SWEEP_INTERVAL_SECONDS: int = 3600
+	ANALYSIS_CACHE_DISK_MAX_BYTES: int = 256 * 1024 * 1024
+
+	# Coze file_id 复用缓存（本地 SQLite，多 worker 共享），有效期略短于 Coze 文件保留期（3 个月）
+	COZE_FILE_CACHE_DB: str = "cache/coze_files.sqlite3"
+	COZE_FILE_CACHE_TTL_SECONDS: int = 80 * 24 * 3600
+
+	# 上传文件：分块读写大小与单文件大小上限（字节）
+	UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+	UPLOAD_MAX_BYTES: int = 20 * 1024 * 1024
+	# 内容寻址上传存储的索引（不能放在 uploads 目录下，以免被静态资源挂载暴露）
+	UPLOAD_INDEX_DB: str = "cache/uploads_index.sqlite3"
+	# 上传暂存目录：同样不能放在 uploads 下，且需与 uploads 位于同一文件系统（落盘时原子重命名）
+	UPLOAD_INCOMING_DIR: str = "cache/uploads_incoming"
+
+	# 发送到上游前的图片规范化（需要 Pillow，未安装时原样发送）：按服务商限制最长边、去除 EXIF、按方向旋转并重新编码
+	IMAGE_NORMALIZE_ENABLED: bool = True
+	IMAGE_NORMALIZE_WORKERS: int = 2
+	IMAGE_NORMALIZE_CACHE_DIR: str = "cache/normalized"
+	# 规范化缓存定期清理：间隔（秒）、未使用多久后删除（秒），以及总大小上限（字节，超出时从最久未使用的开始删除，0 表示不限制）
+	IMAGE_NORMALIZE_CACHE_SWEEP_INTERVAL_SECONDS: int = 3600
+	IMAGE_NORMALIZE_CACHE_MAX_AGE_SECONDS: int = 7 * 86400
+	IMAGE_NORMALIZE_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024
+	# 输出格式 jpeg / webp / png（带透明通道的图片总是使用 png）
+	IMAGE_NORMALIZE_FORMAT: str = "jpeg"
+	IMAGE_NORMALIZE_QUALITY: int = 88
+	IMAGE_MAX_EDGE_COZE: int = 1568
+	IMAGE_MAX_EDGE_SORA: int = 2048
+	IMAGE_MAX_EDGE_TRIPO: int = 2048
+
+	# SSE 增量合并：时间窗口（毫秒，0 表示逐条发送）与缓冲字节阈值；各接口可通过 coalesce_ms 参数覆盖
+	SSE_COALESCE_MS: int = 30
+	SSE_COALESCE_MAX_BYTES: int = 512
+	# 检测 SSE 客户端断开的轮询间隔（秒），断开后取消上游对话
+	SSE_DISCONNECT_POLL_SECONDS: float = 0.5
 
 	# 图片特征分析
 	PICTURE_ANALYSIS_BOT_ID: str = ""
@@ -56,10 +110,83 @@ class Settings(BaseSettings):
 
 	# Tripo
 	TRIPO_API_KEY: str = ""
+	# 多个 key 组成凭据池（与 TRIPO_API_KEY 合并去重），下同
+	TRIPO_API_KEYS: List[str] = []
 
 	# Sora 
 	SORA_BASE_URL: str = ""
 	SORA_API_KEY: str = ""
+	SORA_API_KEYS: List[str] = []
+	# Sora 共享客户端连接池（HTTP/2 需要安装 httpx[http2]）
+	SORA_HTTP2: bool = True
+	SORA_MAX_CONNECTIONS: int = 50
+	SORA_MAX_KEEPALIVE_CONNECTIONS: int = 10
+	SORA_KEEPALIVE_EXPIRY: float = 60.0
+	SORA_TIMEOUT_SECONDS: float = 300.0
+	# 图片发送方式：base64（内嵌在 JSON 中）或 multipart（文件流式发送，内存占用更低），可按请求覆盖
+	SORA_UPLOAD_MODE: str = "base64"
+	# 结果图片并发保存数
+	SORA_SAVE_CONCURRENCY: int = 4
+	# 异步任务的服务端轮询：初始间隔、最大间隔（秒）、状态不变时的退避倍数、最长跟踪时间与结束后保留时间
+	SORA_WATCH_INITIAL_INTERVAL: float = 2.0
+	SORA_WATCH_MAX_INTERVAL: float = 15.0
+	SORA_WATCH_BACKOFF: float = 1.5
+	SORA_WATCH_MAX_SECONDS: float = 30 * 60
+	SORA_WATCH_RETENTION_SECONDS: float = 10 * 60
+
+	# Sora / Tripo 任务状态缓存：进行中状态的缓存时间（秒）与内存中最多保留的任务数（已结束的任务同时持久化到数据库）
+	TASK_STATUS_PENDING_TTL_SECONDS: float = 2.0
+	TASK_STATUS_CACHE_MAX_ENTRIES: int = 4096
+	# 结果中带签名 URL（会过期）的已结束状态（如 Tripo 成功结果）：只在内存中缓存这么久，之后重新查询上游；数据库只保存去掉 URL 的状态
+	TASK_STATUS_SIGNED_URL_TTL_SECONDS: float = 300.0
+
+	# 生成任务队列（/api/jobs）：worker 数、租约时长（秒，崩溃后超时即被重新领取）、空闲轮询间隔、最大尝试次数与重试退避基数（秒）
+	JOB_WORKERS: int = 4
+	JOB_LEASE_SECONDS: float = 60.0
+	JOB_POLL_INTERVAL: float = 2.0
+	JOB_MAX_ATTEMPTS: int = 3
+	JOB_RETRY_BASE_SECONDS: float = 10.0
+	# /sora/image-to-image 与 /3d-generation/submit 默认放入任务队列并立即返回 job_id；为 True 时恢复在请求中同步调用上游的旧行为
+	GENERATION_SUBMIT_INLINE: bool = False
+
+	# 按用户档位加权分配上游并发名额：各上游的最大并发数，以及各档位的权重（未登录用户为 anonymous）
+	COZE_UPSTREAM_SLOTS: int = 32
+	SORA_UPSTREAM_SLOTS: int = 8
+	TRIPO_UPSTREAM_SLOTS: int = 4
+	USER_TIER_WEIGHTS: Dict[str, int] = {
+		"founder": 8,
+		"time_master": 4,
+		"spark_partner": 2,
+		"anonymous": 1,
+	}
+
+	# 调用上游（Sora / Tripo 计数，Coze 提示词生成只检查不计数）前的额度准入：是否强制检查，进程内计数的重新加载间隔（秒）
+	# 强制检查要求前端在生成请求中携带登录 token（frontend/src/api.js 已携带，需部署由其重新构建的 static/dist）
+	QUOTA_ENFORCED: bool = True
+	QUOTA_COUNTER_REFRESH_SECONDS: float = 30.0
+
+	# 上游调用保护：自适应并发上限（成功时加性增加，限流、失败或延迟超过阈值时乘性减小）、熔断与带抖动的重试
+	# 生成调用的上限作为 TierScheduler 的容量，最大为上面各上游的名额数；状态查询使用独立的上限与排队超时
+	RESILIENCE_MIN_LIMIT: int = 1
+	RESILIENCE_BACKOFF_FACTOR: float = 0.5
+	UPSTREAM_STATUS_POLL_SLOTS: int = 16
+	RESILIENCE_QUEUE_TIMEOUT_SECONDS: float = 30.0
+	COZE_LATENCY_THRESHOLD_SECONDS: float = 10.0
+	SORA_LATENCY_THRESHOLD_SECONDS: float = 15.0
+	TRIPO_LATENCY_THRESHOLD_SECONDS: float = 10.0
+	CIRCUIT_FAILURE_THRESHOLD: int = 5
+	CIRCUIT_RECOVERY_SECONDS: float = 30.0
+	UPSTREAM_RETRY_ATTEMPTS: int = 3
+	UPSTREAM_RETRY_BASE_SECONDS: float = 0.5
+	UPSTREAM_RETRY_MAX_SECONDS: float = 8.0
+
+	# bcrypt 密码哈希线程池：线程数，以及排队（含执行中）的最大任务数，超过时返回 503
+	PASSWORD_HASH_WORKERS: int = 4
+	PASSWORD_HASH_MAX_PENDING: int = 64
+
+	# 已认证用户缓存：有效期（秒，不超过 token 的剩余有效期）与最大条目数
+	AUTH_USER_CACHE_TTL_SECONDS: float = 60.0
+	AUTH_USER_CACHE_MAX_ENTRIES: int = 10000
 
 	# JWT settings
 	SECRET_KEY: str = "your secret key"
@@ -82,6 +209,7 @@ class Settings(BaseSettings):
 					coze_config = runtime_config['coze']
 					self.COZE_BASE_URL = coze_config.get('baseUrl', self.COZE_BASE_URL)
 					self.COZE_AUTHORIZATION = coze_config.get('authorization', self.COZE_AUTHORIZATION)
+					self.COZE_AUTHORIZATIONS = coze_config.get('authorizations', self.COZE_AUTHORIZATIONS)
 				
 				# 更新Bot配置
 				if 'bots' in runtime_config:
@@ -100,11 +228,13 @@ class Settings(BaseSettings):
 				if 'tripo' in runtime_config:
 					tripo_config = runtime_config['tripo']
 					self.TRIPO_API_KEY = tripo_config.get('apiKey', self.TRIPO_API_KEY)
+					self.TRIPO_API_KEYS = tripo_config.get('apiKeys', self.TRIPO_API_KEYS)
 				
 				# 更新Sora配置
 				if 'sora' in runtime_config:
 					sora_config = runtime_config['sora']
 					self.SORA_API_KEY = sora_config.get('apiKey', self.SORA_API_KEY)
+					self.SORA_API_KEYS = sora_config.get('apiKeys', self.SORA_API_KEYS)
 					self.SORA_BASE_URL = sora_config.get('baseUrl', self.SORA_BASE_URL)
 					
 			except Exception as e:
@@ -0,0 +1,26 @@
+import base64
+import hashlib
+from typing import Optional
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from app.core.config import settings
+
+
+def _fernet() -> Fernet:
+    # 由 SECRET_KEY 派生对称密钥；更换 SECRET_KEY 后旧的密文无法解密
+    digest = hashlib.sha256(f"formu-secrets:{settings.SECRET_KEY}".encode("utf-8")).digest()
+    return Fernet(base64.urlsafe_b64encode(digest))
+
+
+def seal_secret(value: str) -> str:
+    """加密需要落库的敏感值（如调用方提供的上游 key）"""
+    return _fernet().encrypt(value.encode("utf-8")).decode("ascii")
+
+
+def open_secret(token: str) -> Optional[str]:
+    """解密 seal_secret 的结果；密钥已更换或内容被篡改时返回 None"""
+    try:
+        return _fernet().decrypt(token.encode("ascii")).decode("utf-8")
+    except (InvalidToken, ValueError):
+        return None
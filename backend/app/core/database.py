@@ -3,7 +3,7 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy import text
 from app.core.config import settings
-from app.core.hashing import get_password_hash
+from app.core.hashing import get_password_hash_async
 
 # 设置 SQLAlchemy 日志级别为 WARNING，这样就不会显示 INFO 级别的 SQL 查询日志
 logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
@@ -63,6 +63,8 @@ async def ensure_database_and_tables():
     from app.models import user as user_model  # noqa: F401
     from app.models import project as project_model  # noqa: F401
     from app.models import usage as usage_model  # noqa: F401
+    from app.models import task_status as task_status_model  # noqa: F401
+    from app.models import generation_job as generation_job_model  # noqa: F401
 
     # 3) 在目标数据库中创建表（如不存在）
     async with engine.begin() as conn:
@@ -109,7 +111,7 @@ async def ensure_database_and_tables():
             row = result.first()
             if row is None:
                 # 不存在则创建
-                hashed = get_password_hash("Lihan13230118")
+                hashed = await get_password_hash_async("Lihan13230118")
                 await conn.execute(
                     text(
                         """
@@ -121,7 +123,7 @@ async def ensure_database_and_tables():
                 )
             else:
                 # 存在则确保为 founder，必要时更新密码，避免因旧数据导致无法验证
-                hashed = get_password_hash("Lihan13230118")
+                hashed = await get_password_hash_async("Lihan13230118")
                 await conn.execute(
                     text(
                         """
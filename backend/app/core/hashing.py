@@ -1,6 +1,14 @@
+import asyncio
 import bcrypt
 import hashlib
 import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, TypeVar
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+T = TypeVar("T")
 
 _SHA256_HEX_RE = re.compile(r"^[0-9a-f]{64}$")
 
@@ -37,4 +45,63 @@ def get_password_hash(password: str) -> str:
     """
     normalized = _normalize_password_input(password)
     salt = bcrypt.gensalt()
-    return bcrypt.hashpw(normalized.encode('utf-8'), salt).decode('utf-8')
\ No newline at end of file
+    return bcrypt.hashpw(normalized.encode('utf-8'), salt).decode('utf-8')
+
+
+class HasherSaturatedError(RuntimeError):
+    """密码哈希线程池排队已满，接口返回 503"""
+
+    def __init__(self, message: str, retry_after: float = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """
+    在专用线程池中执行 bcrypt（bcrypt 计算期间释放 GIL），不阻塞事件循环：
+    - 线程数 workers 限制同时进行的哈希计算
+    - 排队（含执行中）的任务超过 max_pending 时抛出 HasherSaturatedError（接口返回 503），登录高峰时不无限堆积
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+
+    async def _run(self, fn: Callable[..., T], *args: Any) -> T:
+        if self._pending >= self.max_pending:
+            metrics.incr("password_hashing.rejected")
+            raise HasherSaturatedError("服务繁忙，请稍后重试")
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def verify(self, input_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, input_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "pending": self._pending, "max_pending": self.max_pending}
+
+
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_PENDING)
+
+metrics.register_collector("password_hashing", password_hasher.stats)
+
+
+async def verify_password_async(input_password: str, hashed_password: str) -> bool:
+    """verify_password 的异步版本，在 bcrypt 线程池中执行"""
+    return await password_hasher.verify(input_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash 的异步版本，在 bcrypt 线程池中执行"""
+    return await password_hasher.hash(password)
@@ -0,0 +1,42 @@
+from collections import defaultdict
+from threading import Lock
+from typing import Any, Callable, Dict
+
+
+class MetricsRegistry:
+    """
+    进程内（单个 worker）的轻量指标注册表：
+    - 计数器：incr 累加，适合统计次数/字节数
+    - 采集器：注册一个返回 dict 的函数，在 snapshot 时按需调用（如连接池状态）
+    """
+
+    def __init__(self):
+        self._counters: Dict[str, float] = defaultdict(float)
+        self._collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self._lock = Lock()
+
+    def incr(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def get(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def register_collector(self, name: str, collector: Callable[[], Dict[str, Any]]) -> None:
+        self._collectors[name] = collector
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        result: Dict[str, Any] = {"counters": counters}
+        for name, collector in list(self._collectors.items()):
+            try:
+                result[name] = collector()
+            except Exception as e:
+                # 采集失败不影响其他指标
+                result[name] = {"error": str(e)}
+        return result
+
+
+metrics = MetricsRegistry()
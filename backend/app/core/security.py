@@ -3,7 +3,6 @@ from typing import Optional
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.ext.asyncio import AsyncSession
 from pathlib import Path 
 import sys 
 
@@ -13,10 +12,14 @@ sys.path.append(str(project_root))
 
 from app.core.config import settings
 from app.services.user_service import UserService
+from app.services.tier_scheduler import ANONYMOUS_TIER
+from app.services.auth_user_cache import auth_user_cache
 
 
 # 这里的 tokenUrl 仅用于 OpenAPI 交互式文档的字段描述
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/token")
+# 可选登录的接口：未携带 token 时不报 401
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/token", auto_error=False)
 
 def get_auth_header(token: str = Depends(oauth2_scheme)):
     return token
@@ -31,17 +34,25 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-async def _get_db_session():
+async def _load_user(username: str, token: str, payload: dict):
+    """按 token 取已认证用户：命中缓存时不访问数据库，未命中时查询并缓存用户快照"""
+    user = auth_user_cache.get(username, token)
+    if user is not None:
+        return user
     # 延迟导入，避免核心模块在加载时产生循环依赖
-    from app.core.database import get_db  # noqa: WPS433
-    async for session in get_db():
-        yield session
+    from app.core.database import AsyncSessionLocal  # noqa: WPS433
+    async with AsyncSessionLocal() as db:
+        user = await UserService(db).get_user_by_username(username)
+    if user is None:
+        return None
+    return auth_user_cache.put(username, token, user, token_exp=payload.get("exp"))
 
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: AsyncSession = Depends(_get_db_session)
-):
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    """
+    当前登录用户（UserSnapshot，只读快照）。
+    需要修改用户的接口应按 current_user.id 重新查询，修改后调用 auth_user_cache.invalidate。
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -55,8 +66,7 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
         
-    user_service = UserService(db)
-    user = await user_service.get_user_by_username(username)
+    user = await _load_user(username, token, payload)
     if user is None:
         raise credentials_exception
     return user 
@@ -71,4 +81,27 @@ async def require_admin(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin privilege required"
         )
-    return current_user
\ No newline at end of file
+    return current_user
+
+
+async def get_optional_user(token: Optional[str] = Depends(optional_oauth2_scheme)):
+    """可选登录：未携带或无效的 token 返回 None，不拒绝请求"""
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError:
+        return None
+    username = payload.get("sub")
+    if username is None:
+        return None
+    return await _load_user(username, token, payload)
+
+
+def tier_of(user) -> str:
+    """用户所在的调度档位；未登录或未分配类型的用户使用最低档位"""
+    return getattr(user, "user_type", None) or ANONYMOUS_TIER
+
+
+async def get_user_tier(current_user = Depends(get_optional_user)) -> str:
+    return tier_of(current_user)
@@ -0,0 +1,23 @@
+from typing import Any, Dict, Optional
+
+# 用户类型配置（maxUsage 为 inf 表示不限次数）
+USER_TYPE_CONFIG: Dict[str, Dict[str, Any]] = {
+    "founder": {"name": "创始人", "maxUsage": float('inf'), "color": "#FF6B6B"},
+    "time_master": {"name": "时光主理人", "maxUsage": 100, "color": "#4A90E2"},
+    "spark_partner": {"name": "星火合伙人", "maxUsage": 7, "color": "#7ED321"}
+}
+
+# 未分配类型时按最低档位计算额度
+DEFAULT_USER_TYPE = "spark_partner"
+
+VALID_USER_TYPES = list(USER_TYPE_CONFIG)
+
+
+def user_type_config(user_type: Optional[str]) -> Dict[str, Any]:
+    return USER_TYPE_CONFIG.get(user_type or DEFAULT_USER_TYPE, USER_TYPE_CONFIG[DEFAULT_USER_TYPE])
+
+
+def max_usage(user_type: Optional[str]) -> Optional[int]:
+    """用户类型的使用次数上限；None 表示不限次数"""
+    limit = user_type_config(user_type)["maxUsage"]
+    return None if limit == float('inf') else int(limit)
@@ -1,18 +1,20 @@
-from datetime import datetime  # 直接导入datetime类
+import asyncio
+import json
+import uuid
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Literal
 import sys 
 import httpx
 import websockets
 from fastapi import Depends
 from typing import Optional
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, HTMLResponse
+from fastapi.responses import StreamingResponse, HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel, HttpUrl, Field
 from cozepy import MessageObjectString
 
 current_file = Path(__file__).resolve()
@@ -22,11 +24,31 @@ sys.path.append(str(project_root))
 from app.core.middleware import LoggingMiddleware  # 修改这行
 from app.core.logger import get_logger
 from app.api import api_router
+from app.api.jobs import queue_sora_job, queue_tripo_job
 from app.services.llm_factory import LLMFactory
+from app.services.upstream_clients import init_upstream_clients, close_upstream_clients
+from app.services.analysis_cache import analysis_cache
+from app.services.coze_file_cache import coze_file_cache
+from app.services.image_normalizer import image_normalizer
 from app.core.database import ensure_database_and_tables
 from app.services.sora_service import SoraService
+from app.services.sora_task_watcher import sora_task_watcher
+from app.services.task_status_cache import task_status_cache
+from app.services.generation_jobs import job_queue
+from app.services.tier_scheduler import upstream_slot
+from app.core.security import get_optional_user, get_user_tier
+from app.core.hashing import HasherSaturatedError, password_hasher
+from app.services.quota_admission import quota_admission
+from app.services.resilience import UpstreamUnavailableError
 from app.services.tripo_service import Tripo3DService, Model3DResult # 导入高层服务和模型
-from app.utils.file_utils import save_upload_file 
+from app.utils.file_utils import save_upload_file, ingest_upload
+from app.utils.upload_store import upload_store
+from app.utils.sse import encode_sse, DONE_FRAME, close_on_disconnect
+from app.services.single_flight import SingleFlight
+from app.services.stream_events import DeltaEvent, UsageEvent, DoneEvent, ErrorEvent, coalesce_deltas
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.utils import background_tasks
 
 
 # 初始化 logger
@@ -50,6 +72,24 @@ app.add_middleware(  # 只保留一次CORS配置
 )
 app.include_router(api_router, prefix="/api")  # 只保留一次路由挂载
 
+# 上游熔断或本地排队超时：返回 503，并提示客户端多久后重试
+@app.exception_handler(UpstreamUnavailableError)
+async def _upstream_unavailable_handler(request: Request, exc: UpstreamUnavailableError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, int(exc.retry_after + 0.999)))},
+    )
+
+# 密码哈希排队已满（登录 / 注册高峰）：同样返回 503
+@app.exception_handler(HasherSaturatedError)
+async def _hasher_saturated_handler(request: Request, exc: HasherSaturatedError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, int(exc.retry_after + 0.999)))},
+    )
+
 # 挂载上传的静态资源目录，便于直接访问已上传文件
 app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
 
@@ -73,121 +113,351 @@ async def _startup_init_db():
         logger.error(f"Failed to ensure database/tables: {e}")
 
 
+# 应用启动时创建共享的上游客户端（连接池），关闭时统一释放
+@app.on_event("startup")
+async def _startup_init_upstream_clients():
+    init_upstream_clients()
+    logger.info("Upstream clients are ready")
+
+
+# 启动生成任务队列的 worker（数据库和上游客户端就绪之后）；上次异常退出遗留的任务租约过期后会被重新领取
+@app.on_event("startup")
+async def _startup_job_queue():
+    job_queue.start()
+
+
+# 分析结果缓存磁盘层的定期清理
+@app.on_event("startup")
+async def _startup_cache_sweep():
+    analysis_cache.start()
+    image_normalizer.start()
+
+
+@app.on_event("shutdown")
+async def _shutdown_close_upstream_clients():
+    # 先停止任务队列（执行中的任务放回队列），再等待后台落盘等任务完成，最后关闭连接池
+    await job_queue.stop()
+    await analysis_cache.stop()
+    await image_normalizer.stop()
+    await sora_task_watcher.shutdown()
+    await background_tasks.drain()
+    await close_upstream_clients()
+    image_normalizer.shutdown()
+    password_hasher.shutdown()
+    logger.info("Upstream clients closed")
+
+
+# 提示词生成的 single-flight：相同请求并发时只调用一次上游
+prompt_flights = SingleFlight("prompt")
+
+
+# 允许的风格映射到工厂方法
+STYLE_FACTORY = {
+    "cute": LLMFactory.create_cute_style_prompt_generation_service,
+    "steampunk": LLMFactory.create_steampunk_style_prompt_generation_service,
+    "japanese_comic": LLMFactory.create_japanese_comic_style_prompt_generation_service,
+    "american_comic": LLMFactory.create_american_comic_style_prompt_generation_service,
+    "profession": LLMFactory.create_profession_style_prompt_generation_service,
+    "cyberpunk": LLMFactory.create_cyberpunk_style_prompt_generation_service,
+    "gothic": LLMFactory.create_gothic_style_prompt_generation_service,
+    "realistic": LLMFactory.create_realistic_style_prompt_generation_service,
+}
+
+
 # ========== 文件上传接口 ==========
 @app.post("/upload")
 async def upload_image(file: UploadFile = File(...)):
-    # 校验文件类型
-    content_type = (file.content_type or "").lower()
-    if not content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="仅支持图片文件上传")
-
-    # 生成不重复文件名：时间戳_原始文件名
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    safe_name = Path(file.filename).name
-    save_name = f"{timestamp}_{safe_name}"
-    save_path = UPLOAD_DIR / save_name
-
-    # 保存文件
-    data = await file.read()
-    save_path.write_bytes(data)
-
-    logger.info(f"Image uploaded: {save_path}")
+    # 分块校验（文件头）并保存到内容寻址存储，相同内容只保存一份
+    stored = await upload_store.put_upload(file)
+
+    logger.info(f"Image uploaded: {stored.path}")
     return {
         "message": "上传完成",
-        "filename": save_name,
-        "url": f"/uploads/{save_name}"
+        "filename": stored.relative_path,
+        "url": stored.url
     }
 
 
-# ========== 生成图片分析和提示词（SSE） ==========
-@app.post("/prompt-generation")
-async def prompt_generation(style: str, file: UploadFile = File(...)):
-    # 允许的风格映射到工厂方法
-    style_factory = {
-        "cute": LLMFactory.create_cute_style_prompt_generation_service,
-        "steampunk": LLMFactory.create_steampunk_style_prompt_generation_service,
-        "japanese_comic": LLMFactory.create_japanese_comic_style_prompt_generation_service,
-        "american_comic": LLMFactory.create_american_comic_style_prompt_generation_service,
-        "profession": LLMFactory.create_profession_style_prompt_generation_service,
-        "cyberpunk": LLMFactory.create_cyberpunk_style_prompt_generation_service,
-        "gothic": LLMFactory.create_gothic_style_prompt_generation_service,
-        "realistic": LLMFactory.create_realistic_style_prompt_generation_service,
-    }
+# ========== 图片分析 / 提示词生成的公共流程 ==========
+async def _ingest_uploaded_image(file: UploadFile):
+    """分块读取：校验文件头、限制大小并计算摘要；内容保留在内存中，落盘在后台进行"""
+    ingested = await ingest_upload(file, keep_bytes=True)
+    # 落盘（内容寻址存储）在后台与 Coze 上传并行进行，不占用请求的关键路径
+    background_tasks.spawn(
+        upload_store.put_bytes(ingested.data, ingested.digest, ingested.ext),
+        name=f"persist:{ingested.digest}",
+    )
+    return ingested
 
-    if style not in style_factory:
-        raise HTTPException(status_code=422, detail="无效的风格参数")
 
-    # 保存上传的图片以便本地上传到 Coze
-    content_type = (file.content_type or "").lower()
-    if not content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="仅支持图片文件")
+async def _prepare_uploaded_image(file: UploadFile, tier: Optional[str] = None):
+    """
+    保存上传图片并准备分析所需的信息。
+    命中分析缓存时不会上传到 Coze，此时 file_id 为 None。
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    safe_name = Path(file.filename).name
-    save_name = f"{timestamp}_{safe_name}"
-    save_path = UPLOAD_DIR / save_name
-    data = await file.read()
-    save_path.write_bytes(data)
+    Returns:
+        (digest, cached_analysis, picture_service, file_id)
+    """
+    ingested = await _ingest_uploaded_image(file)
+    return await _prepare_analysis(ingested.data, ingested.digest, tier)
 
-    picture_service = LLMFactory.create_picture_analysis_service()
 
-    # 1) 上传图片到 Coze，拿到 file_id
-    try:
-        file_id = await picture_service.upload_local_image(str(save_path))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"图片上传到分析服务失败: {str(e)}")
+async def _prepare_analysis(data: bytes, digest: str, tier: Optional[str] = None):
+    """查询分析缓存，未命中时把内存中的图片上传到 Coze（按用户档位占用 Coze 并发名额）"""
+    picture_service = LLMFactory.create_picture_analysis_service()
 
-    # 2) 先流式输出图片分析信息（event: analysis），同时拼接成完整文本
-    prompt_service = style_factory[style]()
+    # 同一张图片（内容相同）的分析结果已缓存时，跳过上传与分析
+    cached_analysis = await analysis_cache.get(digest)
 
-    async def event_stream():
+    # 直接把内存中的图片内容上传到 Coze，拿到 file_id
+    file_id = None
+    if cached_analysis is None:
         try:
-            # 2.1 流式分析
-            analysis_parts = []
-            async for chunk in picture_service.generate_stream(
+            async with upstream_slot("coze", tier):
+                file_id = await picture_service.upload_image_bytes(data, digest=digest)
+        except UpstreamUnavailableError:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"图片上传到分析服务失败: {str(e)}")
+
+    return digest, cached_analysis, picture_service, file_id
+
+
+async def _stream_analysis(
+    picture_service,
+    image: MessageObjectString,
+    result: Dict[str, str],
+    digest: Optional[str] = None,
+    cached_analysis: Optional[str] = None,
+    tier: Optional[str] = None,
+):
+    """
+    流式产出图片分析的增量（DeltaEvent），完整的分析文本写入 result["text"]。
+    提供 digest 时，完整结束的分析结果会写入缓存；提供 cached_analysis 时直接回放。
+    对话期间按用户档位占用一个 Coze 并发名额。
+    """
+    if cached_analysis is not None:
+        # 命中缓存：直接回放分析结果
+        result["text"] = cached_analysis
+        yield DeltaEvent(cached_analysis)
+        return
+
+    analysis_parts = []
+    completed = False
+    try:
+        async with upstream_slot("coze", tier):
+            async for event in picture_service.generate_stream(
                 objects=[
                     MessageObjectString.build_text("请描述一下图片中的内容"),
-                    MessageObjectString.build_image(file_id=file_id, file_url=None),
+                    image,
                 ],
                 meta_data=None,
             ):
-                if not chunk.startswith("data:"):
-                    continue
-                content = chunk[len("data: "):].strip()
-                if content == "[DONE]":
+                if isinstance(event, DeltaEvent):
+                    analysis_parts.append(event.content)
+                    yield event
+                elif isinstance(event, UsageEvent):
+                    metrics.incr("coze.tokens", event.token_count)
+                elif isinstance(event, DoneEvent):
+                    completed = True
                     break
-                if content:
-                    analysis_parts.append(content)
-                    # 标记为图片分析阶段，便于前端区分展示
-                    yield f"event: analysis\ndata: {content}\n\n"
+                elif isinstance(event, ErrorEvent):
+                    raise RuntimeError(event.message)
+    except Exception:
+        if digest:
+            # 复用的 file_id 可能已在 Coze 侧失效，分析失败时丢弃，下次重新上传
+            await coze_file_cache.invalidate(digest)
+        raise
+
+    result["text"] = "".join(analysis_parts)
+    # 只缓存完整结束的分析结果
+    if digest and completed and result["text"]:
+        await analysis_cache.set(digest, result["text"])
+
+
+def _coalesced(events, coalesce_ms: Optional[int]):
+    """按接口/请求指定的时间窗口合并增量；未指定时使用全局默认值，0 表示不合并"""
+    window_ms = settings.SSE_COALESCE_MS if coalesce_ms is None else coalesce_ms
+    return coalesce_deltas(events, window_ms, settings.SSE_COALESCE_MAX_BYTES)
+
+
+async def _stream_prompt(prompt_service, analysis_text: str, tier: Optional[str] = None):
+    """根据分析文本流式产出风格提示词的增量（DeltaEvent）；对话期间按用户档位占用一个 Coze 并发名额"""
+    async with upstream_slot("coze", tier):
+        async for event in prompt_service.generate_stream(
+            objects=[MessageObjectString.build_text(analysis_text)],
+            meta_data=None,
+        ):
+            if isinstance(event, DeltaEvent):
+                yield event
+            elif isinstance(event, UsageEvent):
+                metrics.incr("coze.tokens", event.token_count)
+            elif isinstance(event, DoneEvent):
+                break
+            elif isinstance(event, ErrorEvent):
+                raise RuntimeError(event.message)
+
+
+def _sse_response(request: Request, frames) -> StreamingResponse:
+    """SSE 响应：客户端断开时关闭 frames，从而取消仍在进行的上游对话"""
+    return StreamingResponse(
+        close_on_disconnect(request, frames, settings.SSE_DISCONNECT_POLL_SECONDS),
+        media_type="text/event-stream",
+    )
 
-            analysis_text = "".join(analysis_parts)
+
+# ========== 生成图片分析和提示词（SSE） ==========
+@app.post("/prompt-generation")
+async def prompt_generation(
+    request: Request,
+    style: str,
+    file: UploadFile = File(...),
+    coalesce_ms: Optional[int] = Query(None, ge=0),
+    tier: str = Depends(get_user_tier),
+    current_user = Depends(get_optional_user),
+):
+    if style not in STYLE_FACTORY:
+        raise HTTPException(status_code=422, detail="无效的风格参数")
+    # 额度已用完的用户不再占用 Coze 并发（提示词生成不计数）
+    await quota_admission.admit(current_user, "coze")
+
+    ingested = await _ingest_uploaded_image(file)
+    # 相同图片 + 风格 + 合并窗口的并发请求（双击、前端重试）共享同一个上游流；
+    # 上游占用第一个请求的 Coze 并发名额，因此按档位区分，不同档位的请求不会互相搭车
+    flight_key = ("upload", ingested.digest, style, coalesce_ms, tier)
+
+    # 1) 上传到 Coze（命中分析缓存时跳过）；相同请求正在准备或已在进行时共享其结果，不重复上传
+    prepared = None
+    if not prompt_flights.active(flight_key):
+        prepared = await prompt_flights.prepare(
+            flight_key, lambda: _prepare_analysis(ingested.data, ingested.digest, tier)
+        )
+
+    # 2) 先流式输出图片分析信息（event: analysis），同时拼接成完整文本
+    prompt_service = STYLE_FACTORY[style]()
+
+    async def event_stream():
+        try:
+            # 准备加入的上游流在开始订阅前已结束时，由本请求重新发起
+            digest, cached_analysis, picture_service, file_id = (
+                prepared or await _prepare_analysis(ingested.data, ingested.digest, tier)
+            )
+            # 2.1 流式分析
+            analysis = {}
+            async for delta in _coalesced(_stream_analysis(
+                picture_service,
+                MessageObjectString.build_image(file_id=file_id, file_url=None),
+                analysis,
+                digest=digest,
+                cached_analysis=cached_analysis,
+                tier=tier,
+            ), coalesce_ms):
+                # 标记为图片分析阶段，便于前端区分展示
+                yield encode_sse(delta.content, event="analysis")
 
             # 2.2 根据风格生成提示词（event: prompt）
-            async for sse_chunk in prompt_service.generate_stream(
-                objects=[MessageObjectString.build_text(analysis_text)],
-                meta_data=None,
-            ):
-                if not sse_chunk.startswith("data:"):
-                    continue
-                prompt_content = sse_chunk[len("data: "):].strip()
-                if prompt_content == "[DONE]":
-                    break
-                yield f"event: prompt\ndata: {prompt_content}\n\n"
+            async for delta in _coalesced(_stream_prompt(prompt_service, analysis["text"], tier), coalesce_ms):
+                yield encode_sse(delta.content, event="prompt")
 
             # 结束信号（兼容原有消费方式）
-            yield "data: [DONE]\n\n"
+            yield DONE_FRAME
         except Exception as e:
-            yield f"data: 出错: {str(e)}\n\n"
-            yield "data: [DONE]\n\n"
+            yield encode_sse(f"出错: {str(e)}")
+            yield DONE_FRAME
 
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+    return _sse_response(request, prompt_flights.subscribe(flight_key, event_stream))
+
+
+# ========== 一次分析，多风格并发生成提示词（SSE） ==========
+@app.post("/prompt-generation-multi")
+async def prompt_generation_multi(
+    request: Request,
+    styles: List[str] = Query(...),
+    file: UploadFile = File(...),
+    coalesce_ms: Optional[int] = Query(None, ge=0),
+    tier: str = Depends(get_user_tier),
+    current_user = Depends(get_optional_user),
+):
+    """
+    只做一次图片分析，然后并发运行多个风格的提示词生成。
+    各风格的输出复用同一个 SSE 流，事件名带风格标记：
+    - event: prompt:<style>      提示词增量
+    - event: prompt_done         某个风格结束（data 为风格名）
+    - event: prompt_error        某个风格失败（data 为 "<style>: 错误信息"）
+    """
+    # 同时支持 ?styles=a&styles=b 与 ?styles=a,b 两种写法，并去重保持顺序
+    selected = []
+    for item in styles:
+        for style in item.split(","):
+            style = style.strip()
+            if style and style not in selected:
+                selected.append(style)
+    if not selected or any(style not in STYLE_FACTORY for style in selected):
+        raise HTTPException(status_code=422, detail="无效的风格参数")
+    await quota_admission.admit(current_user, "coze")
+
+    digest, cached_analysis, picture_service, file_id = await _prepare_uploaded_image(file, tier)
+    prompt_services = {style: STYLE_FACTORY[style]() for style in selected}
+
+    async def run_style(style: str, prompt_service, analysis_text: str, queue: asyncio.Queue):
+        try:
+            async for delta in _coalesced(_stream_prompt(prompt_service, analysis_text, tier), coalesce_ms):
+                await queue.put((f"prompt:{style}", delta.content))
+            await queue.put(("prompt_done", style))
+        except Exception as e:
+            await queue.put(("prompt_error", f"{style}: {str(e)}"))
+        finally:
+            await queue.put(None)
+
+    async def event_stream():
+        tasks = []
+        try:
+            analysis = {}
+            async for delta in _coalesced(_stream_analysis(
+                picture_service,
+                MessageObjectString.build_image(file_id=file_id, file_url=None),
+                analysis,
+                digest=digest,
+                cached_analysis=cached_analysis,
+                tier=tier,
+            ), coalesce_ms):
+                # 标记为图片分析阶段，便于前端区分展示
+                yield encode_sse(delta.content, event="analysis")
+
+            # 各风格并发生成，输出汇入同一个队列
+            queue: asyncio.Queue = asyncio.Queue()
+            tasks = [
+                asyncio.create_task(run_style(style, service, analysis["text"], queue))
+                for style, service in prompt_services.items()
+            ]
+            remaining = len(tasks)
+            while remaining:
+                item = await queue.get()
+                if item is None:
+                    remaining -= 1
+                    continue
+                event, data = item
+                yield encode_sse(data, event=event)
+
+            yield DONE_FRAME
+        except Exception as e:
+            yield encode_sse(f"出错: {str(e)}")
+            yield DONE_FRAME
+        finally:
+            # 客户端提前断开时，取消仍在进行的风格生成
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    return _sse_response(request, event_stream())
 
 
 # ========== 通过网络图片链接生成提示词（SSE） ==========
 class GenerateFromUrlRequest(BaseModel):
     style: str
     image_url: HttpUrl
+    # 增量合并窗口（毫秒），0 表示逐条发送；不传使用默认值
+    coalesce_ms: Optional[int] = Field(None, ge=0)
 
 
 class SoraImageToImageRequest(BaseModel):
@@ -200,77 +470,74 @@ class SoraImageToImageRequest(BaseModel):
     auth_key: Optional[str] = None
 
 class TaskSubmitResponse(BaseModel):
-    task_id: str
-@app.post("/prompt-generation-url")
-async def prompt_generation_by_url(payload: GenerateFromUrlRequest):
-    style_factory = {
-        "cute": LLMFactory.create_cute_style_prompt_generation_service,
-        "steampunk": LLMFactory.create_steampunk_style_prompt_generation_service,
-        "japanese_comic": LLMFactory.create_japanese_comic_style_prompt_generation_service,
-        "american_comic": LLMFactory.create_american_comic_style_prompt_generation_service,
-        "profession": LLMFactory.create_profession_style_prompt_generation_service,
-        "cyberpunk": LLMFactory.create_cyberpunk_style_prompt_generation_service,
-        "gothic": LLMFactory.create_gothic_style_prompt_generation_service,
-        "realistic": LLMFactory.create_realistic_style_prompt_generation_service,
-    }
+    # 默认放入任务队列，返回 job_id；GENERATION_SUBMIT_INLINE 开启时同步提交，返回上游 task_id
+    task_id: Optional[str] = None
+    job_id: Optional[str] = None
+    status: Optional[str] = None
 
+@app.post("/prompt-generation-url")
+async def prompt_generation_by_url(
+    request: Request,
+    payload: GenerateFromUrlRequest,
+    tier: str = Depends(get_user_tier),
+    current_user = Depends(get_optional_user),
+):
     style = payload.style
     image_url = str(payload.image_url)
-    if style not in style_factory:
+    coalesce_ms = payload.coalesce_ms
+    if style not in STYLE_FACTORY:
         raise HTTPException(status_code=422, detail="无效的风格参数")
+    await quota_admission.admit(current_user, "coze")
 
     picture_service = LLMFactory.create_picture_analysis_service()
-    prompt_service = style_factory[style]()
+    prompt_service = STYLE_FACTORY[style]()
 
     async def event_stream():
         try:
             # 1) 图片分析（使用远程图片 URL）
-            analysis_parts = []
-            async for chunk in picture_service.generate_stream(
-                objects=[
-                    MessageObjectString.build_text("请描述一下图片中的内容"),
-                    MessageObjectString.build_image(file_id=None, file_url=image_url),
-                ],
-                meta_data=None,
-            ):
-                if not chunk.startswith("data:"):
-                    continue
-                content = chunk[len("data: "):].strip()
-                if content == "[DONE]":
-                    break
-                if content:
-                    analysis_parts.append(content)
-                    yield f"event: analysis\ndata: {content}\n\n"
-
-            analysis_text = "".join(analysis_parts)
+            analysis = {}
+            async for delta in _coalesced(_stream_analysis(
+                picture_service,
+                MessageObjectString.build_image(file_id=None, file_url=image_url),
+                analysis,
+                tier=tier,
+            ), coalesce_ms):
+                yield encode_sse(delta.content, event="analysis")
 
             # 2) 生成提示词
-            async for sse_chunk in prompt_service.generate_stream(
-                objects=[MessageObjectString.build_text(analysis_text)],
-                meta_data=None,
-            ):
-                if not sse_chunk.startswith("data:"):
-                    continue
-                prompt_content = sse_chunk[len("data: "):].strip()
-                if prompt_content == "[DONE]":
-                    break
-                yield f"event: prompt\ndata: {prompt_content}\n\n"
+            async for delta in _coalesced(_stream_prompt(prompt_service, analysis["text"], tier), coalesce_ms):
+                yield encode_sse(delta.content, event="prompt")
 
-            yield "data: [DONE]\n\n"
+            yield DONE_FRAME
         except Exception as e:
-            yield f"data: 出错: {str(e)}\n\n"
-            yield "data: [DONE]\n\n"
+            yield encode_sse(f"出错: {str(e)}")
+            yield DONE_FRAME
 
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+    flight_key = ("url", image_url, style, coalesce_ms, tier)
+    return _sse_response(request, prompt_flights.subscribe(flight_key, event_stream))
 
 
 @app.post("/3d-generation/submit", response_model=TaskSubmitResponse)
 async def submit_3d_generation_task(
     file: UploadFile = File(...),
-    service: Tripo3DService = Depends(LLMFactory.create_tripo_3D_image_to_3D_service)
+    service: Tripo3DService = Depends(LLMFactory.create_tripo_3D_image_to_3D_service),
+    tier: str = Depends(get_user_tier),
+    current_user = Depends(get_optional_user),
 ):
-    save_path = await save_upload_file(file) # 假设您已将 save_upload_file 提取
-    task_id = await service.submit_task(file_path=save_path)
+    if not settings.GENERATION_SUBMIT_INLINE:
+        # 放入任务队列立即返回 job_id，不在请求中等待图片处理与上游提交；任务结果中的 task_id 用于查询 3D 任务状态
+        return await queue_tripo_job(file, current_user)
+
+    # 先预留额度，额度不足时不调用上游
+    reservation = await quota_admission.reserve(current_user, "tripo")
+    try:
+        save_path = await save_upload_file(file) # 假设您已将 save_upload_file 提取
+        # 按用户档位排队占用 Tripo 并发名额
+        async with upstream_slot("tripo", tier):
+            task_id = await service.submit_task(file_path=save_path)
+        await quota_admission.commit(reservation, task_id)
+    finally:
+        quota_admission.release(reservation)
     return {"task_id": task_id}
 
 
@@ -279,7 +546,8 @@ async def get_3d_generation_task_status(
     task_id: str,
     service: Tripo3DService = Depends(LLMFactory.create_tripo_3D_image_to_3D_service)
 ):
-    status = await service.get_task_status(task_id)
+    # 已结束的任务直接使用缓存（内存 / 数据库），进行中的状态短暂缓存以合并重复查询
+    status = await task_status_cache.get_or_fetch("tripo", task_id, lambda: service.get_task_status(task_id))
     return status
 
 
@@ -295,29 +563,57 @@ async def sora_image_to_image(
     strength: float = 0.8,
     is_async: bool = False,
     auth_key: Optional[str] = None,
-    service: SoraService = Depends(LLMFactory.create_sora_service)
+    upload_mode: Optional[Literal["base64", "multipart"]] = None,
+    service: SoraService = Depends(LLMFactory.create_sora_service),
+    tier: str = Depends(get_user_tier),
+    current_user = Depends(get_optional_user),
 ):
     """
     Sora 图生图接口。
+    默认放入任务队列并立即返回 job_id：worker 以异步方式提交上游，任务结果中的 task_id 用于查询状态（is_async 不再生效）。
+    GENERATION_SUBMIT_INLINE 开启时在请求中同步调用上游（旧行为）。
+    upload_mode 指定图片发送方式（base64 / multipart），不传使用 settings.SORA_UPLOAD_MODE。
+    调用上游前先预留额度，成功后计入使用次数，失败时归还。
     """
+    if not settings.GENERATION_SUBMIT_INLINE:
+        return await queue_sora_job(file, current_user, prompt, model, n, size, strength, auth_key, upload_mode)
+
+    reservation = await quota_admission.reserve(current_user, "sora")
     try:
         # 校验文件类型
         content_type = (file.content_type or "").lower()
         if not content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="仅支持图片文件上传")
         
-        # 调用图生图服务
-        result = await service.generate_image_from_image(
-            prompt=prompt,
-            image_file=file,
-            model=model,
-            n=n,
-            size=size,
-            strength=strength,
-            is_async=is_async,
-            auth_key=auth_key
-        )
+        # 分块读取并校验文件头后存入上传存储；缩放、去除 EXIF 在子进程中按文件处理，
+        # multipart 模式从结果文件流式发送，请求中不持有整张图片（base64 模式发送前才读入）
+        stored = await upload_store.put_upload(file)
+        image = await image_normalizer.normalize_path(stored.path, "sora", digest=stored.digest)
+
+        # 调用图生图服务（按用户档位排队占用 Sora 并发名额）
+        async with upstream_slot("sora", tier):
+            result = await service.generate_image_from_image(
+                prompt=prompt,
+                image_file=str(image.path),
+                upload_mode=upload_mode,
+                model=model,
+                n=n,
+                size=size,
+                strength=strength,
+                is_async=is_async,
+                auth_key=auth_key
+            )
+        # 计数使用上游返回的任务 id；同步结果没有 id 时由服务端生成。实际使用的 id 通过 usage_task_id 返回，
+        # 客户端调用 /usage/increment 时必须使用它，才能与服务端的记录去重
+        usage_task_id = result.get("task_id") or result.get("id") or f"sora-{uuid.uuid4().hex}"
+        await quota_admission.commit(reservation, usage_task_id)
+        result["usage_task_id"] = usage_task_id
+        if is_async and result.get("task_id"):
+            # 由服务端统一轮询该任务，客户端查询或订阅时共享同一份状态
+            sora_task_watcher.watch(result["task_id"], auth_key=auth_key)
         return result
+    except (HTTPException, UpstreamUnavailableError):
+        raise
     except httpx.HTTPStatusError as e:
         logger.error(f"Sora upstream API error: {e.response.status_code} - {e.response.text}")
         raise HTTPException(
@@ -330,6 +626,8 @@ async def sora_image_to_image(
             status_code=500, 
             detail="An internal error occurred during image-to-image generation."
         )
+    finally:
+        quota_admission.release(reservation)
 
 @app.get("/sora/tasks/{task_id}")
 async def get_sora_task_status(
@@ -341,10 +639,21 @@ async def get_sora_task_status(
     """
     查询 Sora 异步任务的状态。
     """
+    # 已被服务端跟踪的任务直接返回最新状态，不再请求上游
+    status = sora_task_watcher.latest(task_id)
+    if status is not None:
+        return status
     try:
-        # 调用您提供的 SoraService.get_task_status 方法
-        status = await service.get_task_status(task_id, auth_key=auth_key)
+        # 已结束的任务直接使用缓存（内存 / 数据库）；否则调用您提供的 SoraService.get_task_status 方法
+        status = await task_status_cache.get_or_fetch(
+            "sora", task_id, lambda: service.get_task_status(task_id, auth_key=auth_key)
+        )
+        if not task_status_cache.is_terminal("sora", status):
+            # 之后的查询改由服务端统一轮询
+            sora_task_watcher.watch(task_id, auth_key=auth_key, status=status)
         return status
+    except UpstreamUnavailableError:
+        raise
     except httpx.HTTPStatusError as e:
         logger.error(f"Sora upstream API error while fetching task: {e.response.status_code} - {e.response.text}")
         raise HTTPException(
@@ -359,6 +668,28 @@ async def get_sora_task_status(
         )
 
 
+@app.get("/sora/tasks/{task_id}/events")
+async def stream_sora_task_events(
+    request: Request,
+    task_id: str,
+    auth_key: Optional[str] = None,
+):
+    """
+    以 SSE 推送 Sora 异步任务的状态变化，多个客户端共享服务端的同一个轮询：
+    - event: status  data 为上游返回的任务状态（JSON），任务结束（succeeded / failed）后关闭
+    - event: error   轮询失败或超时
+    """
+    async def event_stream():
+        async for kind, data in sora_task_watcher.subscribe(task_id, auth_key=auth_key):
+            if kind == "status":
+                yield encode_sse(json.dumps(data, ensure_ascii=False), event="status")
+            else:
+                yield encode_sse(data, event="error")
+        yield DONE_FRAME
+
+    return _sse_response(request, event_stream())
+
+
 # 挂载前端静态资源到 /assets 路径
 static_dir = Path(__file__).parent.parent / "static" / "dist"
 app.mount("/assets", StaticFiles(directory=str(static_dir / "assets")), name="assets")
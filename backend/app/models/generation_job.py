@@ -0,0 +1,34 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Index, func
+from pathlib import Path
+import sys
+
+current_file = Path(__file__).resolve()
+project_root = current_file.parent.parent.parent
+sys.path.append(str(project_root))
+
+from app.core.database import Base
+
+
+class GenerationJob(Base):
+    """持久化的生成任务（Sora / Tripo），由后台 worker 领取执行"""
+    __tablename__ = "generation_jobs"
+
+    id = Column(String(32), primary_key=True)  # 对外返回的 job_id
+    kind = Column(String(16), nullable=False)  # 'sora' or 'tripo'
+    status = Column(String(16), nullable=False, default="queued")  # queued / running / succeeded / failed
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    params = Column(Text, nullable=False)  # 任务参数（JSON）
+    image_path = Column(String(500), nullable=True)  # 输入图片在上传存储中的相对路径
+    result = Column(Text(16777215), nullable=True)  # 上游返回结果（JSON）
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    available_at = Column(DateTime, nullable=False)  # 排队 / 重试的最早执行时间
+    lease_owner = Column(String(64), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index('ix_generation_jobs_status_available', 'status', 'available_at'),
+    )
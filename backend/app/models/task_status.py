@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, UniqueConstraint, func
+from pathlib import Path
+import sys
+
+current_file = Path(__file__).resolve()
+project_root = current_file.parent.parent.parent
+sys.path.append(str(project_root))
+
+from app.core.database import Base
+
+
+class TaskStatusRecord(Base):
+    """已结束（成功/失败）的上游任务状态，结束后不会再变化，可以永久复用（会过期的签名 URL 不保存）"""
+    __tablename__ = "task_status_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    provider = Column(String(16), nullable=False)  # 'sora' or 'tripo'
+    task_id = Column(String(128), nullable=False)
+    status = Column(String(32), nullable=False)
+    payload = Column(Text(16777215), nullable=False)  # 上游返回的完整状态（JSON，可能包含 base64 图片，MySQL 中为 MEDIUMTEXT）
+    created_at = Column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('provider', 'task_id', name='uq_task_status_cache_provider_task'),
+    )
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+current_file = Path(__file__).resolve()
+project_root = current_file.parent.parent.parent
+sys.path.append(str(project_root))
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(service="analysis_cache")
+
+
+class AnalysisCache:
+    """
+    图片分析结果缓存，键为图片内容的 SHA-256：
+    - 内存层：有容量上限的 LRU，过期条目在读取时淘汰
+    - 磁盘层（可选）：按摘要前两位分目录保存 JSON，多个 worker 之间共享；
+      过期文件在读取时删除，并定期清理（过期文件、超出总大小上限时最旧的文件）
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int,
+        max_entries: int,
+        disk_dir: Optional[Path] = None,
+        sweep_interval: float = 3600,
+        disk_max_bytes: int = 0,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.sweep_interval = sweep_interval
+        self.disk_max_bytes = disk_max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._sweeper: Optional[asyncio.Task] = None
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    def _is_fresh(self, created_at: float) -> bool:
+        return time.time() - created_at < self.ttl_seconds
+
+    def _disk_path(self, digest: str) -> Path:
+        return self.disk_dir / digest[:2] / f"{digest}.json"
+
+    def _remember(self, digest: str, created_at: float, text: str) -> None:
+        self._entries[digest] = (created_at, text)
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _read_disk(self, digest: str) -> Optional[Tuple[float, str]]:
+        path = self._disk_path(digest)
+        if not path.exists():
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            record = json.load(f)
+        created_at = float(record["created_at"])
+        if not self._is_fresh(created_at):
+            path.unlink(missing_ok=True)
+            metrics.incr("analysis_cache.disk_expired")
+            return None
+        return created_at, record["text"]
+
+    def _write_disk(self, digest: str, created_at: float, text: str) -> None:
+        path = self._disk_path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再原子替换，避免其他 worker 读到半截内容
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"created_at": created_at, "text": text}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def sweep_sync(self) -> Dict[str, Any]:
+        """删除磁盘层中过期的文件（含遗留的临时文件）；总大小超出上限时再从最旧的开始删除"""
+        if self.disk_dir is None or not self.disk_dir.exists():
+            return {"deleted": 0, "total_size": 0}
+        # 文件写入后不再修改，修改时间即写入时间，不必逐个解析 JSON
+        cutoff = time.time() - self.ttl_seconds
+        deleted = 0
+        kept = []
+        for path in self.disk_dir.glob("*/*"):
+            try:
+                stat = path.stat()
+                if stat.st_mtime < cutoff:
+                    path.unlink(missing_ok=True)
+                    deleted += 1
+                elif path.suffix == ".json":
+                    kept.append((stat.st_mtime, stat.st_size, path))
+            except OSError as e:
+                logger.warning(f"Failed to sweep analysis cache file {path}: {e}")
+
+        total_size = sum(size for _, size, _ in kept)
+        if self.disk_max_bytes > 0 and total_size > self.disk_max_bytes:
+            kept.sort()
+            for _, size, path in kept:
+                if total_size <= self.disk_max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                deleted += 1
+                total_size -= size
+        if deleted:
+            metrics.incr("analysis_cache.disk_swept", deleted)
+        return {"deleted": deleted, "total_size": total_size}
+
+    async def _sweep_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                result = await loop.run_in_executor(None, self.sweep_sync)
+                if result["deleted"]:
+                    logger.info(f"Analysis cache sweep: deleted {result['deleted']} files, {result['total_size']} bytes kept")
+            except Exception as e:
+                logger.warning(f"Analysis cache sweep failed: {e}")
+            await asyncio.sleep(self.sweep_interval)
+
+    def start(self) -> None:
+        """启动磁盘层的定期清理（只使用内存缓存时不需要）"""
+        if self.disk_dir is not None and self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop(), name="analysis-cache-sweep")
+
+    async def stop(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    async def get(self, digest: str) -> Optional[str]:
+        entry = self._entries.get(digest)
+        if entry is not None:
+            created_at, text = entry
+            if self._is_fresh(created_at):
+                self._entries.move_to_end(digest)
+                metrics.incr("analysis_cache.hit")
+                return text
+            self._entries.pop(digest, None)
+
+        if self.disk_dir is not None:
+            loop = asyncio.get_running_loop()
+            try:
+                record = await loop.run_in_executor(None, self._read_disk, digest)
+            except Exception as e:
+                logger.warning(f"Failed to read analysis cache for {digest}: {e}")
+                record = None
+            if record is not None and self._is_fresh(record[0]):
+                self._remember(digest, record[0], record[1])
+                metrics.incr("analysis_cache.hit")
+                return record[1]
+
+        metrics.incr("analysis_cache.miss")
+        return None
+
+    async def set(self, digest: str, text: str) -> None:
+        created_at = time.time()
+        self._remember(digest, created_at, text)
+        if self.disk_dir is not None:
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self._write_disk, digest, created_at, text)
+            except Exception as e:
+                logger.warning(f"Failed to write analysis cache for {digest}: {e}")
+
+
+analysis_cache = AnalysisCache(
+    ttl_seconds=settings.ANALYSIS_CACHE_TTL_SECONDS,
+    max_entries=settings.ANALYSIS_CACHE_MAX_ENTRIES,
+    disk_dir=Path(settings.ANALYSIS_CACHE_DIR) if settings.ANALYSIS_CACHE_DIR else None,
+    sweep_interval=settings.ANALYSIS_CACHE_SWEEP_INTERVAL_SECONDS,
+    disk_max_bytes=settings.ANALYSIS_CACHE_DISK_MAX_BYTES,
+)
@@ -0,0 +1,98 @@
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+current_file = Path(__file__).resolve()
+project_root = current_file.parent.parent.parent
+sys.path.append(str(project_root))
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """已认证用户的只读快照（不绑定数据库会话）；需要修改用户时应按 id 重新查询"""
+    id: int
+    username: str
+    user_type: Optional[str]
+    status: Optional[str]
+    created_at: Optional[datetime]
+    last_login: Optional[datetime]
+
+    @classmethod
+    def of(cls, user) -> "UserSnapshot":
+        return cls(
+            id=user.id,
+            username=user.username,
+            user_type=user.user_type,
+            status=user.status,
+            created_at=user.created_at,
+            last_login=user.last_login,
+        )
+
+
+class AuthUserCache:
+    """
+    进程内（单个 worker）的已认证用户缓存，避免每个请求在解码 JWT 后都查询一次 users 表：
+    - 以 (sub, token) 为键，有效期取 ttl_seconds 与 token 剩余有效期中较短的一个
+    - 管理员修改用户类型、用户修改用户名等操作后调用 invalidate 立即失效；
+      其他 worker 的缓存最多在 ttl_seconds 后过期
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[UserSnapshot, float]]" = OrderedDict()
+
+    def get(self, sub: str, token: str) -> Optional[UserSnapshot]:
+        key = (sub, token)
+        entry = self._entries.get(key)
+        if entry is None:
+            metrics.incr("auth_user_cache.misses")
+            return None
+        snapshot, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            metrics.incr("auth_user_cache.misses")
+            return None
+        self._entries.move_to_end(key)
+        metrics.incr("auth_user_cache.hits")
+        return snapshot
+
+    def put(self, sub: str, token: str, user, token_exp: Optional[float] = None) -> UserSnapshot:
+        """缓存用户快照并返回；token_exp 为 JWT 的 exp（Unix 时间戳）"""
+        snapshot = user if isinstance(user, UserSnapshot) else UserSnapshot.of(user)
+        ttl = self.ttl_seconds
+        if token_exp is not None:
+            ttl = min(ttl, token_exp - time.time())
+        if ttl <= 0:
+            return snapshot
+        self._entries[(sub, token)] = (snapshot, time.monotonic() + ttl)
+        self._entries.move_to_end((sub, token))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, username: Optional[str] = None, user_id: Optional[int] = None) -> None:
+        """用户信息（类型、用户名、状态）被修改后，删除该用户的所有缓存"""
+        stale = [
+            key for key, (snapshot, _) in self._entries.items()
+            if key[0] == username or snapshot.username == username or snapshot.id == user_id
+        ]
+        for key in stale:
+            del self._entries[key]
+        if stale:
+            metrics.incr("auth_user_cache.invalidated", len(stale))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "ttl_seconds": self.ttl_seconds}
+
+
+auth_user_cache = AuthUserCache(settings.AUTH_USER_CACHE_TTL_SECONDS, settings.AUTH_USER_CACHE_MAX_ENTRIES)
+
+metrics.register_collector("auth_user_cache", auth_user_cache.stats)
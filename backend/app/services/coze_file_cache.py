@@ -0,0 +1,75 @@
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+current_file = Path(__file__).resolve()
+project_root = current_file.parent.parent.parent
+sys.path.append(str(project_root))
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.metrics import metrics
+from app.utils.sqlite_store import SQLiteStore
+
+logger = get_logger(service="coze_file_cache")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS coze_files (
+    digest TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class CozeFileCache:
+    """
+    图片摘要 -> Coze file_id 的复用缓存。
+    相同内容的图片在有效期内只需上传一次，数据保存在本地 SQLite 中供所有 worker 共享。
+    """
+
+    def __init__(self, db_path: Path, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._store = SQLiteStore(db_path, _SCHEMA)
+
+    async def get(self, digest: str) -> Optional[str]:
+        try:
+            rows = await self._store.execute(
+                "SELECT file_id, created_at FROM coze_files WHERE digest = ?", (digest,)
+            )
+        except Exception as e:
+            logger.warning(f"Failed to read coze file cache: {e}")
+            return None
+        if not rows:
+            metrics.incr("coze_file_cache.miss")
+            return None
+        file_id, created_at = rows[0]
+        if time.time() - created_at >= self.ttl_seconds:
+            # 已超过 Coze 文件保留期，视为失效
+            await self.invalidate(digest)
+            metrics.incr("coze_file_cache.miss")
+            return None
+        metrics.incr("coze_file_cache.hit")
+        return file_id
+
+    async def set(self, digest: str, file_id: str) -> None:
+        try:
+            await self._store.execute(
+                "INSERT OR REPLACE INTO coze_files (digest, file_id, created_at) VALUES (?, ?, ?)",
+                (digest, file_id, time.time()),
+            )
+        except Exception as e:
+            logger.warning(f"Failed to write coze file cache: {e}")
+
+    async def invalidate(self, digest: str) -> None:
+        try:
+            await self._store.execute("DELETE FROM coze_files WHERE digest = ?", (digest,))
+        except Exception as e:
+            logger.warning(f"Failed to invalidate coze file cache: {e}")
+
+
+coze_file_cache = CozeFileCache(
+    db_path=Path(settings.COZE_FILE_CACHE_DB),
+    ttl_seconds=settings.COZE_FILE_CACHE_TTL_SECONDS,
+)
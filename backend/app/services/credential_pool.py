@@ -0,0 +1,201 @@
+import hashlib
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+
+current_file = Path(__file__).resolve()
+project_root = current_file.parent.parent.parent
+sys.path.append(str(project_root))
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(service="credential_pool")
+
+# 任务与创建它的 key 的对应关系最多保留的条数
+_AFFINITY_MAX_ENTRIES = 10000
+
+
+def _mask(key: str) -> str:
+    return f"{key[:4]}…{key[-4:]}" if len(key) > 12 else "…"
+
+
+def _strip_bearer(value: str) -> str:
+    return value[7:].strip() if value[:7].lower() == "bearer " else value.strip()
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    """解析 Retry-After（秒数或 HTTP 日期）"""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _remaining_budget(response: httpx.Response) -> Optional[int]:
+    for header in ("x-ratelimit-remaining-requests", "x-ratelimit-remaining"):
+        value = response.headers.get(header)
+        if value is not None:
+            try:
+                return int(float(value))
+            except ValueError:
+                return None
+    return None
+
+
+@dataclass
+class _KeyState:
+    key: str
+    label: str
+    last_used: float = 0.0
+    cooldown_until: float = 0.0
+    remaining: Optional[int] = None
+    requests: int = 0
+    throttled: int = 0
+    errors: int = 0
+
+
+class CredentialPool:
+    """
+    一个服务商的多个 API key：
+    - acquire 按最久未使用（LRU）分配，跳过冷却中的 key；全部冷却时使用最早结束冷却的 key
+    - 上游返回 429 或剩余额度为 0 的 key 进入冷却（有 Retry-After 时按其时长）
+    - 请求结果通过共享 HTTP 客户端的事件钩子上报（按 Authorization 头识别 key），业务代码只需取 key
+    - 异步任务只能用创建它的 key 查询，remember / candidates 记录并优先使用对应的 key
+    """
+
+    def __init__(self, provider: str, keys: Iterable[str], cooldown_seconds: float):
+        self.provider = provider
+        self.cooldown_seconds = cooldown_seconds
+        self._states: Dict[str, _KeyState] = {}
+        for key in keys:
+            key = (key or "").strip()
+            if key and key not in self._states:
+                self._states[key] = _KeyState(key=key, label=f"#{len(self._states)}:{_mask(key)}")
+        self._affinity: "OrderedDict[str, str]" = OrderedDict()
+
+    @property
+    def keys(self) -> List[str]:
+        return list(self._states)
+
+    @staticmethod
+    def _fingerprint(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+    def ref(self, key: str) -> Optional[str]:
+        """池中 key 的引用（不含 key 本身，可以落库）；不在池中时返回 None"""
+        return self._fingerprint(key) if key in self._states else None
+
+    def resolve(self, ref: str) -> Optional[str]:
+        """按引用取回 key；key 已从池中移除时返回 None"""
+        return next((key for key in self._states if self._fingerprint(key) == ref), None)
+
+    def acquire(self) -> str:
+        """取一个 key；未配置任何 key 时返回空字符串（与原先单 key 未配置时的行为一致）"""
+        if not self._states:
+            return ""
+        now = time.monotonic()
+        available = [state for state in self._states.values() if state.cooldown_until <= now]
+        if available:
+            state = min(available, key=lambda s: s.last_used)
+        else:
+            state = min(self._states.values(), key=lambda s: s.cooldown_until)
+            metrics.incr(f"credentials.{self.provider}.all_cooling")
+        state.last_used = now
+        return state.key
+
+    def observe(self, key: str, response: httpx.Response) -> None:
+        """记录一次上游响应：统计请求数，429 或额度耗尽时让该 key 冷却"""
+        state = self._states.get(key)
+        if state is None:
+            return
+        state.requests += 1
+        state.remaining = _remaining_budget(response)
+        if response.status_code == 429 or state.remaining == 0:
+            if response.status_code == 429:
+                state.throttled += 1
+                metrics.incr(f"credentials.{self.provider}.throttled")
+            cooldown = _retry_after(response)
+            state.cooldown_until = time.monotonic() + (self.cooldown_seconds if cooldown is None else cooldown)
+            logger.warning(f"{self.provider} key {state.label} cooling down for {state.cooldown_until - time.monotonic():.1f}s")
+        elif response.status_code >= 500:
+            state.errors += 1
+
+    def remember(self, task_id: str, key: str) -> None:
+        """记录异步任务由哪个 key 创建（只记录池中的 key）"""
+        if not task_id or key not in self._states:
+            return
+        self._affinity[task_id] = key
+        self._affinity.move_to_end(task_id)
+        while len(self._affinity) > _AFFINITY_MAX_ENTRIES:
+            self._affinity.popitem(last=False)
+
+    def candidates(self, task_id: str) -> List[str]:
+        """查询任务时依次尝试的 key：已知创建者时只用它，否则（如其他 worker 创建的任务）尝试全部 key"""
+        key = self._affinity.get(task_id)
+        if key is not None:
+            return [key]
+        if not self._states:
+            return [""]
+        # 冷却中的 key 放在最后
+        now = time.monotonic()
+        return [state.key for state in sorted(self._states.values(), key=lambda s: s.cooldown_until > now)]
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        total = sum(state.requests for state in self._states.values())
+        return {
+            state.label: {
+                "requests": state.requests,
+                "share": round(state.requests / total, 3) if total else 0.0,
+                "throttled": state.throttled,
+                "errors": state.errors,
+                "remaining": state.remaining,
+                "cooldown_seconds": round(max(0.0, state.cooldown_until - now), 1),
+                "idle_seconds": round(now - state.last_used, 1) if state.last_used else None,
+            }
+            for state in self._states.values()
+        }
+
+    def response_hook(self):
+        """httpx 响应钩子：按请求的 Authorization 头把结果记到对应的 key"""
+        async def _on_response(response: httpx.Response) -> None:
+            authorization = response.request.headers.get("authorization")
+            if authorization:
+                self.observe(_strip_bearer(authorization), response)
+        return _on_response
+
+
+def _pool_keys(single: str, many: Iterable[str]) -> List[str]:
+    # 单个 key 的配置放在最前面，与 key 列表合并去重
+    return [key for key in [single, *many] if key]
+
+
+coze_credentials = CredentialPool(
+    "coze", _pool_keys(settings.COZE_AUTHORIZATION, settings.COZE_AUTHORIZATIONS), settings.CREDENTIAL_COOLDOWN_SECONDS
+)
+sora_credentials = CredentialPool(
+    "sora", _pool_keys(settings.SORA_API_KEY, settings.SORA_API_KEYS), settings.CREDENTIAL_COOLDOWN_SECONDS
+)
+tripo_credentials = CredentialPool(
+    "tripo", _pool_keys(settings.TRIPO_API_KEY, settings.TRIPO_API_KEYS), settings.CREDENTIAL_COOLDOWN_SECONDS
+)
+
+metrics.register_collector(
+    "credentials",
+    lambda: {pool.provider: pool.stats() for pool in (coze_credentials, sora_credentials, tripo_credentials)},
+)
@@ -0,0 +1,121 @@
+import sys
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import httpx
+
+current_file = Path(__file__).resolve()
+project_root = current_file.parent.parent.parent
+sys.path.append(str(project_root))
+
+from app.core.crypto import open_secret
+from app.core.logger import get_logger
+from app.services.credential_pool import sora_credentials
+from app.services.image_normalizer import image_normalizer
+from app.services.job_queue import ClaimedJob, JobHandler, PermanentJobError, job_queue
+from app.services.quota_admission import quota_admission
+from app.services.resilience import UpstreamUnavailableError, request_not_sent
+from app.services.sora_service import SoraService
+from app.services.sora_task_watcher import sora_task_watcher
+from app.services.tier_scheduler import upstream_slot
+from app.services.tripo_service import Tripo3DService
+from app.services.upstream_clients import get_sora_http_client
+from app.utils.upload_store import upload_store
+
+logger = get_logger(service="generation_jobs")
+
+
+def _image_path(job: ClaimedJob) -> Path:
+    path = upload_store.root / (job.image_path or "")
+    if not job.image_path or not path.exists():
+        raise PermanentJobError("任务图片不存在")
+    return path
+
+
+def _raise_for_submission(e: Exception) -> None:
+    """
+    提交上游任务不是幂等的：只有确定请求没有被上游处理时（限流、请求未发出、本地排队超时/熔断）才允许任务重试；
+    其他错误（4xx、5xx、读超时等）上游可能已经创建并计费，直接失败，避免重复生成
+    """
+    if isinstance(e, UpstreamUnavailableError) or request_not_sent(e):
+        raise e
+    if isinstance(e, httpx.HTTPStatusError):
+        if e.response.status_code == 429:
+            raise e
+        raise PermanentJobError(f"Upstream API error: {e.response.text}") from e
+    raise PermanentJobError(f"Upstream request failed after submission: {e}") from e
+
+
+def _sora_auth_key(params: Dict[str, Any]) -> Optional[str]:
+    """还原提交时指定的 key（池中 key 的引用或加密保存的 key）；未指定时返回 None，由凭据池分配"""
+    if params.get("auth_key_ref"):
+        key = sora_credentials.resolve(params["auth_key_ref"])
+        if key is None:
+            raise PermanentJobError("任务指定的 key 已不在凭据池中")
+        return key
+    if params.get("auth_key_sealed"):
+        key = open_secret(params["auth_key_sealed"])
+        if key is None:
+            raise PermanentJobError("任务指定的 key 无法解密")
+        return key
+    return None
+
+
+async def run_sora_job(job: ClaimedJob) -> Dict[str, Any]:
+    """Sora 图生图：以异步方式提交上游任务并返回 task_id，之后由服务端轮询，状态通过 /sora/tasks 查询"""
+    params = job.params
+    # 规范化在子进程中读写文件，上传时从结果文件流式发送（base64 模式才读入内存）
+    # 上传存储中的文件名即内容摘要，无需重新计算
+    image_path = _image_path(job)
+    image = await image_normalizer.normalize_path(image_path, "sora", digest=image_path.stem)
+    auth_key = _sora_auth_key(params)
+    service = SoraService(get_sora_http_client())
+    try:
+        async with upstream_slot("sora", params.get("tier")):
+            result = await service.generate_image_from_image(
+                prompt=params["prompt"],
+                image_file=str(image.path),
+                model=params.get("model", "sora_image"),
+                n=params.get("n", 1),
+                size=params.get("size", "1024x1024"),
+                strength=params.get("strength", 0.8),
+                is_async=True,
+                auth_key=auth_key,
+                upload_mode=params.get("upload_mode"),
+            )
+    except Exception as e:
+        _raise_for_submission(e)
+    task_id = result.get("task_id")
+    if not task_id:
+        raise PermanentJobError(f"Upstream response missing task_id: {result}")
+    sora_task_watcher.watch(task_id, auth_key=auth_key)
+    return {"task_id": task_id}
+
+
+async def run_tripo_job(job: ClaimedJob) -> Dict[str, Any]:
+    """Tripo 图生 3D：提交任务并返回 task_id，后续状态通过 /3d-generation/tasks 查询"""
+    service = Tripo3DService()
+    try:
+        async with upstream_slot("tripo", job.params.get("tier")):
+            task_id = await service.submit_task(file_path=_image_path(job))
+        return {"task_id": task_id}
+    except Exception as e:
+        _raise_for_submission(e)
+    finally:
+        await service.close()
+
+
+def _counted(handler: JobHandler) -> JobHandler:
+    """
+    任务成功后计入提交用户的使用次数。以上游 task_id 去重：客户端随后用同一个 task_id
+    调用 /usage/increment 时不会重复计数
+    """
+    async def run(job: ClaimedJob) -> Dict[str, Any]:
+        result = await handler(job)
+        await quota_admission.record(job.user_id, job.kind, result.get("task_id") or job.id)
+        return result
+    return run
+
+
+job_queue.register("sora", _counted(run_sora_job))
+job_queue.register("tripo", _counted(run_tripo_job))
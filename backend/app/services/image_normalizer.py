@@ -0,0 +1,370 @@
+import asyncio
+import hashlib
+import io
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.metrics import metrics
+from app.utils.file_utils import detect_image_type
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 为可选依赖，未安装时图片原样发送
+    Image = None
+    ImageOps = None
+
+logger = get_logger(service="image_normalizer")
+
+_MIME_TYPES = {
+    "jpg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+    "gif": "image/gif",
+    "bmp": "image/bmp",
+}
+_PIL_FORMATS = {"jpg": "JPEG", "png": "PNG", "webp": "WEBP"}
+
+
+@dataclass(frozen=True)
+class ImageProfile:
+    """某个上游服务的图片规格：最长边、输出格式（jpg/png/webp）与压缩质量"""
+    max_edge: int
+    fmt: str
+    quality: int
+
+    @property
+    def signature(self) -> str:
+        # 规格变化后缓存自然失效
+        return f"{self.max_edge}-{self.fmt}-{self.quality}"
+
+
+@dataclass
+class NormalizedImage:
+    data: bytes
+    ext: str
+
+    @property
+    def mime_type(self) -> str:
+        return _MIME_TYPES.get(self.ext, "application/octet-stream")
+
+
+@dataclass
+class NormalizedFile:
+    """规范化结果所在的文件（缓存文件，或原样发送时的原图），供流式上传使用"""
+    path: Path
+    ext: str
+
+    @property
+    def mime_type(self) -> str:
+        return _MIME_TYPES.get(self.ext, "application/octet-stream")
+
+
+def _normalize_fmt(fmt: str) -> str:
+    fmt = fmt.lower()
+    return "jpg" if fmt == "jpeg" else fmt
+
+
+PROFILES: Dict[str, ImageProfile] = {
+    "coze": ImageProfile(settings.IMAGE_MAX_EDGE_COZE, _normalize_fmt(settings.IMAGE_NORMALIZE_FORMAT), settings.IMAGE_NORMALIZE_QUALITY),
+    "sora": ImageProfile(settings.IMAGE_MAX_EDGE_SORA, _normalize_fmt(settings.IMAGE_NORMALIZE_FORMAT), settings.IMAGE_NORMALIZE_QUALITY),
+    "tripo": ImageProfile(settings.IMAGE_MAX_EDGE_TRIPO, _normalize_fmt(settings.IMAGE_NORMALIZE_FORMAT), settings.IMAGE_NORMALIZE_QUALITY),
+}
+
+
+def _normalize_sync(data: bytes, max_edge: int, fmt: str, quality: int) -> Optional[Tuple[bytes, str]]:
+    """
+    在子进程中执行：按 EXIF 方向旋转、缩放到最长边、重新编码（不写入 EXIF）。
+    返回 None 表示应原样发送：动图，或无需缩放、没有 EXIF 且重新编码后不会更小的图片。
+    """
+    with Image.open(io.BytesIO(data)) as src:
+        # 重新编码只会保留第一帧，动图原样发送
+        if getattr(src, "is_animated", False):
+            return None
+        has_exif = len(src.getexif()) > 0
+        img = ImageOps.exif_transpose(src)
+        resized = max(img.size) > max_edge
+        if resized:
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        # JPEG 不支持透明通道，带透明背景的图片（如抠图后的 3D 素材）改用 PNG
+        out_fmt = "png" if fmt == "jpg" and has_alpha else fmt
+        if out_fmt == "jpg":
+            img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGBA" if has_alpha else "RGB")
+
+        options = {"optimize": True}
+        if out_fmt in ("jpg", "webp"):
+            options["quality"] = quality
+        buf = io.BytesIO()
+        img.save(buf, format=_PIL_FORMATS[out_fmt], **options)
+        out = buf.getvalue()
+        if not resized and not has_exif and len(out) >= len(data):
+            return None
+        return out, out_fmt
+
+
+def _normalize_file_sync(src: str, dst: str, max_edge: int, fmt: str, quality: int) -> Optional[str]:
+    """在子进程中执行：从 src 读取原图，结果写入 dst，父进程不持有图片内容；返回输出格式，None 表示原样发送"""
+    result = _normalize_sync(Path(src).read_bytes(), max_edge, fmt, quality)
+    if result is None:
+        return None
+    out, ext = result
+    Path(dst).write_bytes(out)
+    return ext
+
+
+def _file_digest(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(settings.UPLOAD_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _sniff_ext(path: Path) -> str:
+    with open(path, "rb") as f:
+        return detect_image_type(f.read(16)) or "jpg"
+
+
+class ImageNormalizer:
+    """
+    发送到上游（Coze / Sora / Tripo）前的图片规范化：
+    - 按服务商限制最长边、去除 EXIF、按方向旋转，并重新编码为体积更小的格式
+    - 在进程池中执行，不阻塞事件循环
+    - 结果按 原图 SHA-256 + 规格 缓存到磁盘，相同图片只处理一次；
+      定期清理长时间未使用的文件，总大小超出上限时从最久未使用的开始删除
+    """
+
+    def __init__(
+        self,
+        profiles: Dict[str, ImageProfile],
+        cache_dir: Optional[Path],
+        workers: int,
+        enabled: bool = True,
+        cache_max_age: float = 7 * 86400,
+        cache_max_bytes: int = 0,
+        sweep_interval: float = 3600,
+    ):
+        self.profiles = profiles
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.enabled = enabled and Image is not None
+        self.cache_max_age = cache_max_age
+        self.cache_max_bytes = cache_max_bytes
+        self.sweep_interval = sweep_interval
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._sweeper: Optional[asyncio.Task] = None
+        if enabled and Image is None:
+            logger.warning("Pillow is not installed, images are sent to upstream unchanged")
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _cache_path(self, profile_name: str, profile: ImageProfile, digest: str, ext: str) -> Path:
+        return self.cache_dir / f"{profile_name}-{profile.signature}" / digest[:2] / f"{digest}.{ext}"
+
+    def _find_cache(self, profile_name: str, profile: ImageProfile, digest: str) -> Optional[NormalizedFile]:
+        # 原样发送的图片也会缓存（保留原扩展名），避免重复解码
+        for ext in dict.fromkeys((profile.fmt, "png", *_MIME_TYPES)):
+            path = self._cache_path(profile_name, profile, digest, ext)
+            if path.exists():
+                # 命中时刷新修改时间，清理按最近使用时间计算
+                os.utime(path)
+                return NormalizedFile(path, ext)
+        return None
+
+    def _read_cache(self, profile_name: str, profile: ImageProfile, digest: str) -> Optional[NormalizedImage]:
+        found = self._find_cache(profile_name, profile, digest)
+        return NormalizedImage(found.path.read_bytes(), found.ext) if found is not None else None
+
+    def _write_cache(self, profile_name: str, profile: ImageProfile, digest: str, image: NormalizedImage) -> None:
+        path = self._cache_path(profile_name, profile, digest, image.ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.part")
+        tmp_path.write_bytes(image.data)
+        os.replace(tmp_path, path)
+
+    def sweep_sync(self) -> Dict[str, Any]:
+        """删除超过 cache_max_age 未使用的缓存文件（含遗留的临时文件）；总大小超出上限时再从最久未使用的开始删除"""
+        if self.cache_dir is None or not self.cache_dir.exists():
+            return {"deleted": 0, "total_size": 0}
+        cutoff = time.time() - self.cache_max_age
+        deleted = 0
+        kept = []
+        # 目录结构：<profile>-<signature>/<摘要前两位>/<摘要>.<ext>；规格变化后旧目录中的文件同样会过期删除
+        for path in self.cache_dir.glob("*/*/*"):
+            try:
+                stat = path.stat()
+                if stat.st_mtime < cutoff:
+                    path.unlink(missing_ok=True)
+                    deleted += 1
+                elif not path.name.endswith(".part"):
+                    kept.append((stat.st_mtime, stat.st_size, path))
+            except OSError as e:
+                logger.warning(f"Failed to sweep normalized image cache file {path}: {e}")
+
+        total_size = sum(size for _, size, _ in kept)
+        if self.cache_max_bytes > 0 and total_size > self.cache_max_bytes:
+            kept.sort()
+            for _, size, path in kept:
+                if total_size <= self.cache_max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                deleted += 1
+                total_size -= size
+        if deleted:
+            metrics.incr("image_normalize.cache_swept", deleted)
+        return {"deleted": deleted, "total_size": total_size}
+
+    async def _sweep_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                result = await loop.run_in_executor(None, self.sweep_sync)
+                if result["deleted"]:
+                    logger.info(f"Normalized image cache sweep: deleted {result['deleted']} files, {result['total_size']} bytes kept")
+            except Exception as e:
+                logger.warning(f"Normalized image cache sweep failed: {e}")
+            await asyncio.sleep(self.sweep_interval)
+
+    def start(self) -> None:
+        """启动缓存目录的定期清理"""
+        if self.cache_dir is not None and self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop(), name="image-normalize-cache-sweep")
+
+    async def stop(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    async def normalize(self, data: bytes, profile_name: str, digest: Optional[str] = None) -> NormalizedImage:
+        """
+        返回适合发送给指定服务商的图片；未安装 Pillow、未开启或处理失败时返回原图。
+
+        Args:
+            data: 原图内容
+            profile_name: coze / sora / tripo
+            digest: 原图 SHA-256，未提供时在此计算
+        """
+        original = NormalizedImage(data, detect_image_type(data[:16]) or "jpg")
+        if not self.enabled:
+            return original
+
+        profile = self.profiles[profile_name]
+        digest = digest or hashlib.sha256(data).hexdigest()
+        if self.cache_dir is not None:
+            cached = await asyncio.to_thread(self._read_cache, profile_name, profile, digest)
+            if cached is not None:
+                metrics.incr("image_normalize.cache_hit")
+                return cached
+            metrics.incr("image_normalize.cache_miss")
+
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(
+                self._get_pool(), _normalize_sync, data, profile.max_edge, profile.fmt, profile.quality
+            )
+        except BrokenProcessPool:
+            # 子进程异常退出时重建进程池，本次原样发送
+            logger.error("Image normalizer process pool is broken, recreating")
+            self._pool = None
+            return original
+        except Exception as e:
+            logger.warning(f"Failed to normalize image {digest[:12]} for {profile_name}: {e}")
+            return original
+
+        if result is None:
+            metrics.incr("image_normalize.passthrough")
+            image = original
+        else:
+            image = NormalizedImage(*result)
+        metrics.incr("image_normalize.bytes_in", len(data))
+        metrics.incr("image_normalize.bytes_out", len(image.data))
+        if self.cache_dir is not None:
+            try:
+                await asyncio.to_thread(self._write_cache, profile_name, profile, digest, image)
+            except Exception as e:
+                logger.warning(f"Failed to write normalized image cache: {e}")
+        return image
+
+    async def normalize_path(self, file_path: Path, profile_name: str, digest: Optional[str] = None) -> NormalizedFile:
+        """
+        与 normalize 相同，但输入输出都是文件：子进程直接读写文件，返回缓存文件路径供流式上传，
+        父进程不持有图片内容。没有缓存目录、未开启或处理失败时返回原图路径。
+        """
+        file_path = Path(file_path)
+        if not self.enabled or self.cache_dir is None:
+            return NormalizedFile(file_path, await asyncio.to_thread(_sniff_ext, file_path))
+
+        profile = self.profiles[profile_name]
+        digest = digest or await asyncio.to_thread(_file_digest, file_path)
+        cached = await asyncio.to_thread(self._find_cache, profile_name, profile, digest)
+        if cached is not None:
+            metrics.incr("image_normalize.cache_hit")
+            return cached
+        metrics.incr("image_normalize.cache_miss")
+
+        # 临时文件与缓存文件在同一目录，完成后原子替换；同一进程内可能并发处理同一张图，文件名加随机后缀
+        tmp_path = self._cache_path(profile_name, profile, digest, profile.fmt).with_name(f"{digest}.{uuid.uuid4().hex}.part")
+        loop = asyncio.get_running_loop()
+        path = None
+        try:
+            await asyncio.to_thread(tmp_path.parent.mkdir, parents=True, exist_ok=True)
+            ext = await loop.run_in_executor(
+                self._get_pool(), _normalize_file_sync, str(file_path), str(tmp_path),
+                profile.max_edge, profile.fmt, profile.quality,
+            )
+            if ext is None:
+                metrics.incr("image_normalize.passthrough")
+                ext = await asyncio.to_thread(_sniff_ext, file_path)
+                await asyncio.to_thread(shutil.copyfile, file_path, tmp_path)
+            cache_path = self._cache_path(profile_name, profile, digest, ext)
+            await asyncio.to_thread(os.replace, tmp_path, cache_path)
+            path = cache_path
+        except BrokenProcessPool:
+            logger.error("Image normalizer process pool is broken, recreating")
+            self._pool = None
+        except Exception as e:
+            logger.warning(f"Failed to normalize image {digest[:12]} for {profile_name}: {e}")
+        if path is None:
+            # 处理失败时原样发送
+            await asyncio.to_thread(tmp_path.unlink, missing_ok=True)
+            return NormalizedFile(file_path, await asyncio.to_thread(_sniff_ext, file_path))
+
+        metrics.incr("image_normalize.bytes_in", file_path.stat().st_size)
+        metrics.incr("image_normalize.bytes_out", path.stat().st_size)
+        return NormalizedFile(path, ext)
+
+    async def normalize_file(self, file_path: Path, profile_name: str, digest: Optional[str] = None) -> NormalizedImage:
+        data = await asyncio.to_thread(Path(file_path).read_bytes)
+        return await self.normalize(data, profile_name, digest=digest)
+
+
+image_normalizer = ImageNormalizer(
+    profiles=PROFILES,
+    cache_dir=Path(settings.IMAGE_NORMALIZE_CACHE_DIR) if settings.IMAGE_NORMALIZE_CACHE_DIR else None,
+    workers=settings.IMAGE_NORMALIZE_WORKERS,
+    enabled=settings.IMAGE_NORMALIZE_ENABLED,
+    cache_max_age=settings.IMAGE_NORMALIZE_CACHE_MAX_AGE_SECONDS,
+    cache_max_bytes=settings.IMAGE_NORMALIZE_CACHE_MAX_BYTES,
+    sweep_interval=settings.IMAGE_NORMALIZE_CACHE_SWEEP_INTERVAL_SECONDS,
+)
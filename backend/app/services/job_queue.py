@@ -0,0 +1,330 @@
+import asyncio
+import json
+import os
+import socket
+import sys
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import and_, func, or_, select, update
+
+current_file = Path(__file__).resolve()
+project_root = current_file.parent.parent.parent
+sys.path.append(str(project_root))
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.logger import get_logger
+from app.core.metrics import metrics
+from app.models.generation_job import GenerationJob
+
+logger = get_logger(service="job_queue")
+
+
+class PermanentJobError(Exception):
+    """不可重试的失败（如参数错误、上游 4xx），任务直接标记为失败"""
+
+
+@dataclass
+class ClaimedJob:
+    """worker 领取到的任务（与数据库会话解耦的快照）"""
+    id: str
+    kind: str
+    user_id: Optional[int]
+    params: Dict[str, Any]
+    image_path: Optional[str]
+    attempts: int
+    max_attempts: int
+
+
+JobHandler = Callable[[ClaimedJob], Awaitable[Dict[str, Any]]]
+
+
+def job_to_dict(job: GenerationJob) -> Dict[str, Any]:
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+    }
+
+
+class JobQueue:
+    """
+    基于数据库的持久化任务队列 + asyncio worker 池：
+    - 提交只写入一行记录，立即返回 job_id；worker 通过 SELECT ... FOR UPDATE SKIP LOCKED 领取任务，多进程安全
+    - 领取时获得租约，执行期间定期续约；进程崩溃后租约过期，任务会被其他（或重启后的）worker 重新领取
+    - 可重试的失败按指数退避重新排队，超过最大次数后标记为失败
+    """
+
+    def __init__(
+        self,
+        worker_count: int,
+        lease_seconds: float,
+        poll_interval: float,
+        max_attempts: int,
+        retry_base_seconds: float,
+    ):
+        self.worker_count = worker_count
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, JobHandler] = {}
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[str, ClaimedJob] = {}
+        self._wakeup = asyncio.Event()
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        self._handlers[kind] = handler
+
+    async def enqueue(
+        self,
+        kind: str,
+        params: Dict[str, Any],
+        image_path: Optional[str] = None,
+        user_id: Optional[int] = None,
+    ) -> str:
+        """写入一个待执行任务并返回 job_id"""
+        if kind not in self._handlers:
+            raise ValueError(f"未知的任务类型: {kind}")
+        job_id = uuid.uuid4().hex
+        async with AsyncSessionLocal() as session:
+            session.add(GenerationJob(
+                id=job_id,
+                kind=kind,
+                status="queued",
+                user_id=user_id,
+                params=json.dumps(params, ensure_ascii=False),
+                image_path=image_path,
+                attempts=0,
+                max_attempts=self.max_attempts,
+                available_at=datetime.now(),
+            ))
+            await session.commit()
+        metrics.incr(f"job_queue.{kind}.enqueued")
+        self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id: str, user_id: int) -> Optional[Dict[str, Any]]:
+        """查询任务；只返回属于 user_id 的任务"""
+        async with AsyncSessionLocal() as session:
+            job = await session.get(GenerationJob, job_id)
+            return job_to_dict(job) if job and job.user_id == user_id else None
+
+    async def outstanding(self, user_id: int) -> int:
+        """用户排队中或执行中的任务数"""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(func.count()).select_from(GenerationJob).where(
+                    GenerationJob.user_id == user_id,
+                    GenerationJob.status.in_(("queued", "running")),
+                )
+            )
+            return int(result.scalar_one())
+
+    async def _claim(self) -> Optional[ClaimedJob]:
+        """领取一个可执行的任务：排队中且已到执行时间，或租约已过期（原 worker 崩溃）"""
+        now = datetime.now()
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                result = await session.execute(
+                    select(GenerationJob)
+                    .where(or_(
+                        and_(GenerationJob.status == "queued", GenerationJob.available_at <= now),
+                        and_(GenerationJob.status == "running", GenerationJob.lease_expires_at < now),
+                    ))
+                    .order_by(GenerationJob.available_at)
+                    .limit(1)
+                    .with_for_update(skip_locked=True)
+                )
+                job = result.scalar_one_or_none()
+                if job is None:
+                    return None
+                if job.status == "running":
+                    metrics.incr(f"job_queue.{job.kind}.recovered")
+                    logger.warning(f"Recovering job {job.id} from expired lease of {job.lease_owner}")
+                # 以读到的状态为条件更新，保证同一任务只会被一个 worker 领取
+                snapshot = ClaimedJob(
+                    id=job.id,
+                    kind=job.kind,
+                    user_id=job.user_id,
+                    params=json.loads(job.params),
+                    image_path=job.image_path,
+                    attempts=job.attempts + 1,
+                    max_attempts=job.max_attempts,
+                )
+                guard = (
+                    GenerationJob.id == job.id,
+                    GenerationJob.status == job.status,
+                    GenerationJob.attempts == job.attempts,
+                )
+                if job.status == "running" and job.attempts >= job.max_attempts:
+                    await session.execute(
+                        update(GenerationJob).where(*guard).values(
+                            status="failed",
+                            error=job.error or "任务执行中断次数过多",
+                            lease_owner=None,
+                            lease_expires_at=None,
+                        )
+                    )
+                    return None
+                claimed = await session.execute(
+                    update(GenerationJob).where(*guard).values(
+                        status="running",
+                        attempts=snapshot.attempts,
+                        lease_owner=self.owner,
+                        lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                    )
+                )
+                return snapshot if claimed.rowcount else None
+
+    async def _update_owned(self, job_id: str, **values) -> bool:
+        """只更新仍由本 worker 持有租约的任务，租约已被接管时不覆盖结果"""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(GenerationJob)
+                .where(GenerationJob.id == job_id, GenerationJob.lease_owner == self.owner)
+                .values(**values)
+            )
+            await session.commit()
+            return result.rowcount > 0
+
+    async def _heartbeat(self, job_id: str, work: asyncio.Task) -> None:
+        """定期续约；租约已被其他 worker 接管时取消正在执行的任务后返回"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await self._update_owned(
+                    job_id, lease_expires_at=datetime.now() + timedelta(seconds=self.lease_seconds)
+                )
+            except Exception as e:
+                logger.warning(f"Failed to renew lease of job {job_id}: {e}")
+                continue
+            if not renewed:
+                # 续约失败期间租约过期，任务已被重新领取；继续执行会重复调用上游（重复计费）
+                logger.error(f"Lost lease of job {job_id}, cancelling it")
+                metrics.incr("job_queue.lease_lost")
+                work.cancel()
+                return
+
+    async def _execute(self, job: ClaimedJob) -> None:
+        handler = self._handlers.get(job.kind)
+        if handler is None:
+            await self._update_owned(
+                job.id, status="failed", error=f"未知的任务类型: {job.kind}", lease_owner=None, lease_expires_at=None
+            )
+            metrics.incr(f"job_queue.{job.kind}.failed")
+            return
+        work = asyncio.create_task(handler(job), name=f"job-{job.id}")
+        heartbeat = asyncio.create_task(self._heartbeat(job.id, work))
+        self._running[job.id] = job
+        try:
+            result = await work
+        except asyncio.CancelledError:
+            if heartbeat.done() and not heartbeat.cancelled():
+                # 租约丢失：任务由新的持有者负责，这里不再更新
+                return
+            raise
+        except Exception as e:
+            retryable = not isinstance(e, PermanentJobError) and job.attempts < job.max_attempts
+            logger.error(f"Job {job.id} ({job.kind}) attempt {job.attempts} failed: {e}")
+            if retryable:
+                delay = self.retry_base_seconds * (2 ** (job.attempts - 1))
+                await self._update_owned(
+                    job.id,
+                    status="queued",
+                    error=str(e),
+                    available_at=datetime.now() + timedelta(seconds=delay),
+                    lease_owner=None,
+                    lease_expires_at=None,
+                )
+                metrics.incr(f"job_queue.{job.kind}.retried")
+            else:
+                await self._update_owned(
+                    job.id, status="failed", error=str(e), lease_owner=None, lease_expires_at=None
+                )
+                metrics.incr(f"job_queue.{job.kind}.failed")
+        else:
+            await self._update_owned(
+                job.id,
+                status="succeeded",
+                result=json.dumps(result, ensure_ascii=False),
+                error=None,
+                lease_owner=None,
+                lease_expires_at=None,
+            )
+            metrics.incr(f"job_queue.{job.kind}.succeeded")
+        finally:
+            heartbeat.cancel()
+            self._running.pop(job.id, None)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker {index} failed to claim a job: {e}")
+                job = None
+            if job is None:
+                # 没有可执行的任务：等待新提交的通知或轮询间隔
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._execute(job)
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"job-worker-{i}") for i in range(self.worker_count)
+        ]
+        logger.info(f"Job queue started: {self.worker_count} workers, owner={self.owner}")
+
+    async def stop(self) -> None:
+        """停止 worker；执行中的任务放回队列（不计入尝试次数），重启后立即重新执行"""
+        running = list(self._running.values())
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for job in running:
+            try:
+                await self._update_owned(
+                    job.id,
+                    status="queued",
+                    attempts=job.attempts - 1,
+                    available_at=datetime.now(),
+                    lease_owner=None,
+                    lease_expires_at=None,
+                )
+            except Exception as e:
+                logger.warning(f"Failed to requeue job {job.id} on shutdown: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": len(self._workers), "running": len(self._running)}
+
+
+job_queue = JobQueue(
+    worker_count=settings.JOB_WORKERS,
+    lease_seconds=settings.JOB_LEASE_SECONDS,
+    poll_interval=settings.JOB_POLL_INTERVAL,
+    max_attempts=settings.JOB_MAX_ATTEMPTS,
+    retry_base_seconds=settings.JOB_RETRY_BASE_SECONDS,
+)
+
+metrics.register_collector("job_queue", job_queue.stats)
@@ -10,6 +10,7 @@ from app.core.config import settings, ServiceType
 from app.services.picture_analysis_service import PictureAnalysisService
 from app.services.tripo_service import Tripo3DService
 from app.services.sora_service import SoraService
+from app.services.upstream_clients import get_coze_client, get_sora_http_client
 from app.services.styles_prompt_services import (
     AmericanComicStylePromptGenerationService,
     CuteStylePromptGenerationService,
@@ -25,47 +26,47 @@ class LLMFactory:
     @staticmethod
     def create_picture_analysis_service():
         """创建图片分析服务"""
-        return PictureAnalysisService()
+        return PictureAnalysisService(get_coze_client())
 
     @staticmethod
     def create_cute_style_prompt_generation_service():
         """创建可爱风格提示生成服务"""
-        return CuteStylePromptGenerationService()
+        return CuteStylePromptGenerationService(get_coze_client())
 
     @staticmethod
     def create_american_comic_style_prompt_generation_service():
         """创建美国漫画风格提示生成服务"""
-        return AmericanComicStylePromptGenerationService()
+        return AmericanComicStylePromptGenerationService(get_coze_client())
 
     @staticmethod
     def create_japanese_comic_style_prompt_generation_service():
         """创建日本漫画风格提示生成服务"""
-        return JapaneseComicStylePromptGenerationService()
+        return JapaneseComicStylePromptGenerationService(get_coze_client())
 
     @staticmethod
     def create_cyberpunk_style_prompt_generation_service():
         """创建赛博朋克风格提示生成服务"""
-        return CyberpunkStylePromptGenerationService()
+        return CyberpunkStylePromptGenerationService(get_coze_client())
 
     @staticmethod
     def create_gothic_style_prompt_generation_service():
         """创建哥特风格提示生成服务"""
-        return GothicStylePromptGenerationService()
+        return GothicStylePromptGenerationService(get_coze_client())
 
     @staticmethod
     def create_profession_style_prompt_generation_service():
         """创建职业风格提示生成服务"""
-        return ProfessionStylePromptGenerationService()
+        return ProfessionStylePromptGenerationService(get_coze_client())
 
     @staticmethod
     def create_realistic_style_prompt_generation_service():
         """创建真实风格提示生成服务"""
-        return RealisticStylePromptGenerationService()
+        return RealisticStylePromptGenerationService(get_coze_client())
 
     @staticmethod
     def create_steampunk_style_prompt_generation_service():
         """创建蒸汽朋克风格提示生成服务"""
-        return SteampunkStylePromptGenerationService()
+        return SteampunkStylePromptGenerationService(get_coze_client())
 
     @staticmethod
     def create_tripo_3D_image_to_3D_service():
@@ -75,7 +76,7 @@ class LLMFactory:
     @staticmethod
     def create_sora_service():
         '''Sora 服务'''
-        return SoraService()
+        return SoraService(get_sora_http_client())
 
 
 
@@ -2,6 +2,7 @@ import os
 import sys
 import asyncio
 import uuid  # 添加uuid模块导入
+import hashlib
 from pathlib import Path
 from typing import List, Dict, Optional, AsyncGenerator
 from cozepy import AsyncCoze, TokenAuth, Message, ChatEventType, MessageObjectString
@@ -11,27 +12,54 @@ project_root = current_file.parent.parent.parent
 sys.path.append(str(project_root))
 
 from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.stream_events import StreamEvent, DeltaEvent, UsageEvent, DoneEvent, ErrorEvent
+from app.services.resilience import SUCCESS, UpstreamUnavailableError, classify, coze_guard
+from app.services.coze_file_cache import coze_file_cache
+from app.services.image_normalizer import image_normalizer
+
+
+def _chat_outcome(event) -> Optional[str]:
+    """对话完成或出错事件决定本次上游调用的结果（供调用保护统计）"""
+    if event.event == ChatEventType.CONVERSATION_CHAT_COMPLETED:
+        return SUCCESS
+    if event.event == ChatEventType.ERROR:
+        return classify(event.error)
+    return None
+
+
+async def _cancel_chat(coze: AsyncCoze, conversation_id: str, chat_id: str) -> None:
+    """通知 Coze 取消进行中的对话，尽力而为：超时或失败只计数，不影响流的关闭"""
+    try:
+        await asyncio.wait_for(
+            coze.chat.cancel(conversation_id=conversation_id, chat_id=chat_id),
+            timeout=settings.COZE_CANCEL_TIMEOUT_SECONDS,
+        )
+    except Exception:
+        metrics.incr("coze.chat_cancel_failed")
+
 
 class PictureAnalysisService:
     '''异步的Coze服务类'''
     
-    def __init__(self):
+    def __init__(self, coze: Optional[AsyncCoze] = None):
         self.base_url = settings.COZE_BASE_URL
         self.authorization = settings.COZE_AUTHORIZATION
         self.bot_id = settings.PICTURE_ANALYSIS_BOT_ID
         self.user_id = uuid.uuid4().hex
-        # 使用异步Coze客户端替代同步客户端
-        self.coze = AsyncCoze(
+        # 优先使用注入的共享客户端（进程级连接池），未注入时才单独创建
+        self.coze = coze or AsyncCoze(
             auth=TokenAuth(token=self.authorization), 
             base_url=self.base_url
         )
     
-    async def upload_local_image(self, file_path: str) -> str:
+    async def upload_local_image(self, file_path: str, digest: Optional[str] = None) -> str:
         """
         上传本地图片并返回file_id
         
         Args:
             file_path: 本地图片文件路径
+            digest: 图片内容的 SHA-256，已知时可直接命中 file_id 缓存而无需读取文件
             
         Returns:
             上传成功后的file_id
@@ -40,6 +68,12 @@ class PictureAnalysisService:
             RuntimeError: 上传失败时抛出异常
         """
         try:
+            # 相同内容的图片在有效期内已上传过，直接复用 file_id
+            if digest:
+                cached_file_id = await coze_file_cache.get(digest)
+                if cached_file_id:
+                    return cached_file_id
+
             # 检查文件是否存在
             if not os.path.exists(file_path):
                 raise FileNotFoundError(f"图片文件不存在: {file_path}")
@@ -59,15 +93,49 @@ class PictureAnalysisService:
             
             # 通过线程池执行同步读取
             file_content = await loop.run_in_executor(None, sync_read_file)
+            return await self.upload_image_bytes(file_content, digest=digest)
             
-            # 上传文件内容
-            response = await self.coze.files.upload(
-                file=file_content  # 传递文件内容字节流
-            )
+        except UpstreamUnavailableError:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"图片上传失败: {str(e)}")
+
+    async def upload_image_bytes(self, data: bytes, digest: Optional[str] = None) -> str:
+        """
+        直接上传内存中的图片内容并返回file_id，省去先落盘再读回的开销
+        
+        Args:
+            data: 图片内容字节
+            digest: 图片内容的 SHA-256，未提供时在此计算
             
+        Returns:
+            上传成功后的file_id
+            
+        Raises:
+            RuntimeError: 上传失败时抛出异常
+        """
+        try:
+            if not digest:
+                digest = hashlib.sha256(data).hexdigest()
+            # 相同内容的图片在有效期内已上传过，直接复用 file_id
+            cached_file_id = await coze_file_cache.get(digest)
+            if cached_file_id:
+                return cached_file_id
+            
+            # 缩放、去除 EXIF 后再上传，减少上传体积与分析耗时
+            image = await image_normalizer.normalize(data, "coze", digest=digest)
+
+            # 上传文件内容
+            # 上传可以安全重试（重复上传只会多一个未使用的文件）
+            response = await coze_guard.call(lambda: self.coze.files.upload(
+                file=image.data  # 传递文件内容字节流
+            ))
+            await coze_file_cache.set(digest, response.id)
             
             return response.id
             
+        except UpstreamUnavailableError:
+            raise
         except Exception as e:
             raise RuntimeError(f"图片上传失败: {str(e)}")
     
@@ -75,7 +143,10 @@ class PictureAnalysisService:
         self, 
         objects: List[MessageObjectString], 
         meta_data: Optional[Dict[str, str]] = None
-    ) -> AsyncGenerator[str, None]:
+    ) -> AsyncGenerator[StreamEvent, None]:
+        stream = None
+        finished = False
+        chat = None
         try:
             user_message = Message.build_user_question_objects(
                 objects=objects, 
@@ -83,22 +154,45 @@ class PictureAnalysisService:
             )
             
             # 直接调用异步stream方法，返回异步生成器
-            async for event in self.coze.chat.stream(
+            stream = coze_guard.stream(self.coze.chat.stream(
                 bot_id=self.bot_id,
                 user_id=self.user_id,
                 additional_messages=[user_message],
-            ):
-                if event.event == ChatEventType.CONVERSATION_MESSAGE_DELTA:
-                    # 添加空内容过滤
-                    if event.message.content.strip():
-                        yield f"data: {event.message.content}\n\n"
+            ), outcome_of=_chat_outcome)
+            async for event in stream:
+                if event.event == ChatEventType.CONVERSATION_CHAT_CREATED:
+                    # 记录对话 ID，提前断开时用于取消
+                    chat = event.chat
+                elif event.event == ChatEventType.CONVERSATION_MESSAGE_DELTA:
+                    # 只过滤空内容，保留增量中的空白字符
+                    if event.message.content:
+                        yield DeltaEvent(event.message.content)
                 elif event.event == ChatEventType.CONVERSATION_CHAT_COMPLETED:
-                    print(f"Token使用量: {event.chat.usage.token_count}")
-                    # 添加结束信号
-                    yield "data: [DONE]\n\n"
+                    finished = True
+                    yield UsageEvent(event.chat.usage.token_count)
+                    yield DoneEvent()
                     break
                 elif event.event == ChatEventType.ERROR:
-                    raise Exception(f"Coze API错误: {event.error}")
+                    finished = True
+                    yield ErrorEvent(f"Coze API错误: {event.error}")
+                    break
+            finished = True
                     
+        except UpstreamUnavailableError:
+            finished = True
+            raise
         except Exception as e:
-            raise RuntimeError(f"调用Coze服务失败: {str(e)}")
\ No newline at end of file
+            finished = True
+            raise RuntimeError(f"调用Coze服务失败: {str(e)}")
+        finally:
+            try:
+                if not finished:
+                    # 消费方提前关闭（如客户端断开），对话被中途取消
+                    metrics.incr("coze.chat_cancelled")
+                    # 仅关闭连接时 Coze 仍会把对话跑完并计费，需显式取消
+                    if chat is not None:
+                        await _cancel_chat(self.coze, chat.conversation_id, chat.id)
+            finally:
+                # 及时关闭上游流，释放连接，不再继续接收（和计费）后续内容
+                if stream is not None and hasattr(stream, "aclose"):
+                    await stream.aclose()
\ No newline at end of file
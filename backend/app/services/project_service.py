@@ -10,9 +10,15 @@ sys.path.append(str(project_root))
 
 from app.models.project import Project
 from app.schemas.project import ProjectCreate, ProjectUpdate
+from app.utils.upload_store import upload_store
 
 
 class ProjectService:
+    """
+    项目的增删改查。项目的 image_url 是上传文件的长期引用：
+    先增加新图片的引用再提交，提交成功后再释放旧图片的引用（失败时只会多计，不会误删文件）
+    """
+
     def __init__(self, db: AsyncSession):
         self.db = db
 
@@ -25,6 +31,7 @@ class ProjectService:
             analysis_text=data.analysis_text,
             prompt_text=data.prompt_text,
         )
+        await upload_store.retain_url(data.image_url)
         self.db.add(project)
         await self.db.commit()
         await self.db.refresh(project)
@@ -44,20 +51,27 @@ class ProjectService:
         project = await self.get_project(user_id, project_id)
         if not project:
             return None
+        old_image_url = project.image_url
+        if data.image_url is not None and data.image_url != old_image_url:
+            await upload_store.retain_url(data.image_url)
         for field in ["title", "style", "image_url", "analysis_text", "prompt_text"]:
             value = getattr(data, field)
             if value is not None:
                 setattr(project, field, value)
         await self.db.commit()
         await self.db.refresh(project)
+        if project.image_url != old_image_url:
+            await upload_store.release_url(old_image_url)
         return project
 
     async def delete_project(self, user_id: int, project_id: int) -> bool:
         project = await self.get_project(user_id, project_id)
         if not project:
             return False
+        image_url = project.image_url
         await self.db.delete(project)
         await self.db.commit()
+        await upload_store.release_url(image_url)
         return True
 
 
@@ -0,0 +1,181 @@
+import asyncio
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select
+
+current_file = Path(__file__).resolve()
+project_root = current_file.parent.parent.parent
+sys.path.append(str(project_root))
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.logger import get_logger
+from app.core.metrics import metrics
+from app.core.user_types import max_usage
+from app.models.usage import UsageCounter
+from app.services.usage_service import UsageService
+
+logger = get_logger(service="quota_admission")
+
+
+@dataclass
+class _Counter:
+    # user_usage 中的已用次数（本进程最近一次读取或写入后的值）
+    used: int
+    loaded_at: float
+    # 已预留（上游调用进行中）的次数
+    reserved: int = 0
+
+
+@dataclass
+class Reservation:
+    """一次额度预留；commit 计入使用次数，release 归还（已 commit 时为空操作）"""
+    user_id: Optional[int]
+    service_type: str
+    done: bool = False
+
+
+class QuotaAdmission:
+    """
+    调用上游前的额度准入：
+    - 每个用户的已用次数缓存在进程内（只用于读取），检查与预留不访问数据库；预留计入占用，防止并发请求超额
+    - 调用成功后 commit：任务记录（usage_tasks）与计数（user_usage）在同一个事务中写入（UsageService），
+      进程退出不会丢失计数；客户端随后以相同 task_id 调用 /usage/increment 会被去重
+    - 调用失败时 release 归还预留
+    - 多 worker 时各自缓存计数，空闲的计数每隔 refresh_seconds 从数据库重新加载
+    """
+
+    def __init__(self, enforced: bool, refresh_seconds: float):
+        self.enforced = enforced
+        self.refresh_seconds = refresh_seconds
+        self._counters: Dict[int, _Counter] = {}
+        self._load_locks: Dict[int, asyncio.Lock] = {}
+        # 缓存的用户数达到该值时清理空闲的计数（摊销，避免每次加载都遍历）
+        self._evict_at = 1024
+
+    def _is_fresh(self, counter: Optional[_Counter]) -> bool:
+        if counter is None:
+            return False
+        if counter.reserved:
+            # 有进行中的预留时不清理计数
+            return True
+        return time.monotonic() - counter.loaded_at < self.refresh_seconds
+
+    async def _counter(self, user_id: int) -> _Counter:
+        counter = self._counters.get(user_id)
+        if self._is_fresh(counter):
+            return counter
+        lock = self._load_locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            counter = self._counters.get(user_id)
+            if self._is_fresh(counter):
+                return counter
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    select(UsageCounter.used_count).where(UsageCounter.user_id == user_id)
+                )
+                used = int(result.scalar_one_or_none() or 0)
+            metrics.incr("quota.counter_loads")
+            if counter is None:
+                if len(self._counters) >= self._evict_at:
+                    self._evict_idle()
+                    self._evict_at = max(1024, 2 * len(self._counters))
+                counter = _Counter(used=used, loaded_at=time.monotonic())
+                self._counters[user_id] = counter
+            else:
+                counter.used = used
+                counter.loaded_at = time.monotonic()
+            return counter
+
+    def invalidate(self, user_id: int) -> None:
+        """数据库中的计数被其他途径修改后，下次检查时重新加载"""
+        counter = self._counters.get(user_id)
+        if counter is not None:
+            counter.loaded_at = 0.0
+
+    async def reserve(self, user, service_type: str, outstanding: int = 0) -> Reservation:
+        """
+        预留一次额度；未登录返回 401，额度已用完返回 403。
+        outstanding 为该用户尚未完成、完成后才计数的任务数（如队列中的生成任务），一并计入占用。
+        """
+        if not self.enforced:
+            return Reservation(user_id=getattr(user, "id", None), service_type=service_type, done=True)
+        if user is None:
+            metrics.incr("quota.anonymous_rejected")
+            raise HTTPException(status_code=401, detail="请先登录", headers={"WWW-Authenticate": "Bearer"})
+
+        counter = await self._counter(user.id)
+        limit = max_usage(user.user_type)
+        if limit is not None and counter.used + counter.reserved + outstanding >= limit:
+            metrics.incr(f"quota.{service_type}.rejected")
+            raise HTTPException(status_code=403, detail="您的使用次数已用完，无法继续使用系统！")
+        counter.reserved += 1
+        metrics.incr(f"quota.{service_type}.reserved")
+        return Reservation(user_id=user.id, service_type=service_type)
+
+    async def admit(self, user, service_type: str) -> None:
+        """只检查、不计数的准入（如 Coze 提示词生成）：未登录返回 401，额度已用完返回 403"""
+        reservation = await self.reserve(user, service_type)
+        self.release(reservation)
+
+    async def commit(self, reservation: Reservation, task_id: str) -> None:
+        """上游调用成功：记录任务并计入使用次数"""
+        if reservation.done:
+            return
+        reservation.done = True
+        self._counters[reservation.user_id].reserved -= 1
+        await self._record(reservation.user_id, reservation.service_type, task_id)
+
+    async def record(self, user_id: int, service_type: str, task_id: str) -> None:
+        """没有本进程预留的成功调用（如其他进程提交、由本进程 worker 执行的任务）直接计入使用次数"""
+        if not self.enforced or user_id is None:
+            return
+        await self._record(user_id, service_type, task_id)
+
+    async def _record(self, user_id: int, service_type: str, task_id: str) -> None:
+        try:
+            async with AsyncSessionLocal() as session:
+                record = await UsageService(session).record_task(user_id, task_id, service_type)
+        except Exception as e:
+            # 任务记录失败时不计数，仍由客户端的 /usage/increment 补记
+            logger.error(f"Failed to record usage task {task_id}: {e}")
+            return
+        # 等待写库期间计数可能因空闲被清理，重新取；写入后的数据库值即最新的已用次数
+        counter = await self._counter(user_id)
+        counter.used = record.used
+        if record.counted:
+            metrics.incr(f"quota.{service_type}.committed")
+
+    def release(self, reservation: Reservation) -> None:
+        """上游调用失败：归还预留"""
+        if reservation.done:
+            return
+        reservation.done = True
+        self._counters[reservation.user_id].reserved -= 1
+        metrics.incr(f"quota.{reservation.service_type}.released")
+
+    def _evict_idle(self) -> None:
+        for user_id, counter in list(self._counters.items()):
+            if not self._is_fresh(counter):
+                del self._counters[user_id]
+                self._load_locks.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enforced": self.enforced,
+            "cached_users": len(self._counters),
+            "reserved": sum(counter.reserved for counter in self._counters.values()),
+        }
+
+
+quota_admission = QuotaAdmission(
+    enforced=settings.QUOTA_ENFORCED,
+    refresh_seconds=settings.QUOTA_COUNTER_REFRESH_SECONDS,
+)
+
+metrics.register_collector("quota", quota_admission.stats)
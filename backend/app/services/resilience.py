@@ -0,0 +1,461 @@
+import asyncio
+import random
+import sys
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+import httpx
+
+current_file = Path(__file__).resolve()
+project_root = current_file.parent.parent.parent
+sys.path.append(str(project_root))
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(service="resilience")
+
+T = TypeVar("T")
+
+# 调用结果分类
+SUCCESS = "success"
+THROTTLED = "throttled"        # 429：上游限流
+FAILURE = "failure"            # 5xx、超时、连接错误：上游不健康
+CLIENT_ERROR = "client_error"  # 其他 4xx：请求本身有问题，与上游健康无关
+CANCELLED = "cancelled"        # 调用方取消（如客户端断开）
+
+
+class UpstreamUnavailableError(RuntimeError):
+    """上游暂不可用（熔断或本地排队超时），接口返回 503"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    pass
+
+
+class UpstreamOverloadedError(UpstreamUnavailableError):
+    pass
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    response = getattr(exc, "response", None)
+    status_code = getattr(response, "status_code", None)
+    if isinstance(status_code, int):
+        return status_code
+    # cozepy 的错误只带业务码
+    code = getattr(exc, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def classify(exc: BaseException) -> str:
+    if isinstance(exc, asyncio.CancelledError):
+        return CANCELLED
+    if isinstance(exc, (httpx.TimeoutException, httpx.TransportError)):
+        return FAILURE
+    status_code = _status_code(exc)
+    if status_code == 429:
+        return THROTTLED
+    if status_code is not None and (400 <= status_code < 500 or 4000 <= status_code < 5000):
+        # HTTP 4xx 或 Coze 的 4xxx 业务码（参数、权限等）
+        return CLIENT_ERROR
+    return FAILURE
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def request_not_sent(exc: BaseException) -> bool:
+    """连接阶段失败，请求一定没有到达上游，非幂等请求也可以安全重试"""
+    return isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+class AIMDLimiter:
+    """
+    自适应并发限制（加性增、乘性减）：
+    - 每次成功并发上限增加 1/limit（约每轮满并发 +1）
+    - 限流、失败或延迟超过阈值时上限乘以 backoff；一个往返时间（成功调用延迟的滑动平均）内只下调一次，
+      避免同一波失败把上限压到最低
+    - 上限变化时通知监听者：生成类调用由按档位排队的 TierScheduler 放行，其容量跟随这里的上限
+    - 状态查询等不经过 TierScheduler 的调用用 acquire / release 直接限流，超过上限时在本地排队，
+      等待超过 queue_timeout 时放弃（不再堆到已过载的上游）
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        backoff: float,
+        latency_threshold: float,
+        queue_timeout: float,
+    ):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_threshold = latency_threshold
+        self.queue_timeout = queue_timeout
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+        self._rtt = 0.0
+        self._listeners: List[Callable[[], None]] = []
+
+    @property
+    def current(self) -> int:
+        """当前允许的并发数"""
+        return max(self.min_limit, int(self.limit))
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        self._listeners.append(listener)
+
+    def _has_capacity(self) -> bool:
+        return self._in_flight < self.current
+
+    async def acquire(self) -> None:
+        if self._has_capacity() and not self._waiters:
+            self._in_flight += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # 已分配到名额但等待方放弃：归还
+                self._in_flight -= 1
+                self._wake()
+            else:
+                future.cancel()
+                try:
+                    self._waiters.remove(future)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.incr(f"resilience.{self.name}.queue_timeouts")
+                raise UpstreamOverloadedError(f"{self.name} 上游繁忙，请稍后重试", retry_after=self.queue_timeout) from None
+            raise
+
+    def release(self, outcome: str, latency: Optional[float]) -> None:
+        self._in_flight -= 1
+        self.record(outcome, latency)
+
+    def record(self, outcome: str, latency: Optional[float]) -> None:
+        """按一次调用的结果调整上限"""
+        before = self.current
+        if outcome == SUCCESS:
+            if latency is not None and latency > self.latency_threshold:
+                self._decrease("slow")
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            if latency is not None:
+                self._rtt = latency if not self._rtt else 0.8 * self._rtt + 0.2 * latency
+        elif outcome in (THROTTLED, FAILURE):
+            self._decrease(outcome)
+        self._wake()
+        if self.current != before:
+            for listener in self._listeners:
+                listener()
+
+    def _decrease(self, reason: str) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self._rtt:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * self.backoff)
+        metrics.incr(f"resilience.{self.name}.decrease.{reason}")
+
+    def _wake(self) -> None:
+        while self._waiters and self._has_capacity():
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            self._in_flight += 1
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self._in_flight,
+            "queued": len(self._waiters),
+            "rtt_ms": round(self._rtt * 1000, 1),
+        }
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续 failure_threshold 次失败后打开，打开期间直接拒绝；
+    recovery_seconds 后进入半开状态，只放行一个试探请求，成功则关闭，失败则重新打开
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, recovery_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def check(self) -> None:
+        """打开期间快速拒绝（不改变状态），避免请求在本地排队"""
+        if self.state == self.OPEN and time.monotonic() - self._opened_at < self.recovery_seconds:
+            metrics.incr(f"resilience.{self.name}.rejected")
+            raise CircuitOpenError(
+                f"{self.name} 上游暂不可用，请稍后重试",
+                retry_after=self.recovery_seconds - (time.monotonic() - self._opened_at),
+            )
+
+    def before_call(self) -> None:
+        if self.state == self.OPEN:
+            remaining = self.recovery_seconds - (time.monotonic() - self._opened_at)
+            if remaining > 0:
+                metrics.incr(f"resilience.{self.name}.rejected")
+                raise CircuitOpenError(f"{self.name} 上游暂不可用，请稍后重试", retry_after=remaining)
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                metrics.incr(f"resilience.{self.name}.rejected")
+                raise CircuitOpenError(f"{self.name} 上游正在恢复，请稍后重试", retry_after=1.0)
+            self._probing = True
+
+    def record(self, outcome: str) -> None:
+        if outcome == CANCELLED:
+            self._probing = False
+            return
+        if outcome in (SUCCESS, CLIENT_ERROR):
+            self._failures = 0
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit {self.name} closed")
+            self.state = self.CLOSED
+            self._probing = False
+            return
+        # 限流只在试探时视为未恢复，平时由并发限制处理
+        if outcome == FAILURE:
+            self._failures += 1
+        if self.state == self.HALF_OPEN or (outcome == FAILURE and self._failures >= self.failure_threshold):
+            self._open()
+
+    def _open(self) -> None:
+        if self.state == self.HALF_OPEN:
+            logger.warning(f"Circuit {self.name} reopened: probe failed")
+        elif self.state == self.CLOSED:
+            logger.warning(f"Circuit {self.name} opened after {self._failures} consecutive failures")
+            metrics.incr(f"resilience.{self.name}.opened")
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self._failures}
+
+
+class UpstreamGuard:
+    """
+    一个上游服务商的调用保护：熔断检查 →（gated 时）取得自适应并发名额 → 调用 → 记录结果；
+    失败时按带抖动的指数退避重试。
+    - 生成类调用（gated=False）已在 TierScheduler 的名额内执行，这里只记录结果调整上限，不再排队，
+      避免 FIFO 的二次排队打乱按档位的加权公平顺序
+    - 状态查询（gated=True）使用独立的限流器排队，不与长时间占用名额的生成调用争抢
+    - 幂等请求在限流、5xx、超时时重试；非幂等请求（如创建任务）只在限流或请求未发出时重试，避免重复创建
+    - 流式调用（Coze 对话）只做保护不重试，已输出的内容无法回放
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limiter: AIMDLimiter,
+        breaker: CircuitBreaker,
+        retry_attempts: int,
+        retry_base: float,
+        retry_max: float,
+        gated: bool = False,
+    ):
+        self.name = name
+        self.limiter = limiter
+        self.breaker = breaker
+        self.retry_attempts = retry_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.gated = gated
+
+    async def _enter(self) -> None:
+        """熔断检查 →（gated 时）排队取得并发名额 → 再次检查（排队期间熔断器可能已打开）"""
+        self.breaker.check()
+        if not self.gated:
+            self.breaker.before_call()
+            return
+        await self.limiter.acquire()
+        try:
+            self.breaker.before_call()
+        except BaseException:
+            self.limiter.release(CANCELLED, None)
+            raise
+
+    def _finish(self, outcome: str, latency: Optional[float]) -> None:
+        if self.gated:
+            self.limiter.release(outcome, latency)
+        else:
+            self.limiter.record(outcome, latency)
+        self.breaker.record(outcome)
+        metrics.incr(f"resilience.{self.name}.{outcome}")
+
+    def _backoff(self, attempt: int, exc: BaseException) -> float:
+        retry_after = _retry_after(exc)
+        if retry_after is not None:
+            return min(retry_after, self.retry_max)
+        # full jitter：在 [0, min(max, base * 2^n)] 内随机，避免大量请求同时重试
+        return random.uniform(0, min(self.retry_max, self.retry_base * (2 ** (attempt - 1))))
+
+    async def call(
+        self,
+        fn: Callable[[], Awaitable[T]],
+        *,
+        idempotent: bool = True,
+        track_latency: bool = True,
+        on_retry: Optional[Callable[[BaseException], None]] = None,
+    ) -> T:
+        """
+        执行一次上游调用。track_latency=False 用于本身就很慢的调用（如同步等待生成结果），不以延迟判断过载；
+        on_retry 在每次重试前调用（如限流时换一个 key）。
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            await self._enter()
+            started = time.monotonic()
+            try:
+                result = await fn()
+            except BaseException as e:
+                outcome = classify(e)
+                self._finish(outcome, time.monotonic() - started if track_latency else None)
+                retryable = outcome == THROTTLED or (
+                    outcome == FAILURE and (idempotent or request_not_sent(e))
+                )
+                if not retryable or attempt >= self.retry_attempts:
+                    raise
+                delay = self._backoff(attempt, e)
+                metrics.incr(f"resilience.{self.name}.retries")
+                logger.warning(f"{self.name} call failed ({outcome}: {e}), retry {attempt} in {delay:.2f}s")
+                if on_retry is not None:
+                    on_retry(e)
+                await asyncio.sleep(delay)
+                continue
+            self._finish(SUCCESS, time.monotonic() - started if track_latency else None)
+            return result
+
+    async def stream(
+        self,
+        events: AsyncIterable[T],
+        outcome_of: Optional[Callable[[T], Optional[str]]] = None,
+    ) -> AsyncIterator[T]:
+        """
+        保护一次流式调用，延迟按首个事件到达的时间计算；结束时关闭底层流。
+        outcome_of 从事件判断结果（如对话完成或出错事件），消费方随后提前关闭流不算作取消。
+        """
+        await self._enter()
+        started = time.monotonic()
+        first_latency: Optional[float] = None
+        outcome: Optional[str] = None
+        try:
+            async for event in events:
+                if first_latency is None:
+                    first_latency = time.monotonic() - started
+                if outcome is None and outcome_of is not None:
+                    outcome = outcome_of(event)
+                yield event
+            outcome = outcome or SUCCESS
+        except Exception as e:
+            outcome = outcome or classify(e)
+            raise
+        finally:
+            self._finish(outcome or CANCELLED, first_latency)
+            if hasattr(events, "aclose"):
+                await events.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.limiter.stats(), **self.breaker.stats()}
+
+
+def _limiter(name: str, max_limit: int, latency_threshold: float) -> AIMDLimiter:
+    # 从上限开始：未观察到过载前不限制，由限流、失败或变慢逐步下调
+    return AIMDLimiter(
+        name,
+        initial=max_limit,
+        min_limit=settings.RESILIENCE_MIN_LIMIT,
+        max_limit=max_limit,
+        backoff=settings.RESILIENCE_BACKOFF_FACTOR,
+        latency_threshold=latency_threshold,
+        queue_timeout=settings.RESILIENCE_QUEUE_TIMEOUT_SECONDS,
+    )
+
+
+def _build_guards(name: str, slots: int, latency_threshold: float) -> Tuple[UpstreamGuard, UpstreamGuard]:
+    """
+    一个上游的两个保护：生成调用（上限即 TierScheduler 的容量，最大为该上游的名额数）与状态查询（独立限流）。
+    两者共用熔断器，上游故障时状态查询也会暂停。
+    """
+    breaker = CircuitBreaker(
+        name,
+        failure_threshold=settings.CIRCUIT_FAILURE_THRESHOLD,
+        recovery_seconds=settings.CIRCUIT_RECOVERY_SECONDS,
+    )
+    retry = dict(
+        retry_attempts=settings.UPSTREAM_RETRY_ATTEMPTS,
+        retry_base=settings.UPSTREAM_RETRY_BASE_SECONDS,
+        retry_max=settings.UPSTREAM_RETRY_MAX_SECONDS,
+    )
+    guard = UpstreamGuard(name, _limiter(name, slots, latency_threshold), breaker, **retry)
+    status_guard = UpstreamGuard(
+        f"{name}_status",
+        _limiter(f"{name}_status", settings.UPSTREAM_STATUS_POLL_SLOTS, latency_threshold),
+        breaker,
+        gated=True,
+        **retry,
+    )
+    return guard, status_guard
+
+
+coze_guard, _ = _build_guards("coze", settings.COZE_UPSTREAM_SLOTS, settings.COZE_LATENCY_THRESHOLD_SECONDS)
+sora_guard, sora_status_guard = _build_guards(
+    "sora", settings.SORA_UPSTREAM_SLOTS, settings.SORA_LATENCY_THRESHOLD_SECONDS
+)
+tripo_guard, tripo_status_guard = _build_guards(
+    "tripo", settings.TRIPO_UPSTREAM_SLOTS, settings.TRIPO_LATENCY_THRESHOLD_SECONDS
+)
+
+metrics.register_collector(
+    "resilience",
+    lambda: {
+        guard.name: guard.stats()
+        for guard in (coze_guard, sora_guard, sora_status_guard, tripo_guard, tripo_status_guard)
+    },
+)
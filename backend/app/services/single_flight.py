@@ -0,0 +1,140 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Set, TypeVar
+
+from app.core.logger import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(service="single_flight")
+
+_END = object()
+
+T = TypeVar("T")
+
+
+class _Failure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+class _Flight:
+    """一次正在进行的上游调用：已产出的内容（回放给后加入的订阅者）与当前订阅者队列"""
+
+    def __init__(self):
+        self.buffer: List[Any] = []
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.task: Optional[asyncio.Task] = None
+
+
+class SingleFlight:
+    """
+    相同 key 的并发请求共享同一个上游流：
+    - 第一个请求启动上游，之后加入的请求先回放已产出的内容，再接收后续内容（各自独立的队列）
+    - 只有当最后一个订阅者断开时才取消上游调用
+    - 上游结束后立即移除，之后的相同请求会重新发起
+    - 订阅前的准备步骤（如上传文件）可通过 prepare 共享：从开始准备到上游流启动之间到达的相同请求不会重复执行
+    - 上游在第一个订阅者的上下文（如用户档位的并发名额）中运行，不同上下文的请求应使用不同的 key
+    """
+
+    def __init__(self, name: str, prepare_ttl: float = 30.0):
+        self.name = name
+        self.prepare_ttl = prepare_ttl
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._prepared: Dict[Hashable, asyncio.Future] = {}
+
+    def active(self, key: Hashable) -> bool:
+        return key in self._flights
+
+    def _drop_prepared(self, key: Hashable, future: Optional[asyncio.Future] = None) -> None:
+        if future is None or self._prepared.get(key) is future:
+            self._prepared.pop(key, None)
+
+    async def prepare(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        执行 key 对应的准备步骤，相同 key 的并发请求只执行一次 fn 并共享结果（包括异常）。
+        在调用方 await 之前同步登记，结果保留到该 key 的上游流启动（最多 prepare_ttl 秒）
+        """
+        while True:
+            future = self._prepared.get(key)
+            if future is None:
+                break
+            try:
+                result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    # 执行准备步骤的请求被取消，由本请求重新执行
+                    continue
+                raise
+            metrics.incr(f"single_flight.{self.name}.prepare_joined")
+            return result
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._prepared[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            self._drop_prepared(key, future)
+            future.cancel()
+            raise
+        except Exception as e:
+            self._drop_prepared(key, future)
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        future.set_result(result)
+        loop.call_later(self.prepare_ttl, self._drop_prepared, key, future)
+        return result
+
+    def _broadcast(self, flight: _Flight, item: Any) -> None:
+        for queue in flight.subscribers:
+            queue.put_nowait(item)
+
+    async def _run(self, key: Hashable, flight: _Flight, factory: Callable[[], AsyncIterator[Any]]) -> None:
+        try:
+            async for item in factory():
+                flight.buffer.append(item)
+                self._broadcast(flight, item)
+            self._broadcast(flight, _END)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._broadcast(flight, _Failure(e))
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    async def subscribe(self, key: Hashable, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """订阅 key 对应的上游流；没有进行中的调用时用 factory() 启动一个"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            self._drop_prepared(key)
+            flight.task = asyncio.create_task(self._run(key, flight, factory))
+            metrics.incr(f"single_flight.{self.name}.started")
+        else:
+            metrics.incr(f"single_flight.{self.name}.joined")
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in flight.buffer:
+            queue.put_nowait(item)
+        flight.subscribers.add(queue)
+
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.exc
+                yield item
+        finally:
+            flight.subscribers.discard(queue)
+            if not flight.subscribers and not flight.task.done():
+                # 最后一个订阅者离开，取消上游调用
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+                metrics.incr(f"single_flight.{self.name}.cancelled")
+                logger.info(f"Cancelled upstream flight {key!r}: no subscribers left")
@@ -1,9 +1,12 @@
 import os
 import ssl
+import uuid
 import httpx
 import base64
+import asyncio
+import hashlib
 from datetime import datetime
-from typing import Optional, List, Any, Dict
+from typing import Optional, List, Any, Dict, AsyncIterator
 from pathlib import Path
 import sys 
 
@@ -13,38 +16,146 @@ project_root = current_file.parent.parent.parent
 sys.path.append(str(project_root))
 
 from app.core.config import settings
+from app.utils.file_utils import detect_image_type
+from app.utils import background_tasks
+from app.services.credential_pool import sora_credentials
+from app.services.resilience import sora_guard, sora_status_guard
+
+# 图片的发送方式：base64 内嵌在 JSON 中，或作为 multipart 文件流式发送
+UPLOAD_MODES = ("base64", "multipart")
+_MIME_TYPES = {"jpg": "image/jpeg", "png": "image/png", "gif": "image/gif", "bmp": "image/bmp", "webp": "image/webp"}
 
 
 LOG_FILE = 'image_log.txt'
+OUTPUT_DIR = Path('outputs')
 
 class SoraService:
-    def __init__(self):
-        self.api_key = settings.SORA_API_KEY
+    def __init__(self, client: Optional[httpx.AsyncClient] = None):
         # 存储并规范化 base_url，去除末尾的斜杠
         self.api_base_url = settings.SORA_BASE_URL.rstrip('/')
         
-        ssl_context = ssl.create_default_context()
-        ssl_context.set_ciphers('DEFAULT@SECLEVEL=1')
-        self._client = httpx.AsyncClient(verify=ssl_context, timeout=300)
+        # 优先使用注入的共享客户端（进程级连接池，由应用生命周期关闭），未注入时才单独创建
+        self._owns_client = client is None
+        if client is None:
+            ssl_context = ssl.create_default_context()
+            ssl_context.set_ciphers('DEFAULT@SECLEVEL=1')
+            client = httpx.AsyncClient(verify=ssl_context, timeout=300)
+        self._client = client
 
     async def close(self):
-        await self._client.aclose()
+        # 共享客户端不在这里关闭
+        if self._owns_client:
+            await self._client.aclose()
 
     def _get_effective_auth_key(self, provided_key: Optional[str]) -> str:
-        return provided_key if provided_key else self.api_key
+        # 未指定 key 时从凭据池中取（最久未使用、跳过冷却中的 key）
+        return provided_key if provided_key else sora_credentials.acquire()
+
+    @staticmethod
+    def _encode_image(image_file: Any) -> str:
+        """把图片（字节、文件对象、文件路径或 base64 / data URI）统一编码为 base64 字符串"""
+        if isinstance(image_file, (bytes, bytearray)):
+            # 已读入内存（通常是规范化后的图片）
+            return base64.b64encode(image_file).decode('utf-8')
+        if hasattr(image_file, 'read'):
+            # 如果是文件对象，读取内容并编码为base64
+            image_file.seek(0)
+            return base64.b64encode(image_file.read()).decode('utf-8')
+        if isinstance(image_file, str) and Path(image_file).is_file():
+            # 如果是文件路径，读取并编码
+            with open(image_file, 'rb') as f:
+                return base64.b64encode(f.read()).decode('utf-8')
+        if isinstance(image_file, str) and image_file.startswith('data:image'):
+            # 如果是base64数据URI，直接提取base64部分
+            return image_file.split(',')[1]
+        # 假设已经是base64字符串
+        return image_file
+
+    @staticmethod
+    def _multipart_image(image_file: Any) -> tuple:
+        """
+        把图片转换为 httpx files= 字段，文件对象（如上传的临时文件）由 httpx 分块读取发送，不整体读入内存。
+
+        Returns:
+            (files 字段, 需要调用方关闭的文件对象或 None)
+        """
+        if hasattr(image_file, 'file') and hasattr(image_file, 'filename'):
+            # FastAPI UploadFile：直接使用其底层（已落在临时文件中的）文件对象
+            image_file.file.seek(0)
+            return (image_file.filename or 'image', image_file.file, image_file.content_type), None
+        if hasattr(image_file, 'read'):
+            image_file.seek(0)
+            return (Path(getattr(image_file, 'name', 'image')).name, image_file), None
+        if isinstance(image_file, str) and Path(image_file).is_file():
+            opened = open(image_file, 'rb')
+            return (Path(image_file).name, opened), opened
+        if isinstance(image_file, str):
+            # base64 / data URI 字符串只能解码后发送
+            image_file = base64.b64decode(image_file.split(',')[1] if image_file.startswith('data:image') else image_file)
+        ext = detect_image_type(bytes(image_file[:16])) or 'png'
+        return (f"image.{ext}", bytes(image_file), _MIME_TYPES.get(ext)), None
+
+    def _resolve_upload_mode(self, upload_mode: Optional[str]) -> str:
+        mode = upload_mode or settings.SORA_UPLOAD_MODE
+        if mode not in UPLOAD_MODES:
+            raise ValueError(f"不支持的上传方式: {mode}，仅支持{UPLOAD_MODES}")
+        return mode
+
+    async def _post_image(self, api_url: str, auth_key: str, fields: Dict[str, Any], image_file: Any, upload_mode: str, is_async: bool) -> Dict:
+        """按上传方式发送带图片的请求"""
+        if upload_mode == "base64":
+            payload = dict(fields, image=self._encode_image(image_file))
+            return await self._make_api_request(api_url, auth_key, payload, is_async=is_async)
+
+        image_field, opened = self._multipart_image(image_file)
+        try:
+            return await self._make_api_request(api_url, auth_key, fields, files={'image': image_field}, is_async=is_async)
+        finally:
+            if opened is not None:
+                opened.close()
+
+    @staticmethod
+    def _rewind(files: Optional[Dict]) -> None:
+        """重试前把 multipart 中的文件对象移回开头"""
+        for field in (files or {}).values():
+            content = field[1] if isinstance(field, tuple) else field
+            if hasattr(content, 'seek'):
+                content.seek(0)
 
     async def _make_api_request(self, api_url: str, auth_key: str, data: Dict[str, Any], files: Optional[Dict] = None, is_async: bool = False) -> Dict:
-        headers = {'Authorization': f'{auth_key}'}
         params = {'async': 'true'} if is_async else None
-        print(f"\n--- Sending API Request via SoraService ---\nURL: {api_url}\nParams: {params}\nData: {data}\n")
-        
-        if files:
-            response = await self._client.post(api_url, headers=headers, data=data, files=files, params=params)
-        else:
-            response = await self._client.post(api_url, headers=headers, json=data, params=params)
-        
-        response.raise_for_status()
-        return response.json()
+        # 不打印图片内容（base64 可能有数 MB）
+        logged_data = {k: v for k, v in data.items() if k != 'image'}
+        print(f"\n--- Sending API Request via SoraService ---\nURL: {api_url}\nParams: {params}\nData: {logged_data}\n")
+
+        state = {'key': auth_key}
+        attempt = 0
+
+        async def send() -> httpx.Response:
+            nonlocal attempt
+            attempt += 1
+            headers = {'Authorization': f"{state['key']}"}
+            if files:
+                if attempt > 1:
+                    self._rewind(files)
+                response = await self._client.post(api_url, headers=headers, data=data, files=files, params=params)
+            else:
+                response = await self._client.post(api_url, headers=headers, json=data, params=params)
+            response.raise_for_status()
+            return response
+
+        def rotate_key(exc: BaseException) -> None:
+            # 池中的 key 被限流时换一个 key 重试（调用方指定的 key 不替换）
+            if auth_key in sora_credentials.keys and getattr(getattr(exc, 'response', None), 'status_code', None) == 429:
+                state['key'] = sora_credentials.acquire()
+
+        # 创建任务不是幂等的，只在限流或请求未发出时重试；同步生成本身耗时较长，不以延迟判断过载
+        response = await sora_guard.call(send, idempotent=False, track_latency=is_async, on_retry=rotate_key)
+        result = response.json()
+        if is_async and isinstance(result, dict) and result.get('task_id'):
+            # 异步任务只能用创建它的 key 查询
+            sora_credentials.remember(result['task_id'], state['key'])
+        return result
 
     async def generate_image_from_image(self, 
                                       prompt: str, 
@@ -54,79 +165,51 @@ class SoraService:
                                       size: str = "1024x1024", 
                                       is_async: bool = False, 
                                       strength: float = 0.8,
-                                      auth_key: Optional[str] = None) -> Dict:
-        """使用内部的 base_url 构建图片生成图片的请求 URL"""
+                                      auth_key: Optional[str] = None,
+                                      upload_mode: Optional[str] = None) -> Dict:
+        """
+        使用内部的 base_url 构建图片生成图片的请求 URL。
+        upload_mode: base64（图片内嵌在 JSON 中）或 multipart（文件流式发送），默认使用 settings.SORA_UPLOAD_MODE
+        """
         effective_auth_key = self._get_effective_auth_key(auth_key)
+        mode = self._resolve_upload_mode(upload_mode)
         # 内部构建完整的 API URL
         full_url = f"{self.api_base_url}/v1/images/edits"  # 或者 "/v1/images/variations"，根据API而定
-        
-        # 处理图片文件 - 完整的图片处理逻辑
-        if hasattr(image_file, 'read'):
-            # 如果是文件对象，读取内容并编码为base64
-            image_file.seek(0)
-            image_data = image_file.read()
-            encoded_image = base64.b64encode(image_data).decode('utf-8')
-        elif isinstance(image_file, str) and Path(image_file).is_file():
-            # 如果是文件路径，读取并编码
-            with open(image_file, 'rb') as f:
-                image_data = f.read()
-                encoded_image = base64.b64encode(image_data).decode('utf-8')
-        elif isinstance(image_file, str) and image_file.startswith('data:image'):
-            # 如果是base64数据URI，直接提取base64部分
-            encoded_image = image_file.split(',')[1]
-        else:
-            # 假设已经是base64字符串
-            encoded_image = image_file
 
-        # 构建payload
-        payload = {
+        # 构建payload（图片按上传方式附加）
+        fields = {
             'model': model,
             'prompt': prompt,
-            'image': encoded_image,
             'n': n,
             'size': size,
             'strength': strength  # 控制原图保留程度
         }
 
-        result = await self._make_api_request(full_url, effective_auth_key, payload, is_async=is_async)
+        result = await self._post_image(full_url, effective_auth_key, fields, image_file, mode, is_async)
 
         if not is_async and result.get('data'):
             self.log_image_id(result.get('id'), prompt)
-            await self.save_images_from_data(result['data'], prompt)
+            self._persist_results(result['data'], prompt)
 
         return result
 
-    async def generate_image_variation(self, image_file: Any, model: str = "sora_image", n: int = 1, size: str = "1024x1024", is_async: bool = False, auth_key: Optional[str] = None) -> Dict:
+    async def generate_image_variation(self, image_file: Any, model: str = "sora_image", n: int = 1, size: str = "1024x1024", is_async: bool = False, auth_key: Optional[str] = None, upload_mode: Optional[str] = None) -> Dict:
         """生成图片变体（不需要文字提示）"""
         effective_auth_key = self._get_effective_auth_key(auth_key)
+        mode = self._resolve_upload_mode(upload_mode)
         full_url = f"{self.api_base_url}/v1/images/variations"
-        
-        # 图片处理逻辑
-        if hasattr(image_file, 'read'):
-            image_file.seek(0)
-            image_data = image_file.read()
-            encoded_image = base64.b64encode(image_data).decode('utf-8')
-        elif isinstance(image_file, str) and Path(image_file).is_file():
-            with open(image_file, 'rb') as f:
-                image_data = f.read()
-                encoded_image = base64.b64encode(image_data).decode('utf-8')
-        elif isinstance(image_file, str) and image_file.startswith('data:image'):
-            encoded_image = image_file.split(',')[1]
-        else:
-            encoded_image = image_file
-
-        payload = {
+
+        fields = {
             'model': model,
-            'image': encoded_image,
             'n': n,
             'size': size
         }
 
-        result = await self._make_api_request(full_url, effective_auth_key, payload, is_async=is_async)
+        result = await self._post_image(full_url, effective_auth_key, fields, image_file, mode, is_async)
 
         if not is_async and result.get('data'):
             self.log_image_id(result.get('id'), "image_variation")
-            await self.save_images_from_data(result['data'], "image_variation")
+            self._persist_results(result['data'], "image_variation")
 
         return result
 
@@ -144,20 +227,37 @@ class SoraService:
 
         if not is_async and result.get('data'):
             self.log_image_id(result.get('id'), prompt)
-            await self.save_images_from_data(result['data'], prompt)
+            self._persist_results(result['data'], prompt)
 
         return result
 
     async def get_task_status(self, task_id: str, auth_key: Optional[str] = None) -> Dict:
-        """使用内部的 base_url 构建请求 URL"""
-        effective_auth_key = self._get_effective_auth_key(auth_key)
+        """使用内部的 base_url 构建请求 URL；未指定 key 时使用创建该任务的 key（未知时依次尝试池中的 key）"""
+        candidates = [auth_key] if auth_key else sora_credentials.candidates(task_id)
         # 内部构建完整的任务 URL
         task_url = f"{self.api_base_url}/v1/images/tasks/{task_id}"
-        headers = {'Authorization': f'Bearer {effective_auth_key}'}
-        
-        response = await self._client.get(task_url, headers=headers)
-        response.raise_for_status()
-        return response.json()
+
+        rejected: Optional[httpx.Response] = None
+        for index, key in enumerate(candidates):
+            async def fetch(key: str = key, last: bool = index + 1 == len(candidates)) -> httpx.Response:
+                response = await self._client.get(task_url, headers={'Authorization': f'Bearer {key}'})
+                if response.status_code in (401, 403, 404, 429) and not last:
+                    # 不是这个 key 创建的任务（或该 key 被限流），换下一个
+                    return response
+                response.raise_for_status()
+                return response
+
+            response = await sora_status_guard.call(fetch)
+            if response.is_error:
+                rejected = response
+                continue
+            sora_credentials.remember(task_id, key)
+            return response.json()
+
+        # 所有 key 都未能查询到该任务：报告最后一次被拒绝的结果，不返回 None
+        if rejected is not None:
+            rejected.raise_for_status()
+        raise RuntimeError(f"No Sora credential could query task {task_id}")
 
     def log_image_id(self, task_id: str, prompt: str):
         """Logs the task ID and prompt to a file."""
@@ -170,38 +270,73 @@ class SoraService:
         except Exception as e:
             print(f"Error writing to log file: {e}")
 
-    async def save_images_from_data(self, data_list: List[Dict[str, Any]], prompt: str):
-        """Decodes or downloads and saves images from API response data."""
-        output_dir = 'outputs'
-        os.makedirs(output_dir, exist_ok=True)
-        
-        for i, item in enumerate(data_list):
-            img_data = None
-            if item.get('b64_json'):
-                try:
-                    img_data = base64.b64decode(item['b64_json'])
-                except Exception as e:
-                    print(f"Error decoding base64 image: {e}")
-                    continue
-            elif item.get('url'):
-                try:
-                    print(f"Downloading image from URL: {item['url']}")
-                    # Use the service's client for async download
-                    img_response = await self._client.get(item['url'], timeout=60)
-                    img_response.raise_for_status()
-                    img_data = img_response.content
-                except Exception as e:
-                    print(f"Error downloading image from URL {item['url']}: {e}")
-                    continue
-
-            if img_data:
-                try:
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    safe_prompt = "".join([c for c in prompt if c.isalnum() or c in (' ', '-')]).rstrip()[:30].replace(' ', '_')
-                    filename = f"{timestamp}_{safe_prompt}_{i+1}.png"
-                    filepath = os.path.join(output_dir, filename)
-                    with open(filepath, 'wb') as f:
-                        f.write(img_data)
-                    print(f"Image saved to {filepath}")
-                except Exception as e:
-                    print(f"Error saving image file: {e}")
\ No newline at end of file
+    def _persist_results(self, data_list: List[Dict[str, Any]], prompt: str) -> None:
+        """结果图片在后台保存，不占用响应的关键路径，客户端拿到上游结果即可返回"""
+        background_tasks.spawn(self.save_images_from_data(data_list, prompt), name="sora:save_images")
+
+    async def _write_stream(self, chunks: AsyncIterator[bytes]) -> Path:
+        """边接收边写入临时文件（写入在线程池中进行）并计算 SHA-256，完成后按内容哈希命名"""
+        tmp_path = OUTPUT_DIR / f".{uuid.uuid4().hex}.part"
+        hasher = hashlib.sha256()
+        head = b""
+        out = await asyncio.to_thread(open, tmp_path, 'wb')
+        try:
+            async for chunk in chunks:
+                if len(head) < 16:
+                    head += chunk[:16 - len(head)]
+                hasher.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+        except BaseException:
+            await asyncio.to_thread(out.close)
+            tmp_path.unlink(missing_ok=True)
+            raise
+        await asyncio.to_thread(out.close)
+        # 相同内容的图片只保留一份
+        final_path = OUTPUT_DIR / f"{hasher.hexdigest()}.{detect_image_type(head) or 'png'}"
+        await asyncio.to_thread(os.replace, tmp_path, final_path)
+        return final_path
+
+    async def _save_b64_image(self, b64_json: str) -> Path:
+        img_data = await asyncio.to_thread(base64.b64decode, b64_json)
+
+        async def chunks():
+            view = memoryview(img_data)
+            for offset in range(0, len(view), settings.UPLOAD_CHUNK_SIZE):
+                yield view[offset:offset + settings.UPLOAD_CHUNK_SIZE]
+
+        return await self._write_stream(chunks())
+
+    async def _download_image(self, url: str) -> Path:
+        print(f"Downloading image from URL: {url}")
+        # 流式下载，按块写入磁盘，不把整张图片缓存在内存中
+        async with self._client.stream('GET', url, timeout=60) as response:
+            response.raise_for_status()
+            return await self._write_stream(response.aiter_bytes(settings.UPLOAD_CHUNK_SIZE))
+
+    async def save_images_from_data(self, data_list: List[Dict[str, Any]], prompt: str) -> List[Path]:
+        """
+        Decodes or downloads and saves images from API response data.
+        多张图片并发处理（并发数由 SORA_SAVE_CONCURRENCY 限制），文件按内容 SHA-256 命名。
+        """
+        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        semaphore = asyncio.Semaphore(settings.SORA_SAVE_CONCURRENCY)
+
+        async def save_one(item: Dict[str, Any]) -> Optional[Path]:
+            async with semaphore:
+                if item.get('b64_json'):
+                    try:
+                        return await self._save_b64_image(item['b64_json'])
+                    except Exception as e:
+                        print(f"Error saving base64 image: {e}")
+                elif item.get('url'):
+                    try:
+                        return await self._download_image(item['url'])
+                    except Exception as e:
+                        print(f"Error downloading image from URL {item['url']}: {e}")
+                return None
+
+        paths = await asyncio.gather(*(save_one(item) for item in data_list))
+        saved = [path for path in paths if path is not None]
+        for path in saved:
+            print(f"Image saved to {path} (prompt: {' '.join(prompt.split())[:30]})")
+        return saved
@@ -0,0 +1,195 @@
+import asyncio
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional, Set, Tuple
+
+import httpx
+
+current_file = Path(__file__).resolve()
+project_root = current_file.parent.parent.parent
+sys.path.append(str(project_root))
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.metrics import metrics
+from app.services.sora_service import SoraService
+from app.services.task_status_cache import task_status_cache
+from app.services.upstream_clients import get_sora_http_client
+
+logger = get_logger(service="sora_task_watcher")
+
+
+def is_terminal(status: Dict[str, Any]) -> bool:
+    return task_status_cache.is_terminal("sora", status)
+
+
+@dataclass
+class _WatchedTask:
+    task_id: str
+    auth_key: Optional[str]
+    status: Optional[Dict[str, Any]] = None
+    subscribers: Set[asyncio.Queue] = field(default_factory=set)
+    poller: Optional[asyncio.Task] = None
+
+
+class SoraTaskWatcher:
+    """
+    服务端统一轮询 Sora 异步任务：
+    - 每个任务只有一个轮询协程，状态不变时按指数退避放慢轮询
+    - 所有关注该任务的客户端共享最新状态（/sora/tasks/{id} 直接返回快照），状态变化通过 SSE 推送
+    - 任务结束后在内存中保留一段时间，随后移除
+    """
+
+    def __init__(
+        self,
+        initial_interval: float,
+        max_interval: float,
+        backoff: float,
+        max_duration: float,
+        retention: float,
+    ):
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_duration = max_duration
+        self.retention = retention
+        self._tasks: Dict[str, _WatchedTask] = {}
+
+    def latest(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """最近一次轮询得到的状态；未跟踪或尚未取得状态时返回 None"""
+        entry = self._tasks.get(task_id)
+        return entry.status if entry else None
+
+    def watch(
+        self,
+        task_id: str,
+        auth_key: Optional[str] = None,
+        status: Optional[Dict[str, Any]] = None,
+        delay: Optional[float] = None,
+    ) -> None:
+        """开始跟踪任务（已在跟踪时忽略）；status 为已知的初始状态"""
+        entry = self._tasks.get(task_id)
+        if entry is not None:
+            return
+        entry = _WatchedTask(task_id=task_id, auth_key=auth_key, status=status)
+        self._tasks[task_id] = entry
+        if status is not None and is_terminal(status):
+            self._schedule_forget(entry)
+            return
+        first_delay = self.initial_interval if delay is None else delay
+        entry.poller = asyncio.create_task(self._poll(entry, first_delay), name=f"sora-watch:{task_id}")
+
+    async def subscribe(self, task_id: str, auth_key: Optional[str] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        订阅任务状态变化，产出 ("status", 状态) 或 ("error", 错误信息)。
+        先产出当前状态（如有），任务结束或轮询失败后停止。
+        """
+        if task_id not in self._tasks:
+            # 已结束的任务直接使用缓存，不再轮询上游
+            cached = await task_status_cache.get("sora", task_id)
+            self.watch(task_id, auth_key, status=cached, delay=0)
+        entry = self._tasks[task_id]
+        queue: asyncio.Queue = asyncio.Queue()
+        if entry.status is not None:
+            queue.put_nowait(("status", entry.status))
+            if is_terminal(entry.status):
+                queue.put_nowait(None)
+        entry.subscribers.add(queue)
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                yield item
+        finally:
+            entry.subscribers.discard(queue)
+
+    def _publish(self, entry: _WatchedTask, item: Optional[Tuple[str, Any]]) -> None:
+        for queue in entry.subscribers:
+            queue.put_nowait(item)
+
+    def _schedule_forget(self, entry: _WatchedTask) -> None:
+        asyncio.get_running_loop().call_later(self.retention, self._forget, entry)
+
+    def _forget(self, entry: _WatchedTask) -> None:
+        if self._tasks.get(entry.task_id) is entry:
+            del self._tasks[entry.task_id]
+
+    async def _poll(self, entry: _WatchedTask, delay: float) -> None:
+        service = SoraService(get_sora_http_client())
+        started = time.monotonic()
+        interval = self.initial_interval
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                if time.monotonic() - started > self.max_duration:
+                    logger.warning(f"Stopped watching Sora task {entry.task_id}: timed out")
+                    self._publish(entry, ("error", "任务轮询超时。"))
+                    self._publish(entry, None)
+                    self._forget(entry)
+                    return
+
+                metrics.incr("sora_watcher.polls")
+                try:
+                    status = await service.get_task_status(entry.task_id, auth_key=entry.auth_key)
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code < 500:
+                        # 任务不存在或无权访问，不再重试
+                        self._publish(entry, ("error", f"Upstream API error: {e.response.text}"))
+                        self._publish(entry, None)
+                        self._forget(entry)
+                        return
+                    logger.warning(f"Polling Sora task {entry.task_id} failed: {e}")
+                    metrics.incr("sora_watcher.errors")
+                    status = None
+                except Exception as e:
+                    logger.warning(f"Polling Sora task {entry.task_id} failed: {e}")
+                    metrics.incr("sora_watcher.errors")
+                    status = None
+
+                if status is not None and status != entry.status:
+                    entry.status = status
+                    # 结束状态写入缓存（数据库），跟踪结束后仍可直接查询
+                    await task_status_cache.set("sora", entry.task_id, status)
+                    self._publish(entry, ("status", status))
+                    if is_terminal(status):
+                        self._publish(entry, None)
+                        self._schedule_forget(entry)
+                        return
+                    # 状态有变化，恢复较快的轮询
+                    interval = self.initial_interval
+                else:
+                    interval = min(interval * self.backoff, self.max_interval)
+                delay = interval
+        except asyncio.CancelledError:
+            self._publish(entry, None)
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tracked": len(self._tasks),
+            "polling": sum(1 for entry in self._tasks.values() if entry.poller and not entry.poller.done()),
+            "subscribers": sum(len(entry.subscribers) for entry in self._tasks.values()),
+            "polls": metrics.get("sora_watcher.polls"),
+        }
+
+    async def shutdown(self) -> None:
+        """应用关闭时停止所有轮询"""
+        pollers = [entry.poller for entry in self._tasks.values() if entry.poller and not entry.poller.done()]
+        for poller in pollers:
+            poller.cancel()
+        await asyncio.gather(*pollers, return_exceptions=True)
+        self._tasks.clear()
+
+
+sora_task_watcher = SoraTaskWatcher(
+    initial_interval=settings.SORA_WATCH_INITIAL_INTERVAL,
+    max_interval=settings.SORA_WATCH_MAX_INTERVAL,
+    backoff=settings.SORA_WATCH_BACKOFF,
+    max_duration=settings.SORA_WATCH_MAX_SECONDS,
+    retention=settings.SORA_WATCH_RETENTION_SECONDS,
+)
+
+metrics.register_collector("sora_watcher", sora_task_watcher.stats)
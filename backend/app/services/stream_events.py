@@ -0,0 +1,116 @@
+import asyncio
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional, Union
+
+
+# 服务层产出的轻量事件类型，SSE 编码统一在接口层完成（见 app.utils.sse）
+
+@dataclass(slots=True)
+class DeltaEvent:
+    """增量文本（原样保留空白字符）"""
+    content: str
+
+
+@dataclass(slots=True)
+class UsageEvent:
+    """本次对话的 token 用量"""
+    token_count: int
+
+
+@dataclass(slots=True)
+class DoneEvent:
+    """正常结束"""
+
+
+@dataclass(slots=True)
+class ErrorEvent:
+    """上游返回的错误"""
+    message: str
+
+
+StreamEvent = Union[DeltaEvent, UsageEvent, DoneEvent, ErrorEvent]
+
+
+_END = object()
+
+
+async def _pump(events: AsyncIterator[StreamEvent], queue: asyncio.Queue) -> None:
+    try:
+        async for event in events:
+            await queue.put(event)
+        await queue.put(_END)
+    except asyncio.CancelledError:
+        raise
+    except BaseException as e:
+        await queue.put(e)
+
+
+async def coalesce_deltas(
+    events: AsyncIterator[StreamEvent],
+    window_ms: int,
+    max_bytes: int,
+) -> AsyncIterator[StreamEvent]:
+    """
+    合并连续的 DeltaEvent，减少 SSE 帧数（系统调用与代理开销）：
+    - 缓冲的增量达到 max_bytes（UTF-8 字节）或自首个未发送增量起超过 window_ms 时输出一次
+    - 其他事件会先冲刷缓冲，再原样输出
+    - window_ms <= 0 时不做合并，逐条透传（打字机效果）
+    """
+    if window_ms <= 0:
+        async for event in events:
+            yield event
+        return
+
+    loop = asyncio.get_running_loop()
+    window = window_ms / 1000
+    # 有界队列：下游发送变慢时对上游形成背压
+    queue: asyncio.Queue = asyncio.Queue(maxsize=256)
+    pump = asyncio.create_task(_pump(events, queue))
+    parts: List[str] = []
+    size = 0
+    deadline: Optional[float] = None
+
+    # 跨越时间窗口保留同一个 get 任务：超时只表示窗口到期，不取消正在进行的 get，避免取消与取到数据同时发生时丢失条目
+    get_task: Optional[asyncio.Task] = None
+
+    try:
+        while True:
+            if get_task is None:
+                get_task = asyncio.ensure_future(queue.get())
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            done, _ = await asyncio.wait({get_task}, timeout=timeout)
+            if not done:
+                # 时间窗口到期，输出已缓冲的增量
+                yield DeltaEvent("".join(parts))
+                parts, size, deadline = [], 0, None
+                continue
+            item = get_task.result()
+            get_task = None
+
+            if isinstance(item, DeltaEvent):
+                parts.append(item.content)
+                size += len(item.content.encode("utf-8"))
+                if deadline is None:
+                    deadline = loop.time() + window
+                if size >= max_bytes:
+                    yield DeltaEvent("".join(parts))
+                    parts, size, deadline = [], 0, None
+                continue
+
+            if parts:
+                yield DeltaEvent("".join(parts))
+                parts, size, deadline = [], 0, None
+            if item is _END:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        if get_task is not None:
+            get_task.cancel()
+        if not pump.done():
+            pump.cancel()
+            try:
+                await pump
+            except (asyncio.CancelledError, Exception):
+                pass
@@ -11,17 +11,41 @@ project_root = current_file.parent.parent.parent
 sys.path.append(str(project_root))
 
 from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.stream_events import StreamEvent, DeltaEvent, UsageEvent, DoneEvent, ErrorEvent
+from app.services.resilience import SUCCESS, UpstreamUnavailableError, classify, coze_guard
+
+
+def _chat_outcome(event) -> Optional[str]:
+    """对话完成或出错事件决定本次上游调用的结果（供调用保护统计）"""
+    if event.event == ChatEventType.CONVERSATION_CHAT_COMPLETED:
+        return SUCCESS
+    if event.event == ChatEventType.ERROR:
+        return classify(event.error)
+    return None
+
+
+async def _cancel_chat(coze: AsyncCoze, conversation_id: str, chat_id: str) -> None:
+    """通知 Coze 取消进行中的对话，尽力而为：超时或失败只计数，不影响流的关闭"""
+    try:
+        await asyncio.wait_for(
+            coze.chat.cancel(conversation_id=conversation_id, chat_id=chat_id),
+            timeout=settings.COZE_CANCEL_TIMEOUT_SECONDS,
+        )
+    except Exception:
+        metrics.incr("coze.chat_cancel_failed")
+
 
 class PromptGenerationService:
     """提示词生成服务基类"""
     
-    def __init__(self, bot_id):
+    def __init__(self, bot_id, coze: Optional[AsyncCoze] = None):
         self.base_url = settings.COZE_BASE_URL
         self.authorization = settings.COZE_AUTHORIZATION
         self.bot_id = bot_id
         self.user_id = uuid.uuid4().hex
-        # 使用异步Coze客户端替代同步客户端
-        self.coze = AsyncCoze(
+        # 优先使用注入的共享客户端（进程级连接池），未注入时才单独创建
+        self.coze = coze or AsyncCoze(
             auth=TokenAuth(token=self.authorization), 
             base_url=self.base_url
         )
@@ -30,7 +54,10 @@ class PromptGenerationService:
         self, 
         objects: List[MessageObjectString], 
         meta_data: Optional[Dict[str, str]] = None
-    ) -> AsyncGenerator[str, None]:
+    ) -> AsyncGenerator[StreamEvent, None]:
+        stream = None
+        finished = False
+        chat = None
         try:
             user_message = Message.build_user_question_objects(
                 objects=objects, 
@@ -38,71 +65,94 @@ class PromptGenerationService:
             )
             
             # 直接调用异步stream方法，使用async for遍历
-            async for event in self.coze.chat.stream(
+            stream = coze_guard.stream(self.coze.chat.stream(
                 bot_id=self.bot_id,
                 user_id=self.user_id,
                 additional_messages=[user_message],
-            ):
-                if event.event == ChatEventType.CONVERSATION_MESSAGE_DELTA:
-                    # 按照SSE规范格式化数据，过滤掉空内容
-                    if event.message.content.strip():
-                        yield f"data: {event.message.content}\n\n"
+            ), outcome_of=_chat_outcome)
+            async for event in stream:
+                if event.event == ChatEventType.CONVERSATION_CHAT_CREATED:
+                    # 记录对话 ID，提前断开时用于取消
+                    chat = event.chat
+                elif event.event == ChatEventType.CONVERSATION_MESSAGE_DELTA:
+                    # 只过滤空内容，保留增量中的空白字符
+                    if event.message.content:
+                        yield DeltaEvent(event.message.content)
                 elif event.event == ChatEventType.CONVERSATION_CHAT_COMPLETED:
-                    print(f"Token使用量: {event.chat.usage.token_count}")
-                    # 发送结束消息
-                    yield "data: [DONE]\n\n"
+                    finished = True
+                    yield UsageEvent(event.chat.usage.token_count)
+                    yield DoneEvent()
                     break
                 elif event.event == ChatEventType.ERROR:
-                    raise Exception(f"Coze API错误: {event.error}")
+                    finished = True
+                    yield ErrorEvent(f"Coze API错误: {event.error}")
+                    break
+            finished = True
                     
+        except UpstreamUnavailableError:
+            finished = True
+            raise
         except Exception as e:
+            finished = True
             raise RuntimeError(f"调用Coze服务失败: {str(e)}")
+        finally:
+            try:
+                if not finished:
+                    # 消费方提前关闭（如客户端断开），对话被中途取消
+                    metrics.incr("coze.chat_cancelled")
+                    # 仅关闭连接时 Coze 仍会把对话跑完并计费，需显式取消
+                    if chat is not None:
+                        await _cancel_chat(self.coze, chat.conversation_id, chat.id)
+            finally:
+                # 及时关闭上游流，释放连接，不再继续接收（和计费）后续内容
+                if stream is not None and hasattr(stream, "aclose"):
+                    await stream.aclose()
 
 # 一些继承PromptGenerationService的子类， 实现不同的风格提示词生成服务
 class CuteStylePromptGenerationService(PromptGenerationService):
     '''异步的可爱提示词生成服务类'''
     
-    def __init__(self):
-        super().__init__(settings.CUTE_STYLE_PROMPT_GENERATION_BOT_ID)
+    def __init__(self, coze: Optional[AsyncCoze] = None):
+        super().__init__(settings.CUTE_STYLE_PROMPT_GENERATION_BOT_ID, coze)
 
 class SteampunkStylePromptGenerationService(PromptGenerationService):
     '''异步的蒸汽朋克提示词生成服务类'''
     
-    def __init__(self):
-        super().__init__(settings.STEAMPUNK_STYLE_PROMPT_GENERATION_BOT_ID)
+    def __init__(self, coze: Optional[AsyncCoze] = None):
+        super().__init__(settings.STEAMPUNK_STYLE_PROMPT_GENERATION_BOT_ID, coze)
 
 class JapaneseComicStylePromptGenerationService(PromptGenerationService):
     '''异步的日漫风格提示词服务类'''
     
-    def __init__(self):
-        super().__init__(settings.JAPANESE_COMIC_STYLE_PROMPT_GENERATION_BOT_ID)
+    def __init__(self, coze: Optional[AsyncCoze] = None):
+        super().__init__(settings.JAPANESE_COMIC_STYLE_PROMPT_GENERATION_BOT_ID, coze)
 
 class AmericanComicStylePromptGenerationService(PromptGenerationService):
     '''异步的美漫风格提示词服务类'''
     
-    def __init__(self):
-        super().__init__(settings.AMERICAN_COMIC_STYLE_PROMPT_GENERATION_BOT_ID)
+    def __init__(self, coze: Optional[AsyncCoze] = None):
+        super().__init__(settings.AMERICAN_COMIC_STYLE_PROMPT_GENERATION_BOT_ID, coze)
 
 class ProfessionStylePromptGenerationService(PromptGenerationService):
     '''异步的职业风格提示词服务类'''
     
-    def __init__(self):
-        super().__init__(settings.PROFESSION_STYLE_PROMPT_GENERATION_BOT_ID)
+    def __init__(self, coze: Optional[AsyncCoze] = None):
+        super().__init__(settings.PROFESSION_STYLE_PROMPT_GENERATION_BOT_ID, coze)
 
 class CyberpunkStylePromptGenerationService(PromptGenerationService):
     '''异步的赛博朋克风格提示词服务类'''
     
-    def __init__(self):
-        super().__init__(settings.CYBERPUNK_STYLE_PROMPT_GENERATION_BOT_ID)
+    def __init__(self, coze: Optional[AsyncCoze] = None):
+        super().__init__(settings.CYBERPUNK_STYLE_PROMPT_GENERATION_BOT_ID, coze)
 
 class GothicStylePromptGenerationService(PromptGenerationService):
     '''异步的哥特风提示词服务类'''
     
-    def __init__(self):
-        super().__init__(settings.GOTHIC_STYLE_PROMPT_GENERATION_BOT_ID)
+    def __init__(self, coze: Optional[AsyncCoze] = None):
+        super().__init__(settings.GOTHIC_STYLE_PROMPT_GENERATION_BOT_ID, coze)
 
 class RealisticStylePromptGenerationService(PromptGenerationService):
     '''异步的逼真风格提示词服务类'''
     
-    def __init__(self):
-        super().__init__(settings.REALISTIC_STYLE_PROMPT_GENERATION_BOT_ID)
\ No newline at end of file
+    def __init__(self, coze: Optional[AsyncCoze] = None):
+        super().__init__(settings.REALISTIC_STYLE_PROMPT_GENERATION_BOT_ID, coze)
\ No newline at end of file
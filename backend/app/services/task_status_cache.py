@@ -0,0 +1,199 @@
+import json
+import sys
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.mysql import insert
+
+current_file = Path(__file__).resolve()
+project_root = current_file.parent.parent.parent
+sys.path.append(str(project_root))
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.logger import get_logger
+from app.core.metrics import metrics
+from app.models.task_status import TaskStatusRecord
+
+logger = get_logger(service="task_status_cache")
+
+
+def _sora_status(payload: Dict[str, Any]) -> Optional[str]:
+    return payload.get("status")
+
+
+def _tripo_status(payload: Dict[str, Any]) -> Optional[str]:
+    return (payload.get("data") or {}).get("status")
+
+
+# 持久化时去掉签名 URL 的记录带有此标记，读取时不能直接返回给调用方
+_SIGNED_URLS_REMOVED = "_signed_urls_removed"
+
+
+def _tripo_without_signed_urls(payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Tripo 成功结果中的模型 / 预览图地址是会过期的签名 URL；返回去掉这些字段的副本，其他状态返回 None"""
+    data = payload.get("data") or {}
+    if data.get("status") != "success":
+        return None
+    stripped = {key: value for key, value in payload.items() if key not in ("model_url", "preview_url")}
+    stripped["data"] = {key: value for key, value in data.items() if key not in ("output", "result")}
+    stripped[_SIGNED_URLS_REMOVED] = True
+    return stripped
+
+
+def _no_signed_urls(payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    return None
+
+
+# 各服务商的状态字段、终止状态，以及去掉结果中签名 URL 的方法
+_PROVIDERS: Dict[
+    str,
+    Tuple[Callable[[Dict[str, Any]], Optional[str]], frozenset, Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]],
+] = {
+    "sora": (_sora_status, frozenset({"succeeded", "failed"}), _no_signed_urls),
+    "tripo": (
+        _tripo_status,
+        frozenset({"success", "failed", "cancelled", "banned", "expired"}),
+        _tripo_without_signed_urls,
+    ),
+}
+
+
+class TaskStatusCache:
+    """
+    上游任务状态缓存：
+    - 进行中的状态在内存中缓存 pending_ttl 秒，合并短时间内的重复查询
+    - 已结束的状态不会再变化，写入数据库永久复用，并在内存 LRU 中保留，命中时不访问上游
+    - 结果中带会过期的签名 URL 时（Tripo 成功结果），数据库只保存去掉 URL 的状态，
+      完整结果只在内存中保留 signed_url_ttl 秒，之后重新查询上游以取得新的 URL
+    """
+
+    def __init__(self, pending_ttl: float, max_entries: int, signed_url_ttl: float):
+        self.pending_ttl = pending_ttl
+        self.max_entries = max_entries
+        self.signed_url_ttl = signed_url_ttl
+        # 值为 (过期时间，None 表示不过期, 状态)
+        self._terminal: "OrderedDict[Tuple[str, str], Tuple[Optional[float], Dict[str, Any]]]" = OrderedDict()
+        self._pending: Dict[Tuple[str, str], Tuple[float, Dict[str, Any]]] = {}
+
+    def status_of(self, provider: str, payload: Dict[str, Any]) -> Optional[str]:
+        return _PROVIDERS[provider][0](payload)
+
+    def is_terminal(self, provider: str, payload: Dict[str, Any]) -> bool:
+        extract, terminal, _ = _PROVIDERS[provider]
+        return extract(payload) in terminal
+
+    def _remember_terminal(self, key: Tuple[str, str], payload: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        self._terminal[key] = (None if ttl is None else time.monotonic() + ttl, payload)
+        self._terminal.move_to_end(key)
+        while len(self._terminal) > self.max_entries:
+            self._terminal.popitem(last=False)
+
+    async def _load(self, provider: str, task_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    select(TaskStatusRecord.payload).where(
+                        TaskStatusRecord.provider == provider,
+                        TaskStatusRecord.task_id == task_id,
+                    )
+                )
+                payload = result.scalar_one_or_none()
+        except Exception as e:
+            logger.warning(f"Failed to read task status cache: {e}")
+            return None
+        return json.loads(payload) if payload else None
+
+    async def _persist(self, provider: str, task_id: str, payload: Dict[str, Any]) -> None:
+        payload = _PROVIDERS[provider][2](payload) or payload
+        stmt = insert(TaskStatusRecord).values(
+            provider=provider,
+            task_id=task_id,
+            status=self.status_of(provider, payload) or "",
+            payload=json.dumps(payload, ensure_ascii=False),
+        )
+        stmt = stmt.on_duplicate_key_update(status=stmt.inserted.status, payload=stmt.inserted.payload)
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(stmt)
+                await session.commit()
+        except Exception as e:
+            logger.warning(f"Failed to write task status cache: {e}")
+
+    async def get(self, provider: str, task_id: str) -> Optional[Dict[str, Any]]:
+        """返回缓存的状态：已结束的任务（内存或数据库）或未过期的进行中状态；未命中返回 None"""
+        key = (provider, task_id)
+        terminal = self._terminal.get(key)
+        if terminal is not None:
+            expires_at, payload = terminal
+            if expires_at is None or time.monotonic() < expires_at:
+                self._terminal.move_to_end(key)
+                metrics.incr(f"task_status_cache.{provider}.terminal_hit")
+                return payload
+            # 签名 URL 已过期，数据库中也没有 URL，重新查询上游
+            del self._terminal[key]
+            metrics.incr(f"task_status_cache.{provider}.signed_url_expired")
+            return None
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            expires_at, payload = pending
+            if time.monotonic() < expires_at:
+                metrics.incr(f"task_status_cache.{provider}.pending_hit")
+                return payload
+            # 本进程见过且未结束，不必再查数据库
+            metrics.incr(f"task_status_cache.{provider}.miss")
+            return None
+
+        payload = await self._load(provider, task_id)
+        if payload is not None and not payload.get(_SIGNED_URLS_REMOVED):
+            self._remember_terminal(key, payload)
+            metrics.incr(f"task_status_cache.{provider}.db_hit")
+            return payload
+        metrics.incr(f"task_status_cache.{provider}.miss")
+        return None
+
+    async def set(self, provider: str, task_id: str, payload: Dict[str, Any]) -> None:
+        key = (provider, task_id)
+        if self.is_terminal(provider, payload):
+            self._pending.pop(key, None)
+            if key not in self._terminal:
+                await self._persist(provider, task_id, payload)
+            signed = _PROVIDERS[provider][2](payload) is not None
+            self._remember_terminal(key, payload, self.signed_url_ttl if signed else None)
+        else:
+            self._pending[key] = (time.monotonic() + self.pending_ttl, payload)
+            self._evict_pending()
+
+    def _evict_pending(self) -> None:
+        if len(self._pending) <= self.max_entries:
+            return
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _) in self._pending.items() if expires_at <= now]:
+            del self._pending[key]
+        while len(self._pending) > self.max_entries:
+            self._pending.pop(next(iter(self._pending)))
+
+    async def get_or_fetch(
+        self,
+        provider: str,
+        task_id: str,
+        fetch: Callable[[], Awaitable[Dict[str, Any]]],
+    ) -> Dict[str, Any]:
+        """优先使用缓存，未命中时调用 fetch 查询上游并写入缓存"""
+        payload = await self.get(provider, task_id)
+        if payload is not None:
+            return payload
+        payload = await fetch()
+        await self.set(provider, task_id, payload)
+        return payload
+
+
+task_status_cache = TaskStatusCache(
+    pending_ttl=settings.TASK_STATUS_PENDING_TTL_SECONDS,
+    max_entries=settings.TASK_STATUS_CACHE_MAX_ENTRIES,
+    signed_url_ttl=settings.TASK_STATUS_SIGNED_URL_TTL_SECONDS,
+)
@@ -0,0 +1,179 @@
+import asyncio
+import sys
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Deque, Dict, Mapping, Optional
+
+current_file = Path(__file__).resolve()
+project_root = current_file.parent.parent.parent
+sys.path.append(str(project_root))
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.resilience import AIMDLimiter, coze_guard, sora_guard, tripo_guard
+
+# 未登录用户的档位
+ANONYMOUS_TIER = "anonymous"
+
+# 步长调度的基数：每次分配后档位的 pass 增加 STRIDE_BASE / 权重
+STRIDE_BASE = 1 << 20
+
+
+class _TierState:
+    def __init__(self, weight: int):
+        self.weight = max(1, int(weight))
+        self.stride = STRIDE_BASE / self.weight
+        self.pass_value = 0.0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.granted = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+
+class TierScheduler:
+    """
+    按用户档位加权公平地分配上游并发名额（步长调度 stride scheduling）：
+    - capacity 为该上游的最大并发数，有空闲名额且无人排队时直接放行
+    - 名额不足时按档位排队；名额释放后分配给 pass 最小的档位，该档位 pass 增加 STRIDE_BASE / 权重，
+      因此满载时各档位获得的名额与权重成正比，低档位不会被完全饿死
+    - 档位从空闲变为排队时，pass 追平到当前虚拟时间，空闲期间不会积攒额度
+    - 提供 limiter 时，实际容量为 min(capacity, 自适应并发上限)：上游限流或变慢时少放行，排队仍在这里按档位进行
+    """
+
+    def __init__(
+        self,
+        name: str,
+        capacity: int,
+        weights: Mapping[str, int],
+        default_tier: str = ANONYMOUS_TIER,
+        limiter: Optional[AIMDLimiter] = None,
+    ):
+        self.name = name
+        self.capacity = capacity
+        self._limiter = limiter
+        if limiter is not None:
+            # 上限提高时立即放行排队的请求
+            limiter.add_listener(self._dispatch)
+        self.default_tier = default_tier
+        self._tiers: Dict[str, _TierState] = {tier: _TierState(weight) for tier, weight in weights.items()}
+        if default_tier not in self._tiers:
+            self._tiers[default_tier] = _TierState(1)
+        self._in_use = 0
+        self._virtual_time = 0.0
+
+    @property
+    def effective_capacity(self) -> int:
+        if self._limiter is None:
+            return self.capacity
+        return max(1, min(self.capacity, self._limiter.current))
+
+    def _resolve(self, tier: Optional[str]) -> str:
+        return tier if tier in self._tiers else self.default_tier
+
+    def _waiting(self) -> int:
+        return sum(len(state.waiters) for state in self._tiers.values())
+
+    def _grant(self, tier: str, waited: float) -> None:
+        state = self._tiers[tier]
+        self._in_use += 1
+        self._virtual_time = state.pass_value
+        state.pass_value += state.stride
+        state.granted += 1
+        state.wait_seconds += waited
+        state.max_wait_seconds = max(state.max_wait_seconds, waited)
+        metrics.incr(f"tier_scheduler.{self.name}.{tier}.granted")
+
+    def _dispatch(self) -> None:
+        """把空闲名额依次分配给 pass 最小的排队档位"""
+        while self._in_use < self.effective_capacity:
+            candidates = [(state.pass_value, tier) for tier, state in self._tiers.items() if state.waiters]
+            if not candidates:
+                return
+            _, tier = min(candidates)
+            future = self._tiers[tier].waiters.popleft()
+            if future.done():
+                continue
+            future.set_result(None)
+            # 等待时间在 acquire 中统计，这里只占用名额并推进 pass
+            self._grant(tier, 0.0)
+
+    async def acquire(self, tier: Optional[str]) -> None:
+        tier = self._resolve(tier)
+        state = self._tiers[tier]
+        if self._in_use < self.effective_capacity and not self._waiting():
+            self._grant(tier, 0.0)
+            return
+
+        if not state.waiters:
+            state.pass_value = max(state.pass_value, self._virtual_time)
+        future = asyncio.get_running_loop().create_future()
+        state.waiters.append(future)
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分配到名额但等待方被取消：归还名额
+                self.release()
+            else:
+                try:
+                    state.waiters.remove(future)
+                except ValueError:
+                    pass
+            metrics.incr(f"tier_scheduler.{self.name}.{tier}.cancelled")
+            raise
+        waited = time.monotonic() - started
+        state.wait_seconds += waited
+        state.max_wait_seconds = max(state.max_wait_seconds, waited)
+
+    def release(self) -> None:
+        self._in_use -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, tier: Optional[str]) -> AsyncIterator[None]:
+        """占用一个上游名额，退出时归还"""
+        await self.acquire(tier)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "effective_capacity": self.effective_capacity,
+            "in_use": self._in_use,
+            "waiting": self._waiting(),
+            "tiers": {
+                tier: {
+                    "weight": state.weight,
+                    "queue_depth": len(state.waiters),
+                    "granted": state.granted,
+                    "avg_wait_ms": round(state.wait_seconds / state.granted * 1000, 2) if state.granted else 0.0,
+                    "max_wait_ms": round(state.max_wait_seconds * 1000, 2),
+                }
+                for tier, state in self._tiers.items()
+            },
+        }
+
+
+upstream_schedulers: Dict[str, TierScheduler] = {
+    "coze": TierScheduler("coze", settings.COZE_UPSTREAM_SLOTS, settings.USER_TIER_WEIGHTS, limiter=coze_guard.limiter),
+    "sora": TierScheduler("sora", settings.SORA_UPSTREAM_SLOTS, settings.USER_TIER_WEIGHTS, limiter=sora_guard.limiter),
+    "tripo": TierScheduler(
+        "tripo", settings.TRIPO_UPSTREAM_SLOTS, settings.USER_TIER_WEIGHTS, limiter=tripo_guard.limiter
+    ),
+}
+
+
+def upstream_slot(provider: str, tier: Optional[str]):
+    """占用指定上游的一个并发名额：async with upstream_slot("sora", tier): ..."""
+    return upstream_schedulers[provider].slot(tier)
+
+
+metrics.register_collector(
+    "tier_scheduler", lambda: {name: scheduler.stats() for name, scheduler in upstream_schedulers.items()}
+)
@@ -1,6 +1,6 @@
 import json
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import sys
 import httpx
 from pydantic import BaseModel, HttpUrl
@@ -10,8 +10,10 @@ current_file = Path(__file__).resolve()
 project_root = current_file.parent.parent.parent
 sys.path.append(str(project_root))
 
-from app.core.config import settings
 from app.core.logger import get_logger
+from app.services.image_normalizer import image_normalizer
+from app.services.credential_pool import tripo_credentials
+from app.services.resilience import tripo_guard, tripo_status_guard
 
 # --- 服务配置与模型定义 ---
 logger = get_logger(__name__)
@@ -33,22 +35,55 @@ class _TripoAPIClient:
     相当于厨房里的“专家厨师”。
     """
     def __init__(self):
-        self._api_key = settings.TRIPO_API_KEY
+        # 从凭据池中取 key（最久未使用、跳过冷却中的 key），响应通过钩子上报给凭据池
+        self._api_key = tripo_credentials.acquire()
         self._headers = {"Authorization": f"Bearer {self._api_key}"}
-        self._client = httpx.AsyncClient(headers=self._headers, timeout=60.0)
+        self._client = httpx.AsyncClient(
+            headers=self._headers,
+            timeout=60.0,
+            event_hooks={"response": [tripo_credentials.response_hook()]},
+        )
 
     async def close(self):
         await self._client.aclose()
 
+    def _rotate_key(self, exc: BaseException) -> None:
+        """当前 key 被限流时换一个 key 重试"""
+        if getattr(getattr(exc, "response", None), "status_code", None) == 429:
+            self._api_key = tripo_credentials.acquire()
+            self._client.headers["Authorization"] = f"Bearer {self._api_key}"
+
+    async def _post(self, url: str, idempotent: bool = True, **kwargs) -> httpx.Response:
+        """经调用保护（自适应并发、熔断、重试）发送 POST"""
+        async def send() -> httpx.Response:
+            response = await self._client.post(url, **kwargs)
+            response.raise_for_status()
+            return response
+        return await tripo_guard.call(send, idempotent=idempotent, on_retry=self._rotate_key)
+
     async def upload_image(self, file_path: Path) -> str:
         """上传图片文件以获取image_token。"""
         if not file_path.exists():
             raise FileNotFoundError(f"File not found: {file_path}")
 
         with open(file_path, "rb") as f:
-            files = {"file": (file_path.name, f)}
-            response = await self._client.post(UPLOAD_URL, files=files)
-        
+            async def send() -> httpx.Response:
+                # 重试时从文件开头重新发送
+                f.seek(0)
+                response = await self._client.post(UPLOAD_URL, files={"file": (file_path.name, f)})
+                response.raise_for_status()
+                return response
+            response = await tripo_guard.call(send, on_retry=self._rotate_key)
+
+        return self._parse_image_token(response)
+
+    async def upload_image_bytes(self, data: bytes, filename: str, content_type: str) -> str:
+        """上传内存中的图片内容以获取image_token。"""
+        files = {"file": (filename, data, content_type)}
+        response = await self._post(UPLOAD_URL, files=files)
+        return self._parse_image_token(response)
+
+    def _parse_image_token(self, response: httpx.Response) -> str:
         response.raise_for_status()
         data = response.json()
         image_token = data.get("data", {}).get("image_token")
@@ -57,24 +92,44 @@ class _TripoAPIClient:
         logger.info(f"File uploaded successfully! Image Token: {image_token[:10]}...")
         return image_token
 
-    async def create_task(self, image_token: str) -> str:
-        """使用image_token创建模型生成任务。"""
-        payload = {"type": "image_to_model", "file": {"type": "png", "file_token": image_token}}
-        response = await self._client.post(TASK_URL, json=payload)
-        response.raise_for_status()
+    async def create_task(self, image_token: str, file_type: str = "png") -> str:
+        """使用image_token创建模型生成任务，file_type 为上传图片的实际格式（jpg/png/webp）。"""
+        payload = {"type": "image_to_model", "file": {"type": file_type, "file_token": image_token}}
+        # 创建任务不是幂等的，只在限流或请求未发出时重试
+        response = await self._post(TASK_URL, idempotent=False, json=payload)
         data = response.json()
         task_id = data.get("data", {}).get("task_id")
         if not task_id:
             raise KeyError(f"API response missing 'task_id': {data}")
         logger.info(f"Task created successfully! Task ID: {task_id}")
+        # 任务只能用创建它的 key 查询
+        tripo_credentials.remember(task_id, self._api_key)
         return task_id
 
     async def check_status(self, task_id: str) -> Dict[str, Any]:
-        """通过HTTP GET请求检查任务的当前状态。"""
+        """通过HTTP GET请求检查任务的当前状态（使用创建该任务的 key，未知时依次尝试池中的 key）。"""
         url = TASK_STATUS_URL.format(task_id=task_id)
-        response = await self._client.get(url)
-        response.raise_for_status()
-        return response.json()
+        candidates = tripo_credentials.candidates(task_id)
+        rejected: Optional[httpx.Response] = None
+        for index, key in enumerate(candidates):
+            async def fetch(key: str = key, last: bool = index + 1 == len(candidates)):
+                response = await self._client.get(url, headers={"Authorization": f"Bearer {key}"})
+                if response.status_code in (401, 403, 404, 429) and not last:
+                    return response
+                response.raise_for_status()
+                return response
+
+            response = await tripo_status_guard.call(fetch)
+            if response.is_error:
+                rejected = response
+                continue
+            tripo_credentials.remember(task_id, key)
+            return response.json()
+
+        # 所有 key 都未能查询到该任务：报告最后一次被拒绝的结果，不返回 None
+        if rejected is not None:
+            rejected.raise_for_status()
+        raise RuntimeError(f"No Tripo credential could query task {task_id}")
 
 # ==============================================================================
 #  高层业务服务 (外部调用)
@@ -93,8 +148,12 @@ class Tripo3DService:
         这是一个快速操作，编排了“上传”和“创建”两个步骤。
         """
         logger.info(f"Submitting 3D task for file: {file_path}")
-        image_token = await self._api_client.upload_image(file_path)
-        task_id = await self._api_client.create_task(image_token)
+        # 缩放、去除 EXIF 后再上传，任务类型使用规范化后的实际格式
+        image = await image_normalizer.normalize_file(file_path, "tripo")
+        image_token = await self._api_client.upload_image_bytes(
+            image.data, f"{Path(file_path).stem}.{image.ext}", image.mime_type
+        )
+        task_id = await self._api_client.create_task(image_token, file_type=image.ext)
         return task_id
 
     async def get_task_status(self, task_id: str) -> dict:
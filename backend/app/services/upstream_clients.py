@@ -0,0 +1,168 @@
+import ssl
+import sys
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import httpx
+from cozepy import AsyncCoze, AsyncHTTPClient, TokenAuth
+
+current_file = Path(__file__).resolve()
+project_root = current_file.parent.parent.parent
+sys.path.append(str(project_root))
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.core.metrics import metrics
+from app.services.credential_pool import coze_credentials, sora_credentials
+
+logger = get_logger(service="upstream_clients")
+
+# 进程级（每个 worker 一份）的共享上游客户端，由应用生命周期负责创建与关闭
+_coze_http_client: Optional[AsyncHTTPClient] = None
+# 每个 Coze token 一个 AsyncCoze，共用同一个连接池
+_coze_clients: Dict[str, AsyncCoze] = {}
+_sora_http_client: Optional[httpx.AsyncClient] = None
+
+
+async def _on_coze_request(request: httpx.Request) -> None:
+    metrics.incr("coze.http.requests")
+
+
+async def _on_sora_request(request: httpx.Request) -> None:
+    metrics.incr("sora.http.requests")
+
+
+def _http2_available() -> bool:
+    """HTTP/2 需要 h2 包（httpx[http2]），未安装时回退到 HTTP/1.1"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _build_coze_http_client() -> AsyncHTTPClient:
+    """构建带连接池参数的 Coze HTTP 客户端，复用 TCP/TLS 连接"""
+    limits = httpx.Limits(
+        max_connections=settings.COZE_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.COZE_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.COZE_KEEPALIVE_EXPIRY,
+    )
+    return AsyncHTTPClient(
+        limits=limits,
+        timeout=httpx.Timeout(settings.COZE_TIMEOUT_SECONDS, connect=10.0),
+        event_hooks={"request": [_on_coze_request], "response": [coze_credentials.response_hook()]},
+    )
+
+
+def get_coze_client() -> AsyncCoze:
+    """
+    获取共享的 AsyncCoze 客户端；未初始化时（如脚本中直接调用）惰性创建。
+    配置了多个 token 时，每次按凭据池（最久未使用、跳过冷却中的 token）选择一个。
+    """
+    global _coze_http_client
+    if _coze_http_client is None:
+        _coze_http_client = _build_coze_http_client()
+        logger.info(
+            f"Coze client created: max_connections={settings.COZE_MAX_CONNECTIONS}, "
+            f"max_keepalive={settings.COZE_MAX_KEEPALIVE_CONNECTIONS}, tokens={len(coze_credentials.keys)}"
+        )
+    token = coze_credentials.acquire()
+    client = _coze_clients.get(token)
+    if client is None:
+        client = AsyncCoze(
+            auth=TokenAuth(token=token),
+            base_url=settings.COZE_BASE_URL,
+            http_client=_coze_http_client,
+        )
+        _coze_clients[token] = client
+    return client
+
+
+def get_sora_http_client() -> httpx.AsyncClient:
+    """获取共享的 Sora HTTP 客户端（keep-alive，可用时启用 HTTP/2）；未初始化时惰性创建"""
+    global _sora_http_client
+    if _sora_http_client is None:
+        # Sora 中转服务的证书链需要放宽 OpenSSL 安全级别
+        ssl_context = ssl.create_default_context()
+        ssl_context.set_ciphers('DEFAULT@SECLEVEL=1')
+        http2 = settings.SORA_HTTP2 and _http2_available()
+        _sora_http_client = httpx.AsyncClient(
+            verify=ssl_context,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.SORA_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.SORA_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.SORA_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(settings.SORA_TIMEOUT_SECONDS, connect=10.0),
+            event_hooks={"request": [_on_sora_request], "response": [sora_credentials.response_hook()]},
+        )
+        logger.info(
+            f"Sora client created: http2={http2}, max_connections={settings.SORA_MAX_CONNECTIONS}, "
+            f"max_keepalive={settings.SORA_MAX_KEEPALIVE_CONNECTIONS}"
+        )
+    return _sora_http_client
+
+
+def init_upstream_clients() -> None:
+    """应用启动时预先创建共享客户端"""
+    get_coze_client()
+    get_sora_http_client()
+
+
+async def close_upstream_clients() -> None:
+    """应用关闭时释放连接池"""
+    global _coze_http_client, _sora_http_client
+    if _coze_http_client is not None:
+        try:
+            await _coze_http_client.aclose()
+        except Exception as e:
+            logger.error(f"Failed to close Coze http client: {e}")
+    _coze_http_client = None
+    _coze_clients.clear()
+    if _sora_http_client is not None:
+        try:
+            await _sora_http_client.aclose()
+        except Exception as e:
+            logger.error(f"Failed to close Sora http client: {e}")
+    _sora_http_client = None
+
+
+def _pool_stats(client: Optional[httpx.AsyncClient]) -> Dict[str, Any]:
+    """
+    读取 httpx 底层连接池的使用情况。
+    httpx 没有公开该信息，这里通过 httpcore 连接池的内部属性读取，取不到时返回空统计。
+    """
+    stats = {"initialized": client is not None, "connections": 0, "idle": 0, "active": 0}
+    if client is None:
+        return stats
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    idle = sum(1 for conn in connections if getattr(conn, "is_idle", lambda: False)())
+    stats.update(connections=len(connections), idle=idle, active=len(connections) - idle)
+    return stats
+
+
+def get_coze_pool_stats() -> Dict[str, Any]:
+    stats = _pool_stats(_coze_http_client)
+    stats.update(
+        max_connections=settings.COZE_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.COZE_MAX_KEEPALIVE_CONNECTIONS,
+        requests=metrics.get("coze.http.requests"),
+    )
+    return stats
+
+
+def get_sora_pool_stats() -> Dict[str, Any]:
+    stats = _pool_stats(_sora_http_client)
+    stats.update(
+        max_connections=settings.SORA_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.SORA_MAX_KEEPALIVE_CONNECTIONS,
+        requests=metrics.get("sora.http.requests"),
+    )
+    return stats
+
+
+metrics.register_collector("coze_pool", get_coze_pool_stats)
+metrics.register_collector("sora_pool", get_sora_pool_stats)
@@ -0,0 +1,75 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from sqlalchemy.dialects.mysql import insert
+from dataclasses import dataclass
+from typing import Iterable, Tuple
+from pathlib import Path
+import sys
+
+current_file = Path(__file__).resolve()
+project_root = current_file.parent.parent.parent
+sys.path.append(str(project_root))
+
+from app.models.usage import UsageCounter, UsageTask
+from app.core.logger import get_logger
+from app.core.metrics import metrics
+
+logger = get_logger(service="usage_service")
+
+
+@dataclass
+class UsageRecordResult:
+    counted: int   # 本次新计入的任务数
+    dedup: int     # 已记录过、被忽略的任务数
+    used: int      # 计入后的累计使用次数（数据库中的值）
+
+
+class UsageService:
+    """
+    使用次数记账：任务记录与计数在同一个事务中完成
+    - INSERT IGNORE 写入 usage_tasks（task_id 唯一），受影响行数即新任务数，重复的 task_id 不计数
+    - 只有新任务才执行 INSERT ... ON DUPLICATE KEY UPDATE used_count = used_count + n，由数据库原子累加，
+      并发请求不会丢失更新
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def _used_count(self, user_id: int) -> int:
+        result = await self.db.execute(select(UsageCounter.used_count).where(UsageCounter.user_id == user_id))
+        return int(result.scalar_one_or_none() or 0)
+
+    async def record_tasks(self, user_id: int, tasks: Iterable[Tuple[str, str]]) -> UsageRecordResult:
+        """记录一批 (task_id, service_type)，新任务计入使用次数"""
+        rows = {}
+        for task_id, service_type in tasks:
+            # 同一批次内重复的 task_id 只保留一个
+            rows.setdefault(task_id, service_type)
+        if not rows:
+            return UsageRecordResult(counted=0, dedup=0, used=await self._used_count(user_id))
+
+        try:
+            # 多行 VALUES 的单条语句，rowcount 为实际插入的行数
+            result = await self.db.execute(
+                insert(UsageTask).prefix_with("IGNORE").values([
+                    {"user_id": user_id, "task_id": task_id, "service_type": service_type}
+                    for task_id, service_type in rows.items()
+                ])
+            )
+            counted = result.rowcount
+            if counted:
+                stmt = insert(UsageCounter).values(user_id=user_id, used_count=counted)
+                stmt = stmt.on_duplicate_key_update(used_count=UsageCounter.used_count + counted)
+                await self.db.execute(stmt)
+            # 同一事务内读取，拿到的是本次累加后的值
+            used = await self._used_count(user_id)
+            await self.db.commit()
+        except Exception:
+            await self.db.rollback()
+            raise
+
+        metrics.incr("usage.tasks_counted", counted)
+        return UsageRecordResult(counted=counted, dedup=len(rows) - counted, used=used)
+
+    async def record_task(self, user_id: int, task_id: str, service_type: str) -> UsageRecordResult:
+        return await self.record_tasks(user_id, [(task_id, service_type)])
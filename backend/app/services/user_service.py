@@ -12,7 +12,7 @@ sys.path.append(str(project_root))
 
 from app.models.user import User
 from app.schemas.user import UserCreate
-from app.core.hashing import get_password_hash, verify_password
+from app.core.hashing import get_password_hash_async, verify_password_async
 from app.core.logger import get_logger
 
 logger = get_logger(service="user_service")
@@ -33,7 +33,7 @@ class UserService:
         # 创建新用户
         db_user = User(
             username=user_data.username,
-            password_hash=get_password_hash(user_data.password)
+            password_hash=await get_password_hash_async(user_data.password)
         )
         self.db.add(db_user)
         try:
@@ -58,7 +58,7 @@ class UserService:
             logger.warning(f"User not found: {username}")
             return None
             
-        if not verify_password(password, user.password_hash):
+        if not await verify_password_async(password, user.password_hash):
             logger.warning(f"Invalid password for user: {username}")
             return None
 
@@ -86,7 +86,7 @@ class UserService:
             logger.warning(f"Admin user not found: {username}")
             return None
             
-        if not verify_password(password, user.password_hash):
+        if not await verify_password_async(password, user.password_hash):
             logger.warning(f"Invalid password for admin user: {username}")
             return None
             
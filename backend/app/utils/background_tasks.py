@@ -0,0 +1,40 @@
+import asyncio
+from typing import Awaitable, Optional, Set
+
+from app.core.logger import get_logger
+
+logger = get_logger(service="background_tasks")
+
+# 保存后台任务的强引用，避免任务在完成前被垃圾回收
+_tasks: Set[asyncio.Task] = set()
+
+
+def _on_done(task: asyncio.Task) -> None:
+    _tasks.discard(task)
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        logger.error(f"Background task {task.get_name()} failed: {exc}")
+
+
+def spawn(coro: Awaitable, name: Optional[str] = None) -> asyncio.Task:
+    """在后台运行协程（不阻塞当前请求），异常只记录日志"""
+    task = asyncio.ensure_future(coro)
+    if name:
+        task.set_name(name)
+    _tasks.add(task)
+    task.add_done_callback(_on_done)
+    return task
+
+
+async def drain(timeout: float = 30.0) -> None:
+    """应用关闭时等待尚未完成的后台任务（如文件落盘），超时后取消"""
+    if not _tasks:
+        return
+    pending = list(_tasks)
+    done, not_done = await asyncio.wait(pending, timeout=timeout)
+    for task in not_done:
+        task.cancel()
+    if not_done:
+        logger.warning(f"Cancelled {len(not_done)} background tasks on shutdown")
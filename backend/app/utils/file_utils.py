@@ -1,20 +1,151 @@
 # app/utils/file_utils.py
 
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Optional
 from fastapi import UploadFile, HTTPException
+import asyncio
+import hashlib
 import os
 import logging
 
+from app.core.config import settings
+
 logger = logging.getLogger(__name__)
 
 # 定义上传目录并确保存在
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
+# 常见图片格式的文件头（魔数），用于在读取首块时识别真实类型
+_IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+)
+
+
+def detect_image_type(head: bytes) -> Optional[str]:
+    """根据文件头识别图片类型，返回扩展名；无法识别时返回 None"""
+    for signature, ext in _IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+@dataclass
+class IngestedUpload:
+    """流式接收上传文件的结果"""
+    digest: str
+    size: int
+    ext: str
+    path: Optional[Path] = None
+    data: Optional[bytes] = None
+
+
+async def ingest_upload(
+    file: UploadFile,
+    save_path: Optional[Path] = None,
+    keep_bytes: bool = False,
+    max_bytes: Optional[int] = None,
+) -> IngestedUpload:
+    """
+    按固定大小分块读取上传文件，不把整个文件一次性读入内存：
+    - 首块检查图片魔数，不依赖客户端提供的 content_type
+    - 累计大小超过上限立即中止
+    - 边读边计算 SHA-256
+    - 提供 save_path 时逐块写入磁盘（写入在线程池中进行），先写临时文件再重命名
+
+    Args:
+        file: 从 FastAPI 接收的 UploadFile 对象。
+        save_path: 保存路径，为 None 时不落盘。
+        keep_bytes: 是否在结果中保留完整内容（用于后续直接上传到上游）。
+        max_bytes: 大小上限，默认使用 settings.UPLOAD_MAX_BYTES。
+
+    Raises:
+        HTTPException: 不是图片（400）、超过大小上限（413）或保存失败（500）。
+    """
+    max_bytes = max_bytes or settings.UPLOAD_MAX_BYTES
+    chunk_size = settings.UPLOAD_CHUNK_SIZE
+    hasher = hashlib.sha256()
+    chunks = []
+    size = 0
+    ext = None
+    out = None
+    tmp_path = save_path.with_name(save_path.name + ".part") if save_path else None
+
+    try:
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            if ext is None:
+                ext = detect_image_type(chunk)
+                if ext is None:
+                    raise HTTPException(status_code=400, detail="仅支持图片文件上传")
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"文件过大，最大支持 {max_bytes // (1024 * 1024)}MB")
+            hasher.update(chunk)
+            if keep_bytes:
+                chunks.append(chunk)
+            if tmp_path is not None:
+                if out is None:
+                    out = await asyncio.to_thread(open, tmp_path, "wb")
+                await asyncio.to_thread(out.write, chunk)
+
+        if ext is None:
+            raise HTTPException(status_code=400, detail="上传文件为空")
+        if out is not None:
+            await asyncio.to_thread(out.close)
+            out = None
+            await asyncio.to_thread(os.replace, tmp_path, save_path)
+    except HTTPException:
+        await _discard_partial(out, tmp_path)
+        raise
+    except Exception as e:
+        await _discard_partial(out, tmp_path)
+        logger.error(f"Failed to ingest upload {file.filename}: {e}")
+        raise HTTPException(status_code=500, detail="文件保存失败")
+
+    return IngestedUpload(
+        digest=hasher.hexdigest(),
+        size=size,
+        ext=ext,
+        path=save_path,
+        data=b"".join(chunks) if keep_bytes else None,
+    )
+
+
+async def _discard_partial(out, tmp_path: Optional[Path]) -> None:
+    """清理中止的写入留下的临时文件"""
+    if out is not None:
+        await asyncio.to_thread(out.close)
+    if tmp_path is not None and tmp_path.exists():
+        await asyncio.to_thread(tmp_path.unlink)
+
+
+async def write_bytes_chunked(path: Path, data: bytes, chunk_size: Optional[int] = None) -> None:
+    """把内存中的内容按块写入磁盘（写入在线程池中进行），先写临时文件再重命名"""
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE
+    tmp_path = path.with_name(path.name + ".part")
+    view = memoryview(data)
+    out = await asyncio.to_thread(open, tmp_path, "wb")
+    try:
+        for offset in range(0, len(view), chunk_size):
+            await asyncio.to_thread(out.write, view[offset:offset + chunk_size])
+    finally:
+        await asyncio.to_thread(out.close)
+    await asyncio.to_thread(os.replace, tmp_path, path)
+
 async def save_upload_file(file: UploadFile) -> Path:
     """
-    验证并保存上传的图片文件，返回保存后的路径。
+    验证并保存上传的图片文件（内容寻址存储），返回保存后的路径。
 
     Args:
         file: 从 FastAPI 接收的 UploadFile 对象。
@@ -23,33 +154,23 @@ async def save_upload_file(file: UploadFile) -> Path:
         保存文件的 Path 对象。
 
     Raises:
-        HTTPException: 如果文件不是图片或保存失败。
+        HTTPException: 如果文件不是图片、超过大小上限或保存失败。
     """
-    content_type = (file.content_type or "").lower()
-    if not content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="仅支持图片文件上传")
+    # 延迟导入，避免与 upload_store 循环依赖
+    from app.utils.upload_store import upload_store
 
-    # 生成不重复文件名：时间戳_原始文件名
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    safe_name = Path(file.filename).name
-    save_name = f"{timestamp}_{safe_name}"
-    save_path = UPLOAD_DIR / save_name
+    stored = await upload_store.put_upload(file)
+    return stored.path
 
-    # 保存文件
-    try:
-        data = await file.read()
-        save_path.write_bytes(data)
-    except Exception as e:
-        # 在服务端记录详细错误，但只给客户端返回通用错误
-        # logger.error(f"Failed to save file to {save_path}: {e}")
-        raise HTTPException(status_code=500, detail="文件保存失败")
 
-    return save_path
+def _legacy_files():
+    """旧版平铺在 uploads 根目录下的 {时间戳}_{文件名} 文件（迁移前遗留）"""
+    return [p for p in UPLOAD_DIR.iterdir() if p.is_file() or p.is_symlink()]
 
 
 def cleanup_old_files(days: int = 30) -> dict:
     """
-    清理超过指定天数的文件
+    清理超过指定天数未被使用（且没有被项目引用）的文件
     
     Args:
         days: 保留天数，默认30天
@@ -59,31 +180,44 @@ def cleanup_old_files(days: int = 30) -> dict:
     """
     if not UPLOAD_DIR.exists():
         return {"deleted": 0, "total_size": 0, "errors": []}
-    
+
+    from app.utils.upload_store import upload_store
+
     cutoff_date = datetime.now() - timedelta(days=days)
     deleted_count = 0
     total_size = 0
     errors = []
-    
+
+    # 1) 内容寻址存储：按索引清理没有被项目引用、且超过保留期未被使用的文件，无需遍历目录
     try:
-        for file_path in UPLOAD_DIR.iterdir():
-            if file_path.is_file():
-                try:
-                    # 获取文件创建时间
-                    file_time = datetime.fromtimestamp(file_path.stat().st_ctime)
-                    file_size = file_path.stat().st_size
-                    
-                    if file_time < cutoff_date:
-                        file_path.unlink()  # 删除文件
-                        deleted_count += 1
-                        total_size += file_size
-                        logger.info(f"删除过期文件: {file_path.name}")
-                        
-                except Exception as e:
-                    error_msg = f"删除文件 {file_path.name} 失败: {e}"
-                    errors.append(error_msg)
-                    logger.error(error_msg)
-                    
+        result = upload_store.cleanup_unused_sync(cutoff_date.timestamp())
+        deleted_count += result["deleted"]
+        total_size += result["total_size"]
+        errors.extend(result["errors"])
+    except Exception as e:
+        error_msg = f"清理文件时发生错误: {e}"
+        errors.append(error_msg)
+        logger.error(error_msg)
+
+    # 2) 尚未迁移的旧版平铺文件
+    try:
+        for file_path in _legacy_files():
+            try:
+                # 获取文件创建时间
+                stat = file_path.lstat()
+                file_time = datetime.fromtimestamp(stat.st_ctime)
+
+                if file_time < cutoff_date:
+                    file_path.unlink()  # 删除文件
+                    deleted_count += 1
+                    total_size += stat.st_size
+                    logger.info(f"删除过期文件: {file_path.name}")
+
+            except Exception as e:
+                error_msg = f"删除文件 {file_path.name} 失败: {e}"
+                errors.append(error_msg)
+                logger.error(error_msg)
+
     except Exception as e:
         error_msg = f"清理文件时发生错误: {e}"
         errors.append(error_msg)
@@ -108,30 +242,42 @@ def get_uploads_stats() -> dict:
     """
     if not UPLOAD_DIR.exists():
         return {"total_files": 0, "total_size": 0, "oldest_file": None, "newest_file": None}
-    
+
+    from app.utils.upload_store import upload_store
+
     total_files = 0
     total_size = 0
     oldest_time = None
     newest_time = None
     oldest_file = None
     newest_file = None
-    
+
+    def _consider(name: str, file_time: datetime):
+        nonlocal oldest_time, newest_time, oldest_file, newest_file
+        if oldest_time is None or file_time < oldest_time:
+            oldest_time = file_time
+            oldest_file = name
+        if newest_time is None or file_time > newest_time:
+            newest_time = file_time
+            newest_file = name
+
     try:
-        for file_path in UPLOAD_DIR.iterdir():
-            if file_path.is_file():
-                total_files += 1
-                file_size = file_path.stat().st_size
-                total_size += file_size
-                
-                file_time = datetime.fromtimestamp(file_path.stat().st_ctime)
-                
-                if oldest_time is None or file_time < oldest_time:
-                    oldest_time = file_time
-                    oldest_file = file_path.name
-                    
-                if newest_time is None or file_time > newest_time:
-                    newest_time = file_time
-                    newest_file = file_path.name
+        # 内容寻址存储的统计来自索引
+        stats = upload_store.stats_sync()
+        total_files += stats["total_files"]
+        total_size += stats["total_size"]
+        for entry in (stats["oldest"], stats["newest"]):
+            if entry:
+                _consider(entry[0], datetime.fromtimestamp(entry[1]))
+
+        # 尚未迁移的旧版平铺文件（迁移后留下的符号链接不计入）
+        for file_path in _legacy_files():
+            if file_path.is_symlink():
+                continue
+            stat = file_path.lstat()
+            total_files += 1
+            total_size += stat.st_size
+            _consider(file_path.name, datetime.fromtimestamp(stat.st_ctime))
                     
     except Exception as e:
         logger.error(f"获取uploads统计信息失败: {e}")
@@ -143,4 +289,4 @@ def get_uploads_stats() -> dict:
         "newest_file": newest_file,
         "oldest_time": oldest_time.isoformat() if oldest_time else None,
         "newest_time": newest_time.isoformat() if newest_time else None
-    }
\ No newline at end of file
+    }
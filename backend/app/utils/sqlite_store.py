@@ -0,0 +1,62 @@
+import asyncio
+import sqlite3
+from pathlib import Path
+from typing import Any, Callable, List, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+class SQLiteStore:
+    """
+    本地 SQLite 小型存储，用于在同一台机器的多个 worker 之间共享少量键值数据。
+    - 使用 WAL 模式，允许并发读、串行写
+    - 所有数据库操作都放到线程池执行，不阻塞事件循环
+    """
+
+    def __init__(self, db_path: Path, schema: str):
+        self.db_path = Path(db_path)
+        self.schema = schema
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), timeout=10)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.schema)
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def execute_sync(self, sql: str, params: Sequence[Any] = ()) -> List[tuple]:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+            conn.commit()
+            return rows
+        finally:
+            conn.close()
+
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> List[tuple]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.execute_sync, sql, params)
+
+    def run_sync(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """在一个写事务（BEGIN IMMEDIATE）中执行 fn(conn)，多个 worker 之间串行"""
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn)
+            except Exception:
+                conn.rollback()
+                raise
+            conn.commit()
+            return result
+        finally:
+            conn.close()
+
+    async def run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.run_sync, fn)
@@ -0,0 +1,85 @@
+import asyncio
+from typing import AsyncIterator, Optional
+
+from fastapi import Request
+
+from app.core.metrics import metrics
+
+# 兼容原有消费方式的结束帧
+DONE_FRAME = "data: [DONE]\n\n"
+
+
+def encode_sse(data: str, event: Optional[str] = None) -> str:
+    """按 SSE 规范编码一帧：多行数据拆成多个 data 行，内容中的空白原样保留"""
+    if "\n" in data:
+        body = "".join(f"data: {line}\n" for line in data.split("\n"))
+    else:
+        body = f"data: {data}\n"
+    if event:
+        return f"event: {event}\n{body}\n"
+    return f"{body}\n"
+
+
+_END = object()
+_DISCONNECTED = object()
+
+
+async def close_on_disconnect(
+    request: Request,
+    frames: AsyncIterator[str],
+    poll_interval: float = 0.5,
+) -> AsyncIterator[str]:
+    """
+    转发 SSE 帧，同时在后台检测客户端是否已断开。
+    断开后立即关闭 frames，关闭会逐层传递到上游（Coze 对话流随之取消），
+    即使上游长时间没有输出（如分析阶段）也能及时停止。
+    """
+    # 有界队列：客户端接收变慢时上游随之暂停，不会在无人消费时跑完
+    queue: asyncio.Queue = asyncio.Queue(maxsize=16)
+
+    async def pump() -> None:
+        try:
+            async for frame in frames:
+                await queue.put(frame)
+            await queue.put(_END)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(e)
+
+    async def watch() -> None:
+        while not await request.is_disconnected():
+            await asyncio.sleep(poll_interval)
+        # 队列可能已满，清空后再放入断开标记
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(_DISCONNECTED)
+
+    pump_task = asyncio.create_task(pump())
+    watch_task = asyncio.create_task(watch())
+    try:
+        while True:
+            item = await queue.get()
+            if item is _END:
+                break
+            if item is _DISCONNECTED:
+                metrics.incr("sse.client_disconnected")
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        watch_task.cancel()
+        if not pump_task.done():
+            pump_task.cancel()
+            try:
+                await pump_task
+            except (asyncio.CancelledError, Exception):
+                pass
+        # pump 可能尚未开始迭代，确保 frames 被关闭
+        aclose = getattr(frames, "aclose", None)
+        if aclose is not None:
+            try:
+                await aclose()
+            except Exception:
+                pass
@@ -0,0 +1,255 @@
+import asyncio
+import os
+import sqlite3
+import time
+import re
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+from fastapi import UploadFile
+
+from app.core.config import settings
+from app.core.logger import get_logger
+from app.utils.file_utils import UPLOAD_DIR, ingest_upload, write_bytes_chunked
+from app.utils.sqlite_store import SQLiteStore
+
+logger = get_logger(service="upload_store")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload_blobs (
+    digest TEXT PRIMARY KEY,
+    ext TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    refcount INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_upload_blobs_last_used ON upload_blobs (last_used_at);
+"""
+
+_URL_PATTERN = re.compile(r"^/uploads/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.\w+$")
+
+
+@dataclass
+class StoredUpload:
+    """内容寻址存储中的一个文件"""
+    digest: str
+    ext: str
+    size: int
+    path: Path
+    relative_path: str
+
+    @property
+    def url(self) -> str:
+        return f"/uploads/{self.relative_path}"
+
+
+class UploadStore:
+    """
+    内容寻址的上传文件存储：
+    - 文件按 SHA-256 保存为 uploads/ab/cd/<sha256>.<ext>，相同内容只保存一份
+    - 索引（大小、引用计数、最近使用时间）保存在本地 SQLite，统计和清理无需遍历目录
+    - 引用计数只统计长期引用（项目的 image_url）；临时使用（分析、生成任务的输入）不计入，
+      清理时只删除引用计数为 0 且超过保留期未被使用的文件
+    - 访问 URL 仍为 /uploads/...，与原有静态资源挂载兼容
+    """
+
+    def __init__(self, root: Path, index_db: Path, incoming_dir: Path):
+        self.root = root
+        # 暂存目录不能位于 uploads 下（会被静态资源挂载暴露），且需与 uploads 在同一文件系统以便原子重命名
+        self.incoming_dir = incoming_dir
+        self._index = SQLiteStore(index_db, _SCHEMA)
+
+    @staticmethod
+    def relative_path(digest: str, ext: str) -> str:
+        return f"{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+
+    def path_for(self, digest: str, ext: str) -> Path:
+        return self.root / self.relative_path(digest, ext)
+
+    @staticmethod
+    def digest_of_url(url: Optional[str]) -> Optional[str]:
+        """从 /uploads/ab/cd/<sha256>.<ext> 中取出摘要；旧版平铺 URL 或外部 URL 返回 None"""
+        match = _URL_PATTERN.match(url or "")
+        return match.group(1) if match else None
+
+    def _stored(self, digest: str, ext: str, size: int) -> StoredUpload:
+        return StoredUpload(
+            digest=digest,
+            ext=ext,
+            size=size,
+            path=self.path_for(digest, ext),
+            relative_path=self.relative_path(digest, ext),
+        )
+
+    def _incoming_path(self) -> Path:
+        self.incoming_dir.mkdir(parents=True, exist_ok=True)
+        return self.incoming_dir / uuid.uuid4().hex
+
+    def commit_sync(
+        self,
+        digest: str,
+        ext: str,
+        size: int,
+        source: Optional[Path] = None,
+        data: Optional[bytes] = None,
+        retain: bool = False,
+    ) -> StoredUpload:
+        """
+        在索引事务中登记文件并刷新最近使用时间：文件不存在时把 source（或 data）放到目标位置，已存在时丢弃 source。
+        retain 为真时同时增加一次引用。与清理在同一把写锁下执行，避免并发删除与登记交错。
+        """
+        final_path = self.path_for(digest, ext)
+
+        def _commit(conn: sqlite3.Connection) -> None:
+            if not final_path.exists():
+                final_path.parent.mkdir(parents=True, exist_ok=True)
+                if source is not None:
+                    os.replace(source, final_path)
+                elif data is not None:
+                    tmp_path = final_path.with_name(final_path.name + ".part")
+                    tmp_path.write_bytes(data)
+                    os.replace(tmp_path, final_path)
+                else:
+                    raise FileNotFoundError(f"Blob {digest} is missing and no content was provided")
+            elif source is not None:
+                source.unlink(missing_ok=True)
+            now = time.time()
+            conn.execute(
+                """
+                INSERT INTO upload_blobs (digest, ext, size, refcount, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(digest) DO UPDATE SET
+                    refcount = refcount + excluded.refcount,
+                    last_used_at = excluded.last_used_at
+                """,
+                (digest, ext, size, 1 if retain else 0, now, now),
+            )
+
+        self._index.run_sync(_commit)
+        return self._stored(digest, ext, size)
+
+    async def put_upload(self, file: UploadFile) -> StoredUpload:
+        """流式接收上传文件并存入内容寻址存储"""
+        incoming = self._incoming_path()
+        try:
+            ingested = await ingest_upload(file, save_path=incoming)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, lambda: self.commit_sync(ingested.digest, ingested.ext, ingested.size, source=incoming)
+            )
+        finally:
+            if incoming.exists():
+                incoming.unlink(missing_ok=True)
+
+    async def put_bytes(self, data: bytes, digest: str, ext: str) -> StoredUpload:
+        """保存已在内存中的内容；相同内容已存在时只刷新最近使用时间，不重复写盘"""
+        incoming = None
+        if not self.path_for(digest, ext).exists():
+            incoming = self._incoming_path()
+            await write_bytes_chunked(incoming, data)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                None, lambda: self.commit_sync(digest, ext, len(data), source=incoming, data=data)
+            )
+        finally:
+            if incoming is not None and incoming.exists():
+                incoming.unlink(missing_ok=True)
+
+    def _adjust_sync(self, digest: str, delta: int) -> bool:
+        """调整引用计数（不低于 0）并刷新最近使用时间；文件未登记时返回 False"""
+        changed = self._index.run_sync(
+            lambda conn: conn.execute(
+                "UPDATE upload_blobs SET refcount = MAX(refcount + ?, 0), last_used_at = ? WHERE digest = ?",
+                (delta, time.time(), digest),
+            ).rowcount
+        )
+        return changed > 0
+
+    def retain_sync(self, digest: str) -> bool:
+        """增加一次长期引用"""
+        return self._adjust_sync(digest, 1)
+
+    def release_sync(self, digest: str) -> bool:
+        """
+        减少一次长期引用。引用归零时不立即删除文件：同一内容可能刚被重新上传、即将被引用，
+        由 cleanup_unused_sync 在保留期过后删除
+        """
+        return self._adjust_sync(digest, -1)
+
+    async def retain_url(self, url: Optional[str]) -> bool:
+        digest = self.digest_of_url(url)
+        if digest is None:
+            return False
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.retain_sync, digest)
+
+    async def release_url(self, url: Optional[str]) -> bool:
+        digest = self.digest_of_url(url)
+        if digest is None:
+            return False
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.release_sync, digest)
+
+    def set_refcounts_sync(self, counts: Dict[str, int]) -> int:
+        """按实际引用重建引用计数（未出现在 counts 中的文件归零），返回被修改的行数"""
+
+        def _set(conn: sqlite3.Connection) -> int:
+            changed = conn.execute("UPDATE upload_blobs SET refcount = 0 WHERE refcount != 0").rowcount
+            for digest, count in counts.items():
+                changed += conn.execute(
+                    "UPDATE upload_blobs SET refcount = ? WHERE digest = ?", (count, digest)
+                ).rowcount
+            return changed
+
+        return self._index.run_sync(_set)
+
+    def cleanup_unused_sync(self, cutoff: float) -> dict:
+        """删除没有长期引用、且最近使用时间早于 cutoff（时间戳）的文件"""
+        errors = []
+
+        def _cleanup(conn: sqlite3.Connection) -> dict:
+            rows = conn.execute(
+                "SELECT digest, ext, size FROM upload_blobs WHERE refcount <= 0 AND last_used_at < ?",
+                (cutoff,),
+            ).fetchall()
+            deleted = 0
+            total_size = 0
+            for digest, ext, size in rows:
+                try:
+                    self.path_for(digest, ext).unlink(missing_ok=True)
+                except Exception as e:
+                    errors.append(f"删除文件 {digest}.{ext} 失败: {e}")
+                    continue
+                conn.execute("DELETE FROM upload_blobs WHERE digest = ? AND refcount <= 0", (digest,))
+                deleted += 1
+                total_size += size
+            return {"deleted": deleted, "total_size": total_size}
+
+        result = self._index.run_sync(_cleanup)
+        result["errors"] = errors
+        return result
+
+    def stats_sync(self) -> dict:
+        """基于索引的统计信息，时间为创建时间"""
+        count, total_size = self._index.execute_sync(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM upload_blobs"
+        )[0]
+        oldest = self._index.execute_sync(
+            "SELECT digest, ext, created_at FROM upload_blobs ORDER BY created_at ASC LIMIT 1"
+        )
+        newest = self._index.execute_sync(
+            "SELECT digest, ext, created_at FROM upload_blobs ORDER BY created_at DESC LIMIT 1"
+        )
+        return {
+            "total_files": count,
+            "total_size": total_size,
+            "oldest": (self.relative_path(oldest[0][0], oldest[0][1]), oldest[0][2]) if oldest else None,
+            "newest": (self.relative_path(newest[0][0], newest[0][1]), newest[0][2]) if newest else None,
+        }
+
+
+upload_store = UploadStore(UPLOAD_DIR, Path(settings.UPLOAD_INDEX_DB), Path(settings.UPLOAD_INCOMING_DIR))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+登录高峰时的事件循环延迟基准（不需要数据库）
+模拟并发登录的密码校验，同时用一个每 10ms 唤醒一次的探针测量事件循环被阻塞的时间（SSE 推送等都会被同样延迟）：
+- sync：原实现，在协程中直接调用 bcrypt.checkpw
+- async：verify_password_async，在有界的 bcrypt 线程池中执行
+"""
+import sys
+import asyncio
+import statistics
+import time
+from pathlib import Path
+
+# 添加项目根目录到 PYTHONPATH
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(str(ROOT_DIR))
+
+from app.core.hashing import get_password_hash, verify_password, verify_password_async, password_hasher
+from app.core.logger import get_logger
+
+logger = get_logger(service="bench_login_event_loop_lag")
+
+PROBE_INTERVAL = 0.01
+
+
+async def _probe(lags: list, stop: asyncio.Event) -> None:
+    """记录每次唤醒比预期晚了多久"""
+    while not stop.is_set():
+        expected = time.perf_counter() + PROBE_INTERVAL
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(max(0.0, time.perf_counter() - expected))
+
+
+async def _sync_login(password: str, hashed: str) -> bool:
+    return verify_password(password, hashed)
+
+
+async def _async_login(password: str, hashed: str) -> bool:
+    return await verify_password_async(password, hashed)
+
+
+async def _run(name: str, logins: int, login) -> None:
+    hashed = get_password_hash("bench-password")
+    lags: list = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_probe(lags, stop))
+    await asyncio.sleep(PROBE_INTERVAL * 5)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(login("bench-password", hashed) for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await probe
+    assert all(results)
+    lags_ms = sorted(lag * 1000 for lag in lags)
+    p99 = lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))]
+    logger.info(
+        f"{name:<6} {logins} 次登录耗时 {elapsed:6.2f}s  事件循环延迟 "
+        f"p50 {statistics.median(lags_ms):7.1f}ms  p99 {p99:7.1f}ms  最大 {lags_ms[-1]:7.1f}ms"
+    )
+
+
+async def bench(logins: int) -> None:
+    await _run("sync", logins, _sync_login)
+    await _run("async", logins, _async_login)
+    password_hasher.shutdown()
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="对比同步与线程池 bcrypt 校验对事件循环延迟的影响")
+    parser.add_argument("--logins", type=int, default=32, help="并发登录次数，默认 32（不超过 PASSWORD_HASH_MAX_PENDING）")
+
+    args = parser.parse_args()
+
+    logger.info("=" * 50)
+    logger.info("登录高峰事件循环延迟基准")
+    logger.info("=" * 50)
+
+    asyncio.run(bench(args.logins))
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
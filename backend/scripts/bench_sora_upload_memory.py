@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Sora 图片上传内存基准
+对比上传方式单次请求的峰值内存（tracemalloc，只统计主进程）：
+- base64：读入整张图片，编码后内嵌在 JSON 中发送
+- multipart：从上传的临时文件流式发送（不做规范化）
+- normalize+multipart：默认路径，规范化在子进程中按文件处理（缓存未命中），再从结果文件流式发送；
+  需要 Pillow，使用真实的噪点 JPEG（难以压缩，缩放后仍较大）
+上游使用本地 transport 模拟，只逐块读取请求体，不会发出真实请求。
+"""
+import sys
+import asyncio
+import gc
+import hashlib
+import os
+import tempfile
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# 添加项目根目录到 PYTHONPATH
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(str(ROOT_DIR))
+
+from app.core.logger import get_logger
+from app.services.image_normalizer import PROFILES, ImageNormalizer
+from app.services.sora_service import SoraService
+
+logger = get_logger(service="bench_sora_upload_memory")
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
+
+@dataclass
+class SpooledUpload:
+    """模拟 FastAPI UploadFile：内容保存在临时文件中"""
+    filename: str
+    file: Any
+    content_type: str = "image/png"
+
+
+class DrainTransport(httpx.AsyncBaseTransport):
+    """模拟上游：逐块读取并丢弃请求体（httpx.MockTransport 会先把整个请求体读入内存，不适合测量）"""
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        received = 0
+        async for chunk in request.stream:
+            received += len(chunk)
+        return httpx.Response(200, json={"id": "bench", "received": received, "data": []})
+
+
+def _make_upload(size: int) -> SpooledUpload:
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    spooled.write(PNG_HEADER)
+    remaining = size - len(PNG_HEADER)
+    while remaining > 0:
+        chunk = os.urandom(min(remaining, 1024 * 1024))
+        spooled.write(chunk)
+        remaining -= len(chunk)
+    spooled.seek(0)
+    return SpooledUpload(filename="bench.png", file=spooled)
+
+
+async def _run_once(service: SoraService, upload: SpooledUpload, mode: str) -> int:
+    upload.file.seek(0)
+    # 只统计本次请求新增的内存，扣除之前遗留（尚未回收）的部分
+    gc.collect()
+    baseline = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    if mode == "base64":
+        # 与接口中 base64 模式一致：先把图片整体读入内存
+        image_file: Any = upload.file.read()
+    else:
+        image_file = upload
+    await service.generate_image_from_image(
+        prompt="bench",
+        image_file=image_file,
+        is_async=True,
+        upload_mode=mode,
+    )
+    del image_file
+    return tracemalloc.get_traced_memory()[1] - baseline
+
+
+def _make_jpeg(path: Path, edge: int) -> int:
+    """生成 edge x edge*3/4 的噪点 JPEG，返回文件大小"""
+    Image.effect_noise((edge, edge * 3 // 4), 64).convert("RGB").save(path, format="JPEG", quality=95)
+    return path.stat().st_size
+
+
+async def _run_normalized(service: SoraService, source: Path, digest: str, work_dir: Path, run: int) -> int:
+    # 每次使用新的缓存目录，测量缓存未命中（需要规范化）的情况
+    normalizer = ImageNormalizer(PROFILES, work_dir / f"cache-{run}", workers=1)
+    try:
+        # 先启动进程池，子进程的导入开销不计入本次请求
+        await asyncio.get_running_loop().run_in_executor(normalizer._get_pool(), abs, 0)
+        gc.collect()
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        # 与接口一致：摘要在接收上传时已算出
+        image = await normalizer.normalize_path(source, "sora", digest=digest)
+        await service.generate_image_from_image(
+            prompt="bench",
+            image_file=str(image.path),
+            is_async=True,
+            upload_mode="multipart",
+        )
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        normalizer.shutdown()
+
+
+async def bench_normalized(service: SoraService, edge: int, runs: int) -> None:
+    if Image is None:
+        logger.warning("Pillow 未安装，跳过 normalize+multipart")
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = Path(tmp)
+        source = work_dir / "bench.jpg"
+        size = _make_jpeg(source, edge)
+        digest = hashlib.sha256(source.read_bytes()).hexdigest()
+        peaks = []
+        for run in range(runs):
+            peaks.append(await _run_normalized(service, source, digest, work_dir, run))
+        peak = max(peaks)
+        logger.info(
+            f"normalize+multipart 峰值内存: {peak / 1024 / 1024:.2f} MB "
+            f"({peak / size:.2f}x 图片大小 {size / 1024 / 1024:.2f} MB)"
+        )
+
+
+async def bench(size_mb: int, runs: int, edge: int) -> None:
+    client = httpx.AsyncClient(transport=DrainTransport())
+    service = SoraService(client)
+    service.api_base_url = "http://sora.bench"
+    upload = _make_upload(size_mb * 1024 * 1024)
+
+    tracemalloc.start()
+    try:
+        for mode in ("base64", "multipart"):
+            peaks = [await _run_once(service, upload, mode) for _ in range(runs)]
+            peak = max(peaks)
+            logger.info(
+                f"{mode:<9} 峰值内存: {peak / 1024 / 1024:.2f} MB "
+                f"({peak / (size_mb * 1024 * 1024):.2f}x 图片大小)"
+            )
+        await bench_normalized(service, edge, runs)
+    finally:
+        tracemalloc.stop()
+        upload.file.close()
+        await client.aclose()
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="对比 Sora 图片上传方式的峰值内存")
+    parser.add_argument("--size-mb", type=int, default=8, help="模拟图片大小（MB），默认 8")
+    parser.add_argument("--runs", type=int, default=3, help="每种方式运行次数，默认 3")
+    parser.add_argument("--edge", type=int, default=4000, help="normalize+multipart 使用的噪点 JPEG 宽度（像素），默认 4000")
+
+    args = parser.parse_args()
+
+    logger.info("=" * 50)
+    logger.info("Sora 上传内存基准")
+    logger.info("=" * 50)
+
+    asyncio.run(bench(args.size_mb, args.runs, args.edge))
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
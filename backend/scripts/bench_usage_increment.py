@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+使用次数记账基准（需要可连接的 MySQL，使用 .env 中的 DATABASE_URL）
+同一用户在高并发下记账，对比三种方式的吞吐量与最终计数是否正确：
+- legacy：原 /usage/increment 实现（插入任务并提交，再 SELECT 计数、Python 中加一、再次提交）
+- atomic：UsageService.record_task（INSERT IGNORE + ON DUPLICATE KEY UPDATE，单个事务）
+- batch：UsageService.record_tasks，按批次记账
+运行时创建临时用户，结束后删除该用户及其记录。
+"""
+import sys
+import asyncio
+import time
+import uuid
+from pathlib import Path
+
+from sqlalchemy import delete, insert, select
+
+# 添加项目根目录到 PYTHONPATH
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(str(ROOT_DIR))
+
+from app.core.database import AsyncSessionLocal, ensure_database_and_tables
+from app.core.logger import get_logger
+from app.models.usage import UsageCounter, UsageTask
+from app.models.user import User
+from app.services.usage_service import UsageService
+
+logger = get_logger(service="bench_usage_increment")
+
+
+async def _legacy_increment(user_id: int, task_id: str) -> None:
+    """原接口的记账流程（保留用于对比）"""
+    async with AsyncSessionLocal() as db:
+        try:
+            await db.execute(insert(UsageTask).values(user_id=user_id, task_id=task_id, service_type="bench"))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            return
+        result = await db.execute(select(UsageCounter).where(UsageCounter.user_id == user_id))
+        row = result.scalar_one_or_none()
+        if not row:
+            try:
+                await db.execute(insert(UsageCounter).values(user_id=user_id, used_count=1))
+                await db.commit()
+            except Exception:
+                # 并发首次插入冲突，这次计数丢失
+                await db.rollback()
+        else:
+            row.used_count = int(row.used_count or 0) + 1
+            await db.commit()
+
+
+async def _atomic_increment(user_id: int, task_id: str) -> None:
+    async with AsyncSessionLocal() as db:
+        await UsageService(db).record_task(user_id, task_id, "bench")
+
+
+async def _reset(user_id: int) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(UsageTask).where(UsageTask.user_id == user_id))
+        await db.execute(delete(UsageCounter).where(UsageCounter.user_id == user_id))
+        await db.commit()
+
+
+async def _used_count(user_id: int) -> int:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(UsageCounter.used_count).where(UsageCounter.user_id == user_id))
+        return int(result.scalar_one_or_none() or 0)
+
+
+async def _run(name: str, user_id: int, total: int, concurrency: int, increment) -> None:
+    await _reset(user_id)
+    task_ids = [f"bench-{uuid.uuid4().hex}" for _ in range(total)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(task_id: str) -> None:
+        async with semaphore:
+            await increment(user_id, task_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(task_id) for task_id in task_ids))
+    elapsed = time.perf_counter() - started
+    used = await _used_count(user_id)
+    logger.info(
+        f"{name:<7} {total / elapsed:8.1f} 次/秒  计数 {used}/{total}"
+        f"{'' if used == total else f'  丢失 {total - used}'}"
+    )
+
+
+async def _run_batch(user_id: int, total: int, batch_size: int) -> None:
+    await _reset(user_id)
+    task_ids = [f"bench-{uuid.uuid4().hex}" for _ in range(total)]
+    started = time.perf_counter()
+    for i in range(0, total, batch_size):
+        async with AsyncSessionLocal() as db:
+            await UsageService(db).record_tasks(user_id, [(task_id, "bench") for task_id in task_ids[i:i + batch_size]])
+    elapsed = time.perf_counter() - started
+    used = await _used_count(user_id)
+    logger.info(f"{'batch':<7} {total / elapsed:8.1f} 次/秒  计数 {used}/{total}（每批 {batch_size}）")
+
+
+async def bench(total: int, concurrency: int, batch_size: int) -> None:
+    await ensure_database_and_tables()
+    async with AsyncSessionLocal() as db:
+        user = User(username=f"bench_{uuid.uuid4().hex[:12]}", password_hash="-", status="inactive")
+        db.add(user)
+        await db.commit()
+        user_id = user.id
+
+    try:
+        await _run("legacy", user_id, total, concurrency, _legacy_increment)
+        await _run("atomic", user_id, total, concurrency, _atomic_increment)
+        await _run_batch(user_id, total, batch_size)
+    finally:
+        await _reset(user_id)
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(User).where(User.id == user_id))
+            await db.commit()
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="对比使用次数记账方式的吞吐量与正确性")
+    parser.add_argument("--total", type=int, default=2000, help="记账次数，默认 2000")
+    parser.add_argument("--concurrency", type=int, default=50, help="并发数，默认 50")
+    parser.add_argument("--batch-size", type=int, default=200, help="批量记账每批任务数，默认 200")
+
+    args = parser.parse_args()
+
+    logger.info("=" * 50)
+    logger.info("使用次数记账基准")
+    logger.info("=" * 50)
+
+    asyncio.run(bench(args.total, args.concurrency, args.batch_size))
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
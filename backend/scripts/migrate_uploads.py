@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+上传文件迁移脚本
+把 uploads 根目录下旧版的 {时间戳}_{文件名} 平铺文件迁移到内容寻址存储（uploads/ab/cd/<sha256>.<ext>），
+并把 projects.image_url 中引用的旧 URL 更新为新 URL。
+默认在原位置保留指向新文件的符号链接，保证外部仍在使用的旧 URL 可以访问。
+最后按 projects.image_url 重建索引中的引用计数（可重复执行，已迁移过的部署也应执行一次）。
+"""
+import sys
+import asyncio
+import hashlib
+import os
+from pathlib import Path
+
+# 添加项目根目录到 PYTHONPATH
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(str(ROOT_DIR))
+
+from sqlalchemy import text
+
+from app.core.logger import get_logger
+from app.utils.file_utils import UPLOAD_DIR, detect_image_type
+from app.utils.upload_store import upload_store
+
+logger = get_logger(service="migrate_uploads")
+
+
+def _legacy_files():
+    return sorted(p for p in UPLOAD_DIR.iterdir() if p.is_file() and not p.is_symlink())
+
+
+def _guess_ext(path: Path, head: bytes) -> str:
+    ext = detect_image_type(head)
+    if ext:
+        return ext
+    suffix = path.suffix.lower().lstrip(".")
+    return "jpg" if suffix == "jpeg" else (suffix or "bin")
+
+
+def migrate_files(dry_run: bool, keep_links: bool) -> dict:
+    """迁移文件，返回 {旧 URL: 新 URL}"""
+    url_map = {}
+    for path in _legacy_files():
+        data = path.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        ext = _guess_ext(path, data[:16])
+        old_url = f"/uploads/{path.name}"
+        new_url = f"/uploads/{upload_store.relative_path(digest, ext)}"
+        url_map[old_url] = new_url
+
+        if dry_run:
+            logger.info(f"[dry-run] {path.name} -> {new_url}")
+            continue
+
+        stored = upload_store.commit_sync(digest, ext, len(data), source=path)
+        if keep_links:
+            # 旧位置保留相对符号链接，仍在 /uploads 目录之内，静态资源挂载可以正常访问
+            os.symlink(os.path.relpath(stored.path, path.parent), path)
+        logger.info(f"{path.name} -> {new_url}")
+    return url_map
+
+
+async def update_project_urls(url_map: dict, dry_run: bool) -> int:
+    from app.core.database import engine
+
+    updated = 0
+    async with engine.begin() as conn:
+        for old_url, new_url in url_map.items():
+            if dry_run:
+                result = await conn.execute(
+                    text("SELECT COUNT(*) FROM projects WHERE image_url = :old"), {"old": old_url}
+                )
+                updated += int(result.scalar_one())
+                continue
+            result = await conn.execute(
+                text("UPDATE projects SET image_url = :new WHERE image_url = :old"),
+                {"old": old_url, "new": new_url},
+            )
+            updated += result.rowcount or 0
+    await engine.dispose()
+    return updated
+
+
+async def recount_references(dry_run: bool) -> int:
+    """按项目实际引用的图片重建引用计数，返回被引用的文件数"""
+    from app.core.database import engine
+
+    counts = {}
+    async with engine.connect() as conn:
+        result = await conn.execute(
+            text("SELECT image_url, COUNT(*) FROM projects WHERE image_url IS NOT NULL GROUP BY image_url")
+        )
+        for image_url, count in result.all():
+            digest = upload_store.digest_of_url(image_url)
+            if digest is not None:
+                counts[digest] = counts.get(digest, 0) + int(count)
+    await engine.dispose()
+
+    if not dry_run:
+        upload_store.set_refcounts_sync(counts)
+    return len(counts)
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="把旧版平铺的上传文件迁移到内容寻址存储")
+    parser.add_argument("--dry-run", action="store_true", help="模拟运行，只打印迁移计划")
+    parser.add_argument("--no-links", action="store_true", help="不在原位置保留符号链接")
+    parser.add_argument("--skip-db", action="store_true", help="不更新 projects.image_url，也不重建引用计数")
+
+    args = parser.parse_args()
+
+    logger.info("=" * 50)
+    logger.info("上传文件迁移工具")
+    logger.info("=" * 50)
+
+    url_map = migrate_files(dry_run=args.dry_run, keep_links=not args.no_links)
+    logger.info(f"{'待迁移' if args.dry_run else '已迁移'}文件数: {len(url_map)}")
+
+    if url_map and not args.skip_db:
+        updated = asyncio.run(update_project_urls(url_map, dry_run=args.dry_run))
+        logger.info(f"{'待更新' if args.dry_run else '已更新'}项目数: {updated}")
+
+    if not args.skip_db:
+        referenced = asyncio.run(recount_references(dry_run=args.dry_run))
+        logger.info(f"被项目引用的文件数: {referenced}")
+
+    logger.info("迁移完成！")
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
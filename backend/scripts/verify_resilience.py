@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+上游调用保护验证（不访问真实上游）
+本地模拟一个只能承受固定并发的上游（超过时返回 429，负载越高延迟越大），以远高于其容量的并发持续调用。
+与服务中的用法一致：请求在 TierScheduler 中排队，其容量跟随调用保护的自适应并发上限：
+1. 自适应并发上限应收敛到上游容量附近，429 比例随之下降
+2. 上游进入故障期（全部返回 503）后熔断器打开，直接拒绝请求而不再打到上游
+3. 故障结束后熔断器经半开试探恢复关闭，并发上限重新增长
+"""
+import sys
+import asyncio
+import time
+from pathlib import Path
+
+import httpx
+
+# 添加项目根目录到 PYTHONPATH
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(str(ROOT_DIR))
+
+from app.core.logger import get_logger
+from app.services.resilience import AIMDLimiter, CircuitBreaker, UpstreamGuard, UpstreamUnavailableError
+from app.services.tier_scheduler import TierScheduler
+
+logger = get_logger(service="verify_resilience")
+
+
+class FakeUpstream:
+    """模拟上游：并发超过 capacity 时返回 429；failing 为真时全部返回 503"""
+
+    def __init__(self, capacity: int, latency: float):
+        self.capacity = capacity
+        self.latency = latency
+        self.failing = False
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.failing:
+            await asyncio.sleep(self.latency)
+            return httpx.Response(503)
+        if self.in_flight >= self.capacity:
+            self.throttled += 1
+            return httpx.Response(429)
+        self.in_flight += 1
+        try:
+            # 接近容量时变慢
+            await asyncio.sleep(self.latency * (1 + self.in_flight / self.capacity))
+            return httpx.Response(200, json={"ok": True})
+        finally:
+            self.in_flight -= 1
+
+
+async def verify(capacity: int, clients: int, phase_seconds: float) -> None:
+    upstream = FakeUpstream(capacity, latency=0.05)
+    guard = UpstreamGuard(
+        "fake",
+        AIMDLimiter("fake", initial=64, min_limit=1, max_limit=64, backoff=0.5, latency_threshold=1.0, queue_timeout=5.0),
+        CircuitBreaker("fake", failure_threshold=5, recovery_seconds=1.0),
+        retry_attempts=3,
+        retry_base=0.05,
+        retry_max=0.5,
+    )
+    scheduler = TierScheduler("fake", 64, {"anonymous": 1}, limiter=guard.limiter)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(upstream.handle), base_url="http://upstream")
+    stats = {"ok": 0, "failed": 0, "rejected": 0}
+    stop = asyncio.Event()
+
+    async def request() -> httpx.Response:
+        response = await client.get("/work")
+        response.raise_for_status()
+        return response
+
+    async def worker() -> None:
+        while not stop.is_set():
+            try:
+                async with scheduler.slot(None):
+                    await guard.call(request)
+                stats["ok"] += 1
+            except UpstreamUnavailableError:
+                stats["rejected"] += 1
+                await asyncio.sleep(0.05)
+            except httpx.HTTPStatusError:
+                stats["failed"] += 1
+
+    def report(phase: str) -> None:
+        logger.info(
+            f"{phase:<6} limit={guard.limiter.limit:5.1f} in_use={scheduler.stats()['in_use']:3d} "
+            f"circuit={guard.breaker.state:<9} upstream_requests={upstream.requests:5d} "
+            f"429={upstream.throttled:4d} ok={stats['ok']:5d} failed={stats['failed']:4d} rejected={stats['rejected']:5d}"
+        )
+
+    async def observe(phase: str) -> None:
+        deadline = time.monotonic() + phase_seconds
+        while time.monotonic() < deadline:
+            await asyncio.sleep(phase_seconds / 4)
+            report(phase)
+
+    workers = [asyncio.create_task(worker()) for _ in range(clients)]
+    try:
+        await observe("normal")
+        upstream.failing = True
+        await observe("outage")
+        upstream.failing = False
+        await observe("recover")
+    finally:
+        stop.set()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await client.aclose()
+
+    logger.info(f"上游容量 {capacity}，最终并发上限 {guard.limiter.limit:.1f}，熔断器状态 {guard.breaker.state}")
+
+
+def main():
+    """主函数"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="用模拟上游验证自适应并发、熔断与重试")
+    parser.add_argument("--capacity", type=int, default=8, help="模拟上游的并发容量，默认 8")
+    parser.add_argument("--clients", type=int, default=64, help="并发调用方数量，默认 64")
+    parser.add_argument("--phase-seconds", type=float, default=4.0, help="每个阶段的时长（秒），默认 4")
+
+    args = parser.parse_args()
+
+    logger.info("=" * 50)
+    logger.info("上游调用保护验证")
+    logger.info("=" * 50)
+
+    asyncio.run(verify(args.capacity, args.clients, args.phase_seconds))
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
@@ -196,7 +196,7 @@ function App() {
                 setSoraResult(finalResult); 
                 setIsSoraGenerating(false);
                 try { 
-                    await incrementServerUsage({ taskId: submitResult.task_id, serviceType: 'sora' });
+                    await incrementServerUsage({ taskId: submitResult.usage_task_id || submitResult.task_id, serviceType: 'sora' });
                     await refreshUsage(); // 等待更新完成后再刷新
                 } catch (err) {
                     console.error('Failed to update usage:', err);
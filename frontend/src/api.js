@@ -5,6 +5,12 @@ async function safeText(resp) {
   try { return await resp.text(); } catch { return ''; }
 }
 
+// 生成接口由服务端检查额度，需要携带登录 token
+function authHeaders() {
+  const token = localStorage.getItem('formu_token');
+  return token ? { 'Authorization': `Bearer ${token}` } : {};
+}
+
 function parseSSE(block) {
   const lines = block.split(/\r?\n/);
   let event;
@@ -13,7 +19,8 @@ function parseSSE(block) {
     if (line.startsWith('event:')) {
       event = line.slice(6).trim();
     } else if (line.startsWith('data:')) {
-      dataParts.push(line.slice(5).trim());
+      // SSE 规范只去掉冒号后的一个空格，增量中的空白需要原样保留
+      dataParts.push(line.slice(5).replace(/^ /, ''));
     }
   }
   return { event, data: dataParts.join('\n') };
@@ -34,6 +41,27 @@ export async function uploadImage(file) {
   return resp.json();
 }
 
+// --- Generation Jobs ---
+// 生成接口默认把任务放入服务端队列并立即返回 job_id，等待任务完成后取得上游 task_id
+export async function waitForJob(jobId, { pollInterval = 2000, maxAttempts = 300 } = {}) {
+  for (let attempt = 0; attempt < maxAttempts; attempt++) {
+    const resp = await fetch(`${API_BASE}/api/jobs/${jobId}`, { headers: authHeaders() });
+    const job = await resp.json().catch(() => ({}));
+    if (!resp.ok) {
+      throw new Error(`任务查询失败: ${resp.status} ${job.detail || ''}`);
+    }
+    if (job.status === 'succeeded') return job.result || {};
+    if (job.status === 'failed') throw new Error(job.error || '任务失败');
+    await new Promise((resolve) => setTimeout(resolve, pollInterval));
+  }
+  throw new Error('任务排队超时');
+}
+
+// 提交接口的响应：排队时等待任务完成，同步模式（服务端关闭队列）时直接返回
+async function resolveSubmitted(data) {
+  return data.job_id ? waitForJob(data.job_id) : data;
+}
+
 // --- Prompt Generation (from File & URL) ---
 export async function streamPrompt({ file, style, onAnalysis, onPrompt, onDone }) {
   const form = new FormData();
@@ -41,6 +69,7 @@ export async function streamPrompt({ file, style, onAnalysis, onPrompt, onDone }
 
   const resp = await fetch(`${API_BASE}/prompt-generation?style=${encodeURIComponent(style)}`, {
     method: 'POST',
+    headers: authHeaders(),
     body: form,
   });
   if (!resp.ok || !resp.body) {
@@ -80,7 +109,7 @@ export async function streamPrompt({ file, style, onAnalysis, onPrompt, onDone }
 export async function streamPromptFromUrl({ imageUrl, style, onAnalysis, onPrompt, onDone }) {
   const resp = await fetch(`${API_BASE}/prompt-generation-url`, {
     method: 'POST',
-    headers: { 'Content-Type': 'application/json' },
+    headers: { 'Content-Type': 'application/json', ...authHeaders() },
     body: JSON.stringify({ style, image_url: imageUrl })
   })
   if (!resp.ok || !resp.body) {
@@ -120,6 +149,7 @@ export async function generateSoraImageFromImage({ prompt, file, model = "sora_i
 
   const resp = await fetch(`${API_BASE}/sora/image-to-image`, {
     method: 'POST',
+    headers: authHeaders(),
     body: form,
   });
   if (!resp.ok) {
@@ -127,10 +157,51 @@ export async function generateSoraImageFromImage({ prompt, file, model = "sora_i
     const msg = data.detail || await safeText(resp);
     throw new Error(`Sora 图生图失败: ${resp.status} ${msg}`);
   }
-  return resp.json();
+  return resolveSubmitted(await resp.json());
 }
 
+// 优先订阅服务端推送的任务状态（SSE，服务端统一轮询上游），不可用时退回客户端轮询
 export function pollSoraTask({ taskId, onProgress, onSuccess, onError }) {
+  if (typeof EventSource === 'undefined') {
+    return pollSoraTaskByInterval({ taskId, onProgress, onSuccess, onError });
+  }
+  const source = new EventSource(`${API_BASE}/sora/tasks/${taskId}/events`);
+  let received = false;
+  let fallback = null;
+  source.addEventListener('status', (e) => {
+    received = true;
+    const result = JSON.parse(e.data);
+    onProgress?.(result);
+    if (result.status === 'succeeded' || result.status === 'failed') {
+      source.close();
+      if (result.status === 'succeeded') {
+        onSuccess?.(result);
+      } else {
+        onError?.(result);
+      }
+    }
+  });
+  source.addEventListener('error', (e) => {
+    source.close();
+    if (e.data) {
+      // 服务端发送的错误事件（轮询失败或超时）
+      onError?.({ detail: e.data });
+    } else if (!received) {
+      // 连接失败（如旧版后端不支持推送），改为客户端轮询
+      fallback = pollSoraTaskByInterval({ taskId, onProgress, onSuccess, onError });
+    } else {
+      onError?.({ detail: '任务状态连接中断。' });
+    }
+  });
+  return {
+    cancel: () => {
+      source.close();
+      fallback?.cancel();
+    },
+  };
+}
+
+function pollSoraTaskByInterval({ taskId, onProgress, onSuccess, onError }) {
   const pollInterval = 3000;
   const maxAttempts = 60;
   let attempts = 0;
@@ -247,6 +318,7 @@ export async function submit3DTask(file, prompt) {
 
   const resp = await fetch(`${API_BASE}/3d-generation/submit`, {
     method: 'POST',
+    headers: authHeaders(),
     body: form,
   });
 
@@ -255,7 +327,7 @@ export async function submit3DTask(file, prompt) {
     const msg = data.detail || await safeText(resp);
     throw new Error(`3D任务提交失败: ${resp.status} ${msg}`);
   }
-  return resp.json();
+  return resolveSubmitted(await resp.json());
 }
 
 /**